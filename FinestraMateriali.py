@@ -1,42 +1,678 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, stream_with_context, g
 from flask_cors import CORS
-import pyodbc
+import os
+import sys
+import time
+import json
+import base64
+import logging
+import argparse
+from logging.handlers import RotatingFileHandler
+import sqlite3
+import zlib
+import hashlib
+import threading
 import traceback
+from collections import deque, OrderedDict, namedtuple
+from contextlib import contextmanager, ExitStack
+from functools import lru_cache
+from decimal import Decimal
+import datetime as _dt
 
 app = Flask(__name__)
 CORS(app)  # <-- Importante per CORS da frontend!
 
+CONN_STR = (
+    "DRIVER={ODBC Driver 17 for SQL Server};"
+    "SERVER=192.168.1.251;"
+    "DATABASE=ADB_TIME_DISPLAY;"
+    "UID=Alessandra;"
+    "PWD=alessandra;"
+    "TrustServerCertificate=yes;"
+)
+
+# ───────────────────────── Pool connessioni DB ─────────────────────────
+# Il login su SQL Server costa più della query: le connessioni restano aperte
+# e vengono riusate tra le richieste. Configurabile da variabili d'ambiente;
+# MATERIALI_DB_SQLITE=<file> usa un DB SQLite locale al posto di SQL Server
+# (stesse tabelle DORig/DOTes/CF), utile per prove senza la rete dell'ufficio.
+POOL_DIMENSIONE = int(os.environ.get("MATERIALI_POOL_SIZE", "8"))
+POOL_TIMEOUT_S = float(os.environ.get("MATERIALI_POOL_TIMEOUT_S", "10"))    # attesa max di una connessione libera
+POOL_IDLE_MAX_S = float(os.environ.get("MATERIALI_POOL_IDLE_S", "300"))     # chiudo le connessioni ferme da più di così
+POOL_VERIFICA_S = float(os.environ.get("MATERIALI_POOL_VERIFICA_S", "30"))  # SELECT 1 se ferma da più di così
+DB_SQLITE = os.environ.get("MATERIALI_DB_SQLITE", "").strip()
+QUERY_TIMEOUT_S = int(os.environ.get("MATERIALI_QUERY_TIMEOUT_S", "30"))   # 0 = nessun limite
+
+
+class PoolEsaurito(TimeoutError):
+    """Nessuna connessione libera entro il timeout."""
+
+
+class PoolConnessioni:
+    """
+    Pool limitato e thread-safe di connessioni DB-API (pyodbc, sqlite3, ...).
+    `factory()` apre una connessione nuova. Le connessioni rimaste ferme oltre
+    `verifica_s` vengono provate con `sql_verifica` prima di essere riconsegnate
+    (se rotte si riconnette), quelle ferme oltre `idle_max_s` vengono chiuse.
+    """
+
+    def __init__(self, factory, dimensione=POOL_DIMENSIONE, timeout=POOL_TIMEOUT_S,
+                 idle_max_s=POOL_IDLE_MAX_S, verifica_s=POOL_VERIFICA_S, sql_verifica="SELECT 1"):
+        self.factory = factory
+        self.dimensione = max(1, int(dimensione))
+        self.timeout = timeout
+        self.idle_max_s = idle_max_s
+        self.verifica_s = verifica_s
+        self.sql_verifica = sql_verifica
+        self._cond = threading.Condition()
+        self._libere = deque()  # (conn, ultimo_uso); a destra le più recenti
+        self._aperte = 0
+        self._stati = {}  # id(conn) -> dict legato alla vita della connessione (es. statement preparati)
+        self.contatori = {"checkout": 0, "attese": 0, "timeout": 0, "aperte_nuove": 0,
+                          "riconnessioni": 0, "scartate": 0, "chiuse_idle": 0}
+
+    def stato(self, conn):
+        """Dizionario privato della connessione, buttato quando la connessione viene chiusa."""
+        return self._stati.setdefault(id(conn), {})
+
+    def _chiudi(self, conn):
+        self._stati.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _sfoltisci(self, adesso):
+        """Chiude le connessioni libere ferme da troppo (chiamata con il lock preso)."""
+        vecchie = []
+        while self._libere and adesso - self._libere[0][1] > self.idle_max_s:
+            vecchie.append(self._libere.popleft()[0])
+        self._aperte -= len(vecchie)
+        self.contatori["chiuse_idle"] += len(vecchie)
+        return vecchie
+
+    def _valida(self, conn):
+        try:
+            cur = conn.cursor()
+            try:
+                cur.execute(self.sql_verifica)
+                cur.fetchall()
+            finally:
+                cur.close()
+            return True
+        except Exception:
+            return False
+
+    def acquisisci(self):
+        adesso = time.monotonic()
+        scadenza = adesso + self.timeout
+        with self._cond:
+            vecchie = self._sfoltisci(adesso)
+            self.contatori["checkout"] += 1
+            atteso = False
+            while not self._libere and self._aperte >= self.dimensione:
+                if not atteso:
+                    self.contatori["attese"] += 1
+                    atteso = True
+                resto = scadenza - time.monotonic()
+                if resto <= 0:
+                    self.contatori["timeout"] += 1
+                    raise PoolEsaurito(f"nessuna connessione libera entro {self.timeout}s")
+                self._cond.wait(resto)
+            if self._libere:
+                conn, ultimo_uso = self._libere.pop()
+            else:
+                conn, ultimo_uso = None, None
+                self._aperte += 1  # riservo il posto, la connessione la apro fuori dal lock
+        for v in vecchie:
+            self._chiudi(v)
+
+        try:
+            if conn is None:
+                conn = self.factory()
+                with self._cond:
+                    self.contatori["aperte_nuove"] += 1
+            elif time.monotonic() - ultimo_uso > self.verifica_s and not self._valida(conn):
+                self._chiudi(conn)
+                conn = self.factory()
+                with self._cond:
+                    self.contatori["riconnessioni"] += 1
+        except Exception:
+            with self._cond:
+                self._aperte -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def rilascia(self, conn, rotta=False):
+        """Riconsegna la connessione; `rotta=True` la chiude e libera il posto."""
+        if rotta:
+            self._chiudi(conn)
+        with self._cond:
+            if rotta:
+                self._aperte -= 1
+                self.contatori["scartate"] += 1
+            else:
+                self._libere.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connessione(self):
+        """
+        with pool.connessione() as conn: ...
+        Se il blocco solleva, la transazione viene annullata; se neanche il
+        rollback riesce la connessione è considerata rotta e viene scartata.
+        """
+        conn = self.acquisisci()
+        try:
+            yield conn
+        except BaseException:
+            try:
+                conn.rollback()
+                rotta = False
+            except Exception:
+                rotta = True
+            self.rilascia(conn, rotta=rotta)
+            raise
+        else:
+            self.rilascia(conn)
+
+    def chiudi_tutte(self):
+        with self._cond:
+            libere = [c for c, _ in self._libere]
+            self._libere.clear()
+            self._aperte -= len(libere)
+        for c in libere:
+            self._chiudi(c)
+
+    def metriche(self):
+        with self._cond:
+            return dict(self.contatori, dimensione=self.dimensione, aperte=self._aperte,
+                        libere=len(self._libere), in_uso=self._aperte - len(self._libere))
+
+
+def connetti_db():
+    """Apre una connessione al DB gestionale (o al SQLite locale se configurato)."""
+    if DB_SQLITE:
+        return sqlite3.connect(DB_SQLITE, check_same_thread=False)
+    import pyodbc  # solo qui: il resto del modulo (e il pool) si usa anche senza driver ODBC
+    # autocommit: niente transazioni lasciate aperte sulle connessioni parcheggiate nel pool
+    conn = pyodbc.connect(CONN_STR, timeout=5, autocommit=True)
+    conn.timeout = QUERY_TIMEOUT_S  # una query lenta non tiene occupato un thread all'infinito
+    return conn
+
+
+pool_db = PoolConnessioni(connetti_db)
+
+# ───────────────────────── Cache risultati ─────────────────────────
+# Le stesse combinazioni di filtri arrivano di continuo dal calendario: tengo in
+# memoria il JSON già serializzato per TTL secondi (i documenti nuovi compaiono
+# al più con questo ritardo, o subito dopo POST /api/materiali/cache/invalida).
+CACHE_TTL_S = float(os.environ.get("MATERIALI_CACHE_TTL_S", "60"))  # 0 = cache spenta
+CACHE_MAX_VOCI = int(os.environ.get("MATERIALI_CACHE_MAX_VOCI", "256"))
+CACHE_MAX_BYTES = int(os.environ.get("MATERIALI_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+
+def etag_di(dati):
+    """ETag di un corpo di risposta (hash del JSON serializzato)."""
+    return hashlib.blake2b(dati, digest_size=12).hexdigest()
+
+
+class CacheRisultati:
+    """
+    LRU thread-safe chiave -> bytes con scadenza. Evizione per numero di voci
+    e per byte totali; le voci scadute vengono scartate alla lettura.
+    Con l'ETag di ogni voce, calcolato una volta alla scrittura.
+    """
+
+    def __init__(self, ttl_s=CACHE_TTL_S, max_voci=CACHE_MAX_VOCI, max_bytes=CACHE_MAX_BYTES):
+        self.ttl_s = ttl_s
+        self.max_voci = max_voci
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._voci = OrderedDict()  # chiave -> (scadenza, dati, etag)
+        self._bytes = 0
+        self.contatori = {"hit": 0, "miss": 0, "scadute": 0, "evizioni": 0, "invalidazioni": 0}
+
+    def _togli(self, chiave):
+        dati = self._voci.pop(chiave)[1]
+        self._bytes -= len(dati)
+
+    def leggi(self, chiave):
+        return self.leggi_con_etag(chiave)[0]
+
+    def leggi_con_etag(self, chiave):
+        """(dati, etag) oppure (None, None)."""
+        with self._lock:
+            voce = self._voci.get(chiave)
+            if voce is not None and voce[0] <= time.monotonic():
+                self._togli(chiave)
+                self.contatori["scadute"] += 1
+                voce = None
+            if voce is None:
+                self.contatori["miss"] += 1
+                return None, None
+            self._voci.move_to_end(chiave)
+            self.contatori["hit"] += 1
+            return voce[1], voce[2]
+
+    def scrivi(self, chiave, dati, etag=None):
+        if self.ttl_s <= 0 or len(dati) > self.max_bytes:
+            return
+        etag = etag or etag_di(dati)
+        with self._lock:
+            if chiave in self._voci:
+                self._togli(chiave)
+            self._voci[chiave] = (time.monotonic() + self.ttl_s, dati, etag)
+            self._bytes += len(dati)
+            while self._voci and (len(self._voci) > self.max_voci or self._bytes > self.max_bytes):
+                self._togli(next(iter(self._voci)))
+                self.contatori["evizioni"] += 1
+
+    def invalida(self, filtro=None):
+        """Toglie le voci per cui filtro(chiave) è vero (tutte se filtro è None). Ritorna quante."""
+        with self._lock:
+            via = [k for k in self._voci if filtro is None or filtro(k)]
+            for k in via:
+                self._togli(k)
+            self.contatori["invalidazioni"] += len(via)
+            return len(via)
+
+    def metriche(self):
+        with self._lock:
+            return dict(self.contatori, voci=len(self._voci), bytes=self._bytes,
+                        ttl_s=self.ttl_s, max_voci=self.max_voci, max_bytes=self.max_bytes)
+
+
+cache_materiali = CacheRisultati()
+
+# ───────────────────────── Snapshot locale (SQLite) ─────────────────────────
+# Copia locale delle colonne di DORig/DOTes/CF usate da /api/materiali, tenuta
+# aggiornata da un job periodico (solo se attivato con MATERIALI_SYNC_S > 0, o a
+# mano con --sync / POST /api/materiali/snapshot/sync). MATERIALI_FONTE decide da
+# dove si legge:
+#   erp       (default) SQL Server, e se non risponde la copia locale
+#   snapshot  la copia locale (veloce, indicizzata), e SQL Server se la copia non c'è ancora
+SNAPSHOT_PATH = os.environ.get("MATERIALI_SNAPSHOT_PATH") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "data", "materiali_snapshot.sqlite")
+FONTE = os.environ.get("MATERIALI_FONTE", "erp").strip().lower()
+SYNC_S = float(os.environ.get("MATERIALI_SYNC_S", "0"))                 # 0 = niente sync periodico (default)
+SYNC_FINESTRA_GG = int(os.environ.get("MATERIALI_SYNC_FINESTRA_GG", "45"))  # documenti recenti riletti a ogni giro
+SYNC_COMPLETO_H = float(os.environ.get("MATERIALI_SYNC_COMPLETO_H", "24"))  # copia completa almeno ogni tot ore
+SYNC_BLOCCO = 5000
+ERP_PAUSA_S = 30  # dopo un errore dell'ERP leggo prima dalla copia locale per un po'
+
+SCHEMA_SNAPSHOT = """
+CREATE TABLE IF NOT EXISTS DOTes (
+    Id_DOTes   INTEGER PRIMARY KEY,
+    NumeroDoc,
+    DataDoc    DATAORA
+);
+CREATE TABLE IF NOT EXISTS DORig (
+    Id_DORig           INTEGER PRIMARY KEY,
+    Id_DOTes           INTEGER,
+    Cd_CF              TEXT COLLATE NOCASE,
+    Cd_AR              TEXT,
+    Descrizione        TEXT,
+    Qta                REAL,
+    PrezzoUnitarioV    REAL,
+    Cd_DOSottoCommessa TEXT COLLATE NOCASE,   -- come la collation case-insensitive di SQL Server
+    DataConsegna       DATAORA,
+    NoteRiga           TEXT
+);
+CREATE TABLE IF NOT EXISTS CF (
+    Cd_CF       TEXT PRIMARY KEY COLLATE NOCASE,
+    Descrizione TEXT
+);
+CREATE TABLE IF NOT EXISTS sync_meta (
+    chiave TEXT PRIMARY KEY,
+    valore TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_rig_sottocommessa ON DORig (Cd_DOSottoCommessa);
+CREATE INDEX IF NOT EXISTS ix_rig_cf ON DORig (Cd_CF);
+CREATE INDEX IF NOT EXISTS ix_rig_dotes ON DORig (Id_DOTes);
+CREATE INDEX IF NOT EXISTS ix_tes_data ON DOTes (DataDoc, NumeroDoc);
+"""
+
+COLONNE_SYNC = {
+    "DOTes": ("Id_DOTes", "NumeroDoc", "DataDoc"),
+    "DORig": ("Id_DORig", "Id_DOTes", "Cd_CF", "Cd_AR", "Descrizione", "Qta", "PrezzoUnitarioV",
+              "Cd_DOSottoCommessa", "DataConsegna", "NoteRiga"),
+    "CF": ("Cd_CF", "Descrizione"),
+}
+
+
+def _leggi_dataora(b):
+    testo = b.decode("utf-8")
+    try:
+        return _dt.datetime.fromisoformat(testo)
+    except ValueError:
+        return testo
+
+
+# date salvate come testo ISO, rilette come datetime: in uscita stesso formato dd-mm-yyyy dell'ERP
+sqlite3.register_converter("DATAORA", _leggi_dataora)
+sqlite3.register_adapter(_dt.datetime, lambda v: v.isoformat(" "))
+sqlite3.register_adapter(_dt.date, lambda v: v.isoformat())
+sqlite3.register_adapter(Decimal, float)
+
+
+def apri_snapshot(path=SNAPSHOT_PATH, scrittura=False):
+    if scrittura:
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        conn = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")  # le letture continuano durante la sync
+        conn.executescript(SCHEMA_SNAPSHOT)
+        return conn
+    uri = "file:" + path.replace("\\", "/") + "?mode=ro"
+    return sqlite3.connect(uri, uri=True, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+
+
+pool_snapshot = PoolConnessioni(apri_snapshot)
+_stato_snapshot = {"pronto": None}
+_lock_sync = threading.Lock()
+_erp_ko_fino = 0.0
+
+
+def _meta(conn):
+    return {r[0]: r[1] for r in conn.execute("SELECT chiave, valore FROM sync_meta")}
+
+
+def snapshot_pronto():
+    """True se la copia locale esiste ed è stata completata almeno una volta."""
+    if _stato_snapshot["pronto"] is None:
+        if not os.path.exists(SNAPSHOT_PATH):
+            return False
+        try:
+            conn = apri_snapshot()
+            try:
+                _stato_snapshot["pronto"] = "ultimo_completo" in _meta(conn)
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return False  # non memorizzo: il file può comparire con la prima sync
+    return _stato_snapshot["pronto"]
+
+
+def _come_dataora(v):
+    """DataDoc sempre datetime nella copia locale: i confronti con la finestra di sync sono tra datetime."""
+    if isinstance(v, str):
+        try:
+            v = _dt.datetime.fromisoformat(v)
+        except ValueError:
+            return v
+    if isinstance(v, _dt.date) and not isinstance(v, _dt.datetime):
+        v = _dt.datetime.combine(v, _dt.time())
+    return v
+
+
+def _copia(erp, snap, tabella, query, params=(), inserisci="INSERT OR REPLACE"):
+    """Copia il risultato di `query` (colonne in ordine COLONNE_SYNC) a blocchi. Ritorna le righe copiate."""
+    colonne = COLONNE_SYNC[tabella]
+    i_data = colonne.index("DataDoc") if "DataDoc" in colonne else None
+    sql = f"{inserisci} INTO {tabella} ({', '.join(colonne)}) VALUES ({', '.join('?' * len(colonne))})"
+    cursor = erp.cursor()
+    n = 0
+    try:
+        cursor.execute(query, list(params))
+        while True:
+            blocco = cursor.fetchmany(SYNC_BLOCCO)
+            if not blocco:
+                break
+            righe = [tuple(r) for r in blocco]
+            if i_data is not None:
+                righe = [r[:i_data] + (_come_dataora(r[i_data]),) + r[i_data + 1:] for r in righe]
+            snap.executemany(sql, righe)
+            n += len(blocco)
+    finally:
+        cursor.close()
+    return n
+
+
+def sincronizza_snapshot(completo=False, path=SNAPSHOT_PATH):
+    """
+    Aggiorna la copia locale dall'ERP in una sola transazione (chi legge vede la
+    versione prima o quella dopo). Incrementale: rilegge i documenti con
+    Id_DOTes nuovo o DataDoc da SYNC_FINESTRA_GG giorni prima dell'inizio
+    della sync precedente (un datetime, come DataDoc; righe cancellate comprese) e le righe con Id_DORig nuovo; i documenti della
+    finestra cancellati nell'ERP spariscono con le loro righe; CF sempre per
+    intero. Documenti vecchi modificati o cancellati li sistema la copia
+    completa, fatta la prima volta, con completo=True o se l'ultima ha più di
+    SYNC_COMPLETO_H ore.
+    Ritorna statistiche del giro; {"in_corso": True} se un'altra sync sta girando.
+    """
+    if not _lock_sync.acquire(blocking=False):
+        return {"in_corso": True}
+    try:
+        t0 = time.perf_counter()
+        inizio = time.time()  # high-water mark: quello che cambia durante la sync lo rilegge il giro dopo
+        snap = apri_snapshot(path, scrittura=True)
+        try:
+            meta = _meta(snap)
+            ultimo_completo = float(meta.get("ultimo_completo") or 0)
+            completo = completo or time.time() - ultimo_completo > SYNC_COMPLETO_H * 3600
+            stats = {"completo": completo}
+            rig_cols = ", ".join(f"rig.{c}" for c in COLONNE_SYNC["DORig"])
+            with pool_db.connessione() as erp, snap:
+                if completo:
+                    for tabella in ("DORig", "DOTes", "CF"):
+                        snap.execute(f"DELETE FROM {tabella}")
+                    stats["DOTes"] = _copia(erp, snap, "DOTes", "SELECT Id_DOTes, NumeroDoc, DataDoc FROM DOTes")
+                    stats["DORig"] = _copia(erp, snap, "DORig", f"SELECT {rig_cols} FROM DORig rig")
+                else:
+                    max_tes = snap.execute("SELECT COALESCE(MAX(Id_DOTes), 0) FROM DOTes").fetchone()[0]
+                    max_rig = snap.execute("SELECT COALESCE(MAX(Id_DORig), 0) FROM DORig").fetchone()[0]
+                    ultimo = min(float(meta.get("ultimo_sync") or inizio), inizio)
+                    dal = _dt.datetime.fromtimestamp(ultimo) - _dt.timedelta(days=SYNC_FINESTRA_GG)
+                    filtro_tes = "tes.Id_DOTes > ? OR tes.DataDoc >= ?"
+                    cursor = erp.cursor()
+                    try:
+                        cursor.execute(f"SELECT tes.Id_DOTes FROM DOTes tes WHERE {filtro_tes}", [max_tes, dal])
+                        ids = [r[0] for r in cursor.fetchall()]
+                    finally:
+                        cursor.close()
+                    # documenti della finestra non più riletti: cancellati nell'ERP (via, con le righe)
+                    # oppure con DataDoc spostata fuori finestra (restano, li aggiorna la copia completa)
+                    riletti = set(ids)
+                    spariti = [r[0] for r in snap.execute("SELECT Id_DOTes FROM DOTes WHERE DataDoc >= ?", [dal])
+                               if r[0] not in riletti]
+                    cancellati = []
+                    cursor = erp.cursor()
+                    try:
+                        for i in range(0, len(spariti), 500):
+                            parte = spariti[i:i + 500]
+                            cursor.execute(f"SELECT Id_DOTes FROM DOTes WHERE Id_DOTes IN "
+                                           f"({', '.join('?' * len(parte))})", parte)
+                            esistenti = {r[0] for r in cursor.fetchall()}
+                            cancellati += [i_tes for i_tes in parte if i_tes not in esistenti]
+                    finally:
+                        cursor.close()
+                    for i in range(0, len(cancellati), 500):
+                        parte = cancellati[i:i + 500]
+                        snap.execute(f"DELETE FROM DOTes WHERE Id_DOTes IN ({', '.join('?' * len(parte))})", parte)
+                    stats["DOTes_cancellati"] = len(cancellati)
+                    # righe dei documenti riletti o cancellati: via le vecchie, così spariscono anche quelle cancellate
+                    ids += cancellati
+                    for i in range(0, len(ids), 500):
+                        parte = ids[i:i + 500]
+                        snap.execute(f"DELETE FROM DORig WHERE Id_DOTes IN ({', '.join('?' * len(parte))})", parte)
+                    stats["DOTes"] = _copia(erp, snap, "DOTes",
+                                            f"SELECT tes.Id_DOTes, tes.NumeroDoc, tes.DataDoc FROM DOTes tes "
+                                            f"WHERE {filtro_tes}", [max_tes, dal])
+                    stats["DORig"] = _copia(erp, snap, "DORig",
+                                            f"SELECT {rig_cols} FROM DORig rig WHERE rig.Id_DORig > ? OR rig.Id_DOTes IN "
+                                            f"(SELECT tes.Id_DOTes FROM DOTes tes WHERE {filtro_tes})",
+                                            [max_rig, max_tes, dal])
+                snap.execute("DELETE FROM CF")
+                stats["CF"] = _copia(erp, snap, "CF", "SELECT Cd_CF, Descrizione FROM CF")
+                adesso = str(inizio)
+                snap.execute("INSERT OR REPLACE INTO sync_meta VALUES ('ultimo_sync', ?)", (adesso,))
+                if completo:
+                    snap.execute("INSERT OR REPLACE INTO sync_meta VALUES ('ultimo_completo', ?)", (adesso,))
+        finally:
+            snap.close()
+        _stato_snapshot["pronto"] = True
+        if FONTE == "snapshot":
+            cache_materiali.invalida()
+        stats["secondi"] = round(time.perf_counter() - t0, 3)
+        app.logger.info("Sync snapshot materiali: %s", stats)
+        return stats
+    finally:
+        _lock_sync.release()
+
+
+def avvia_sync_periodico(intervallo=SYNC_S):
+    """Thread in background che chiama sincronizza_snapshot() ogni `intervallo` secondi."""
+    def ciclo():
+        while True:
+            try:
+                sincronizza_snapshot()
+            except Exception:
+                app.logger.exception("Sync snapshot materiali fallita")
+            time.sleep(intervallo)
+    t = threading.Thread(target=ciclo, name="sync-snapshot", daemon=True)
+    t.start()
+    return t
+
+
+def fonti_lettura():
+    """[(nome, pool, dialetto)] nell'ordine in cui provarle, secondo FONTE e lo stato dell'ERP."""
+    erp = ("erp", pool_db, DIALETTO)
+    if not snapshot_pronto():
+        return [erp]
+    locale = ("snapshot", pool_snapshot, "sqlite")
+    if FONTE == "snapshot" or time.monotonic() < _erp_ko_fino:
+        return [locale, erp]
+    return [erp, locale]
+
+
+def esegui_lettura(lettura):
+    """
+    Chiama lettura(sessione) sulla prima fonte che risponde (vedi fonti_lettura).
+    Ritorna (risultato, nome fonte); se falliscono tutte rilancia l'ultimo errore.
+    """
+    global _erp_ko_fino
+    fonti = fonti_lettura()
+    for i, (nome, pool, dialetto) in enumerate(fonti):
+        try:
+            with pool.connessione() as conn:
+                sessione = Sessione(pool, conn, dialetto)
+                try:
+                    return lettura(sessione), nome
+                finally:
+                    sessione.chiudi()
+        except Exception:
+            if nome == "erp":
+                _erp_ko_fino = time.monotonic() + ERP_PAUSA_S
+            if i == len(fonti) - 1:
+                raise
+            app.logger.warning("Lettura da %s fallita, provo %s", nome, fonti[i + 1][0], exc_info=True)
+
 
 @app.errorhandler(Exception)
 def handle_exception(e):
-    print("### ERRORE GENERALE FLASK ###")
-    traceback.print_exc()
+    # in produzione stdout è scartato (server.js avvia con stdio 'ignore'): va nel log
+    app.logger.error("### ERRORE GENERALE FLASK ###\n%s", traceback.format_exc())
     return jsonify({"error": str(e)}), 500
 
-from decimal import Decimal
-import datetime as _dt
+# ───────────────────────── Log e latenze ─────────────────────────
+LOG_PATH = os.environ.get("MATERIALI_LOG_PATH") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "log_materiali.txt")
+LOG_LEVEL = os.environ.get("MATERIALI_LOG_LEVEL", "INFO").upper()
+LENTA_MS = float(os.environ.get("MATERIALI_LENTA_MS", "1000"))  # sopra questa soglia: WARNING
 
-@app.route('/api/materiali', methods=['GET'])
-def get_materiali():
-    sottocommessa = request.args.get("sottocommessa", "").strip()
-    tipo_cf = request.args.get("tipo_cf", "").strip().lower()  # "cliente" | "fornitore" | ""
-    qta_gt_0 = request.args.get("qta_gt_0", "").strip() in ("1", "true", "yes")
 
-    # Se nessun filtro, restituisco lista vuota (comportamento attuale)
-    if not (sottocommessa or tipo_cf or qta_gt_0):
-        return jsonify([])
+def configura_log(path=LOG_PATH, level=LOG_LEVEL):
+    """Log su file con rotazione (chiamata solo dall'avvio del server, non all'import)."""
+    handler = RotatingFileHandler(path, maxBytes=1_000_000, backupCount=3, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("[%(asctime)s] %(levelname)s %(message)s", "%Y-%m-%d %H:%M:%S"))
+    from flask.logging import default_handler
+    app.logger.removeHandler(default_handler)
+    app.logger.addHandler(handler)
+    app.logger.setLevel(getattr(logging, level, logging.INFO))
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)  # accessi già loggati con la latenza
 
-    conn_str = (
-        "DRIVER={ODBC Driver 17 for SQL Server};"
-        "SERVER=192.168.1.251;"
-        "DATABASE=ADB_TIME_DISPLAY;"
-        "UID=Alessandra;"
-        "PWD=alessandra;"
-        "TrustServerCertificate=yes;"
-    )
-
-    query = """
-    SELECT
+
+@app.before_request
+def _inizio_richiesta():
+    g.t0 = time.perf_counter()
+
+
+@app.after_request
+def _fine_richiesta(resp):
+    """Latenza per richiesta nel log e nell'header Server-Timing (per lo stream: fino al primo byte)."""
+    t0 = g.pop("t0", None)
+    if t0 is None:
+        return resp
+    ms = (time.perf_counter() - t0) * 1000
+    resp.headers["Server-Timing"] = f"app;dur={ms:.1f}"
+    livello = logging.WARNING if ms >= LENTA_MS else logging.INFO
+    app.logger.log(livello, "%s %s %s %.1fms cache=%s", request.method, request.full_path.rstrip("?"),
+                   resp.status_code, ms, resp.headers.get("X-Cache", "-"))
+    return resp
+
+
+DIALETTO = "sqlite" if DB_SQLITE else "mssql"
+LIMITE_MAX = 5000     # righe max per pagina
+STREAM_BLOCCO = 500   # righe per fetchmany in modalità stream
+BATCH_MAX = 1000      # sottocommesse max per richiesta batch
+BATCH_BLOCCO_IN = 500 # valori per IN (...): SQL Server accetta al massimo 2100 parametri
+
+# Ordinamento della lista; Id_DORig fa da spareggio così la paginazione a chiave
+# (keyset) è stabile anche con più righe sullo stesso documento.
+ORDINE = (("tes.DataDoc", "_DataDoc"), ("tes.NumeroDoc", "_NumeroDoc"), ("rig.Id_DORig", "_IdRiga"))
+
+
+class CursoreNonValido(ValueError):
+    pass
+
+
+def _codifica_cursore(valori):
+    """Valori di ordinamento dell'ultima riga -> stringa opaca url-safe."""
+    out = []
+    for v in valori:
+        if isinstance(v, _dt.datetime):
+            out.append({"dt": v.isoformat()})
+        elif isinstance(v, _dt.date):
+            out.append({"d": v.isoformat()})
+        elif isinstance(v, Decimal):
+            out.append({"dec": str(v)})
+        else:
+            out.append(v)
+    return base64.urlsafe_b64encode(json.dumps(out).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decodifica_cursore(testo):
+    try:
+        valori = json.loads(base64.urlsafe_b64decode(testo + "=" * (-len(testo) % 4)))
+        if not isinstance(valori, list) or len(valori) != len(ORDINE):
+            raise ValueError
+        out = []
+        for v in valori:
+            if isinstance(v, dict):
+                if "dt" in v:
+                    v = _dt.datetime.fromisoformat(v["dt"])
+                elif "d" in v:
+                    v = _dt.date.fromisoformat(v["d"])
+                else:
+                    v = Decimal(v["dec"])
+            out.append(v)
+        return out
+    except Exception:
+        raise CursoreNonValido("cursore 'dopo' non valido")
+
+
+# ───────────────────────── Query layer ─────────────────────────
+# Ogni richiesta si riduce a una "forma": quali filtri sono attivi, quali valori
+# del cursore di paginazione sono NULL e quante sottocommesse ci sono nell'IN
+# (arrotondate a poche taglie fisse). L'SQL di una forma è generato una volta
+# sola e i valori viaggiano sempre come parametri: sul server le varianti sono
+# poche e stabili (piani in cache) e su ogni connessione del pool lo statement
+# resta preparato (vedi Sessione). I tempi sono raccolti per forma.
+SELECT_MATERIALI = """
+    SELECT{top}
         tes.NumeroDoc,
         tes.DataDoc,
         rig.Cd_CF,
@@ -47,51 +683,710 @@ def get_materiali():
         rig.PrezzoUnitarioV,
         rig.Cd_DOSottoCommessa,
         rig.DataConsegna,
-        rig.NoteRiga
+        rig.NoteRiga,
+        {ordine}
     FROM DORig rig
     LEFT JOIN DOTes tes ON rig.Id_DOTes = tes.Id_DOTes
     LEFT JOIN CF cli ON rig.Cd_CF = cli.Cd_CF
-    WHERE 1=1
+    WHERE 1=1"""
+
+# filtri semplici, in ordine fisso (è anche l'ordine dei parametri)
+FILTRI = (
+    ("sottocommessa", "rig.Cd_DOSottoCommessa = ?"),
+    ("tipo_cf", "rig.Cd_CF >= ? AND rig.Cd_CF < ?"),  # range sul prefisso invece di LIKE 'C%': sfrutta l'indice
+    ("qta_gt_0", "rig.Qta > 0"),
+    ("dal", "tes.DataDoc >= ?"),
+    ("al", "tes.DataDoc < ?"),                        # giorno dopo `al`, così vale anche con l'ora
+    ("cd_ar", "rig.Cd_AR = ?"),
+)
+_SQL_FILTRI = dict(FILTRI)
+TAGLIE_IN = (1, 5, 20, 100, BATCH_BLOCCO_IN)  # IN riempito ripetendo l'ultimo codice fino alla taglia
+PREPARATI_MAX = 32  # statement tenuti preparati per connessione
+
+Query = namedtuple("Query", "forma sql params")
+
+
+def _parametri_filtro(nome, valore):
+    if nome == "tipo_cf":
+        return ["C", "D"] if valore == "cliente" else ["F", "G"]
+    if nome == "qta_gt_0":
+        return []
+    if nome == "al":
+        return [valore + _dt.timedelta(days=1)]
+    return [valore]
+
+
+def _condizione_dopo(maschera):
+    """
+    WHERE per le righe che seguono il cursore nell'ordine DESC di ORDINE
+    ('v' valore presente, 'n' NULL per ogni colonna). In DESC i NULL vanno in
+    fondo (sia SQL Server che SQLite), quindi "dopo v" è `col < v OR col IS NULL`
+    e dopo un NULL non c'è niente.
     """
+    cond = None
+    for (col, _), m in reversed(list(zip(ORDINE, maschera))):
+        dopo = f"({col} < ? OR {col} IS NULL)" if m == "v" else None
+        uguale = f"{col} = ?" if m == "v" else f"{col} IS NULL"
+        if cond is not None:
+            annidata = f"({uguale} AND {cond})"
+            cond = f"({dopo} OR {annidata})" if dopo else annidata
+        else:
+            cond = dopo
+    return cond or "1=0"
+
+
+def _parametri_dopo(valori):
+    """Parametri di _condizione_dopo nello stesso ordine: per colonna "<" e poi "=" (l'ultima solo "<")."""
     params = []
+    for i, v in enumerate(valori):
+        if v is not None:
+            params += [v] if i == len(valori) - 1 else [v, v]
+    return params
 
-    if sottocommessa:
-        query += " AND rig.Cd_DOSottoCommessa = ?"
-        params.append(sottocommessa)
 
-    if tipo_cf in ("cliente", "fornitore"):
-        query += " AND rig.Cd_CF LIKE ?"
-        params.append("C%" if tipo_cf == "cliente" else "F%")
+@lru_cache(maxsize=256)
+def _sql_forma(parti, dialetto):
+    """SQL di una forma (tupla di parti come prodotta da prepara_query)."""
+    limite = "limite" in parti
+    sql = SELECT_MATERIALI.format(top=" TOP (?)" if limite and dialetto == "mssql" else "",
+                                  ordine=", ".join(f"{col} AS {alias}" for col, alias in ORDINE))
+    for parte in parti:
+        if parte.startswith("in"):
+            sql += f" AND rig.Cd_DOSottoCommessa IN ({', '.join('?' * int(parte[2:]))})"
+        elif parte.startswith("dopo_"):
+            sql += f" AND {_condizione_dopo(parte[5:])}"
+        elif parte != "limite":
+            sql += f" AND {_SQL_FILTRI[parte]}"
+    sql += " ORDER BY " + ", ".join(f"{col} DESC" for col, _ in ORDINE)
+    if limite and dialetto == "sqlite":
+        sql += " LIMIT ?"
+    return sql
 
-    if qta_gt_0:
-        query += " AND rig.Qta > 0"
 
-    query += " ORDER BY tes.DataDoc DESC, tes.NumeroDoc DESC"
+def prepara_query(filtri, dialetto=DIALETTO):
+    """
+    filtri: dict con sottocommessa (str, o lista per l'IN del batch), tipo_cf
+    ("cliente"/"fornitore"), qta_gt_0, dal/al (date), cd_ar, dopo (valori del
+    cursore), limite. Ritorna Query(forma, sql, params).
+    """
+    parti, params = [], []
+    limite = filtri.get("limite")
+    if limite and dialetto == "mssql":
+        params.append(int(limite))
+    sottocommessa = filtri.get("sottocommessa")
+    if isinstance(sottocommessa, (list, tuple)):
+        taglia = next(t for t in TAGLIE_IN if t >= len(sottocommessa))
+        parti.append(f"in{taglia}")
+        params += list(sottocommessa) + [sottocommessa[-1]] * (taglia - len(sottocommessa))
+    for nome, _ in FILTRI:
+        valore = filtri.get(nome)
+        if not valore or (nome == "sottocommessa" and isinstance(valore, (list, tuple))):
+            continue
+        if nome == "tipo_cf" and valore not in ("cliente", "fornitore"):
+            continue
+        parti.append(nome)
+        params += _parametri_filtro(nome, valore)
+    dopo = filtri.get("dopo")
+    if dopo is not None:
+        parti.append("dopo_" + "".join("n" if v is None else "v" for v in dopo))
+        params += _parametri_dopo(dopo)
+    if limite:
+        parti.append("limite")
+        if dialetto == "sqlite":
+            params.append(int(limite))
+    parti = tuple(parti)
+    return Query(f"{'+'.join(parti) or 'tutto'}|{dialetto}", _sql_forma(parti, dialetto), params)
+
+
+class TempiForme:
+    """Esecuzioni e tempi (execute + fetch) per forma di query, per scovare quelle lente."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._forme = {}  # forma -> [esecuzioni, totale_ms, max_ms, righe]
+
+    def registra(self, forma, ms, righe):
+        with self._lock:
+            v = self._forme.setdefault(forma, [0, 0.0, 0.0, 0])
+            v[0] += 1
+            v[1] += ms
+            v[2] = max(v[2], ms)
+            v[3] += righe
+        livello = logging.WARNING if ms >= LENTA_MS else logging.DEBUG
+        app.logger.log(livello, "query forma=%s %.1fms righe=%s", forma, ms, righe)
+
+    def metriche(self):
+        with self._lock:
+            out = [{"forma": f, "esecuzioni": n, "totale_ms": round(tot, 1), "media_ms": round(tot / n, 1),
+                    "max_ms": round(mx, 1), "righe": r} for f, (n, tot, mx, r) in self._forme.items()]
+        return sorted(out, key=lambda d: d["totale_ms"], reverse=True)
+
+
+tempi_forme = TempiForme()
+
+
+class Sessione:
+    """
+    Connessione presa dal pool per una lettura. Esegue le Query su un cursore
+    riservato a quel testo SQL e tenuto tra una richiesta e l'altra: rieseguendo
+    lo stesso testo pyodbc salta la SQLPrepare (sqlite3 ha già la sua cache di
+    statement). I cursori lasciati con risultati pendenti vengono chiusi, perché
+    senza MARS bloccherebbero la connessione.
+    """
+
+    def __init__(self, pool, conn, dialetto):
+        self.pool = pool
+        self.conn = conn
+        self.dialetto = dialetto
+        self._pendenti = set()
+
+    def query(self, filtri):
+        return prepara_query(filtri, self.dialetto)
+
+    def _cursore(self, sql):
+        preparati = self.pool.stato(self.conn).setdefault("preparati", OrderedDict())
+        cursor = preparati.get(sql)
+        if cursor is None:
+            cursor = preparati[sql] = self.conn.cursor()
+            if len(preparati) > PREPARATI_MAX:
+                preparati.popitem(last=False)[1].close()
+        else:
+            preparati.move_to_end(sql)
+        return cursor
+
+    def _scarta(self, sql):
+        cursor = self.pool.stato(self.conn).get("preparati", {}).pop(sql, None)
+        if cursor is not None:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+
+    def righe(self, q, quante=None):
+        """Esegue q e ritorna (righe, description); al massimo `quante` righe se indicato."""
+        t0 = time.perf_counter()
+        cursor = self._cursore(q.sql)
+        self._pendenti.add(q.sql)
+        cursor.execute(q.sql, q.params)
+        if quante:
+            righe = cursor.fetchmany(quante)
+            cursor.fetchall()  # con TOP/LIMIT non resta niente: chiude il risultato
+        else:
+            righe = cursor.fetchall()
+        self._pendenti.discard(q.sql)
+        tempi_forme.registra(q.forma, (time.perf_counter() - t0) * 1000, len(righe))
+        return righe, cursor.description
+
+    def scorri(self, q, blocco):
+        """Generatore: (primo blocco di righe, description) e poi i blocchi successivi."""
+        t0 = time.perf_counter()
+        cursor = self._cursore(q.sql)
+        self._pendenti.add(q.sql)
+        cursor.execute(q.sql, q.params)
+        n = 0
+        righe = cursor.fetchmany(blocco)
+        yield righe, cursor.description
+        while righe:
+            n += len(righe)
+            righe = cursor.fetchmany(blocco)
+            if righe:
+                yield righe, None
+        self._pendenti.discard(q.sql)
+        tempi_forme.registra(q.forma, (time.perf_counter() - t0) * 1000, n)
+
+    def chiudi(self):
+        for sql in list(self._pendenti):
+            self._scarta(sql)
+        self._pendenti.clear()
+
+
+def _data_breve():
+    """Formattatore dd-mm-yyyy con memo: in un risultato le date distinte sono poche."""
+    memo = {}
+
+    def formatta(v):
+        testo = memo.get(v)
+        if testo is None:
+            testo = memo[v] = v.strftime('%d-%m-%Y')
+        return testo
+    return formatta
+
+
+def _converti_generico(v):
+    """Per colonne di tipo sconosciuto (es. SQLite con solo NULL nel campione)."""
+    if isinstance(v, ( _dt.date, _dt.datetime )):
+        return v.strftime('%d-%m-%Y')
+    if isinstance(v, Decimal):
+        return float(v)
+    return v
+
+
+def _convertitore_per(tipo, nome):
+    """Funzione di conversione per una colonna di quel tipo, None se il valore va bene così."""
+    if tipo is None:
+        return str if nome == "NoteRiga" else _converti_generico
+    if issubclass(tipo, _dt.date):  # anche datetime
+        return _data_breve()
+    if issubclass(tipo, Decimal):
+        return float
+    if nome == "NoteRiga" and not issubclass(tipo, str):
+        return str  # testo libero sempre stringa se presente
+    return None
+
 
-    risultati = []
+class ConvertitoreRighe:
+    """
+    Righe del cursore -> valori JSON-friendly (date dd-mm-yyyy, Decimal -> float).
+    La conversione si sceglie una volta per colonna dal tipo in cursor.description
+    (pyodbc); sqlite3 non dà i tipi, quindi si guarda il primo valore non nullo di
+    `campione`. Le ultime `escludi_coda` colonne (quelle di ORDINE) non escono.
+    """
+
+    def __init__(self, description, campione=(), escludi_coda=0):
+        desc = description[:len(description) - escludi_coda]
+        self.colonne = [c[0] for c in desc]
+        self.n = len(desc)
+        self._conv = []
+        for i, c in enumerate(desc):
+            tipo = c[1] if isinstance(c[1], type) else None
+            if tipo is None:
+                tipo = next((type(r[i]) for r in campione if r[i] is not None), None)
+            f = _convertitore_per(tipo, self.colonne[i])
+            if f is not None:
+                self._conv.append((i, f))
+
+    def valori(self, row):
+        vals = list(row[:self.n])
+        for i, f in self._conv:
+            v = vals[i]
+            if v is not None:
+                vals[i] = f(v)
+        return vals
+
+    def dict(self, row):
+        return dict(zip(self.colonne, self.valori(row)))
+
+
+def leggi_filtri(sorgente):
+    """
+    Filtri di /api/materiali dalla query string o dal corpo JSON, normalizzati.
+    Ritorna (filtri, None) oppure (None, messaggio di errore).
+    """
+    def testo(nome):
+        return str(sorgente.get(nome) or "").strip()
+
+    filtri = {
+        "sottocommessa": testo("sottocommessa"),
+        "tipo_cf": testo("tipo_cf").lower(),  # "cliente" | "fornitore" | ""
+        "qta_gt_0": sorgente.get("qta_gt_0") is True or testo("qta_gt_0").lower() in ("1", "true", "yes"),
+        "cd_ar": testo("cd_ar"),
+    }
+    for nome in ("dal", "al"):
+        try:
+            filtri[nome] = _dt.date.fromisoformat(testo(nome)) if testo(nome) else None
+        except ValueError:
+            return None, f"{nome} non valido (atteso yyyy-mm-dd)"
+    return filtri, None
+
+
+def chiave_cache(filtri):
+    """(sottocommessa, tipo_cf, qta_gt_0) più gli eventuali filtri aggiuntivi."""
+    # tipo_cf diverso da cliente/fornitore non filtra, come nella query
+    tipo_cf = filtri["tipo_cf"] if filtri["tipo_cf"] in ("cliente", "fornitore") else ""
+    # sottocommessa casefold: nel DB il filtro è case-insensitive, C4924-01 e c4924-01 sono lo stesso risultato
+    chiave = (filtri["sottocommessa"].casefold(), tipo_cf, filtri["qta_gt_0"])
+    extra = tuple((n, str(filtri[n])) for n in ("dal", "al", "cd_ar") if filtri.get(n))
+    return chiave + (extra,) if extra else chiave
+
+
+def _apri_stream(filtri):
+    """
+    Prende la connessione ed esegue la query prima che parta la risposta, così
+    PoolEsaurito e gli errori DB arrivano al chiamante (503/500) invece che a
+    stream già iniziato. Usa la prima fonte di fonti_lettura(): a stream
+    iniziato non si può ripiegare su un'altra.
+    Ritorna (primo blocco, description, altri blocchi, chiudi); `chiudi`
+    riconsegna la connessione al pool e va chiamata a risposta finita.
+    """
+    pila = ExitStack()
     try:
-        with pyodbc.connect(conn_str, timeout=5) as conn:
-            with conn.cursor() as cursor:
-                cursor.execute(query, params)
-                columns = [c[0] for c in cursor.description]
-                for row in cursor.fetchall():
-                    d = {}
-                    for col, val in zip(columns, row):
-                        if isinstance(val, ( _dt.date, _dt.datetime )):
-                            d[col] = val.strftime('%d-%m-%Y')
-                        elif isinstance(val, Decimal):
-                            d[col] = float(val)
-                        else:
-                            d[col] = val
-                    # Testo libero (NoteRiga) sempre stringa se presente
-                    if d.get("NoteRiga") is not None:
-                        d["NoteRiga"] = str(d["NoteRiga"])
-                    risultati.append(d)
+        _, pool, dialetto = fonti_lettura()[0]
+        conn = pila.enter_context(pool.connessione())
+        sessione = Sessione(pool, conn, dialetto)
+        pila.callback(sessione.chiudi)
+        blocchi = sessione.scorri(sessione.query(filtri), STREAM_BLOCCO)
+        primo, description = next(blocchi)
+    except BaseException:
+        pila.__exit__(*sys.exc_info())  # rollback/scarto come in pool.connessione()
+        raise
+    return primo, description, blocchi, pila.close
+
+
+def _stream_json(primo, description, blocchi, colonnare=False):
+    """Genera il JSON riga per riga (fetchmany): memoria costante qualunque sia il risultato."""
+    conv = ConvertitoreRighe(description, primo, escludi_coda=len(ORDINE))
+    if colonnare:
+        yield '{"columns":' + app.json.dumps(conv.colonne) + ',"rows":['
+        formatta = conv.valori
+    else:
+        yield "["
+        formatta = conv.dict
+    try:
+        iniziato = False
+        blocco = primo
+        while blocco:
+            for row in blocco:
+                testo = app.json.dumps(formatta(row))
+                yield "," + testo if iniziato else testo
+                iniziato = True
+            blocco = next(blocchi, (None, None))[0]
+        yield "]}" if colonnare else "]"
+    except Exception:
+        # lo status è già partito: chiudo senza "]" così il client vede un JSON troncato
+        app.logger.exception("Errore DB in /api/materiali (stream)")
+
+
+@app.route('/api/materiali', methods=['GET'])
+def get_materiali():
+    """
+    Lista righe documento filtrate. Senza parametri extra ritorna l'array completo.
+      ?limite=N[&dopo=CURSORE]  pagina a chiave: {"righe": [...], "prossimo": CURSORE|null}
+      ?stream=1                 array completo scritto a blocchi, senza tenerlo in memoria
+      ?formato=colonne          {"columns": [...], "rows": [[...], ...]} invece di un dict per riga
+                                (combinabile con le due sopra)
+    Filtri: sottocommessa, tipo_cf, qta_gt_0, dal/al (yyyy-mm-dd su DataDoc), cd_ar.
+    """
+    filtri, errore = leggi_filtri(request.args)
+    if errore:
+        return jsonify({"error": errore}), 400
+
+    # Se nessun filtro, restituisco lista vuota (comportamento attuale)
+    if not any(filtri.values()):
+        return jsonify([])
+
+    try:
+        limite = int(request.args.get("limite") or 0)
+    except ValueError:
+        return jsonify({"error": "limite non valido"}), 400
+    limite = min(max(limite, 0), LIMITE_MAX)
+    dopo_testo = request.args.get("dopo", "").strip()
+    try:
+        dopo = _decodifica_cursore(dopo_testo) if dopo_testo else None
+    except CursoreNonValido as e:
+        return jsonify({"error": str(e)}), 400
+
+    colonnare = request.args.get("formato", "").strip().lower() == "colonne"
+
+    if request.args.get("stream", "").strip() in ("1", "true", "yes") and not limite:
+        try:
+            primo, description, blocchi, chiudi = _apri_stream(dict(filtri, dopo=dopo))
+        except PoolEsaurito:
+            app.logger.warning("Pool DB esaurito in /api/materiali (stream)")
+            return jsonify({"error": "Database occupato, riprovare"}), 503
+        except Exception:
+            app.logger.exception("Errore DB in /api/materiali (stream)")
+            return jsonify({"error": "Errore di accesso al database"}), 500
+        resp = app.response_class(stream_with_context(_stream_json(primo, description, blocchi, colonnare)),
+                                  mimetype="application/json")
+        resp.call_on_close(chiudi)
+        return resp
+
+    chiave = chiave_cache(filtri)
+    if limite:
+        chiave += (limite, dopo_testo)
+    if colonnare:
+        chiave += ("colonne",)
+    dati, etag = cache_materiali.leggi_con_etag(chiave)
+    if dati is not None:
+        resp = app.response_class(dati, mimetype="application/json")
+        resp.set_etag(etag, weak=True)
+        resp.headers["X-Cache"] = "HIT"
+        return resp
+
+    n_ord = len(ORDINE)
+
+    def lettura(sessione):
+        # una riga in più per sapere se esiste la pagina successiva
+        q = sessione.query(dict(filtri, dopo=dopo, limite=limite + 1 if limite else None))
+        righe, description = sessione.righe(q, limite + 1 if limite else None)
+        prossimo = None
+        if limite and len(righe) > limite:
+            righe = righe[:limite]
+            prossimo = _codifica_cursore(righe[-1][-n_ord:])
+        conv = ConvertitoreRighe(description, righe[:STREAM_BLOCCO], escludi_coda=n_ord)
+        formatta = conv.valori if colonnare else conv.dict
+        return [formatta(row) for row in righe], prossimo, conv.colonne
+
+    try:
+        (risultati, prossimo, colonne), fonte = esegui_lettura(lettura)
+    except PoolEsaurito:
+        app.logger.warning("Pool DB esaurito in /api/materiali")
+        return jsonify({"error": "Database occupato, riprovare"}), 503
     except Exception:
         app.logger.exception("Errore DB in /api/materiali")
         return jsonify({"error": "Errore di accesso al database"}), 500
 
-    return jsonify(risultati)
+    if colonnare:
+        risultati = {"columns": colonne, "rows": risultati}
+        if limite:
+            risultati["prossimo"] = prossimo
+    elif limite:
+        risultati = {"righe": risultati, "prossimo": prossimo}
+    resp = jsonify(risultati)
+    etag = etag_di(resp.get_data())
+    cache_materiali.scrivi(chiave, resp.get_data(), etag)
+    resp.set_etag(etag, weak=True)
+    resp.headers["X-Cache"] = "MISS"
+    resp.headers["X-Fonte"] = fonte
+    return resp
+
+@app.route('/api/materiali/batch', methods=['POST'])
+def post_materiali_batch():
+    """
+    Più sottocommesse in una sola richiesta:
+      {"sottocommesse": ["C4924-01", ...], "tipo_cf": "fornitore", "qta_gt_0": true}
+    (accetta anche dal/al/cd_ar come GET /api/materiali). Risposta: {"C4924-01": [righe come /api/materiali], ...}, una chiave per
+    ogni sottocommessa richiesta (lista vuota se non ha righe).
+    Le sottocommesse già in cache non vanno al DB; le altre con una query IN.
+    """
+    body = request.get_json(silent=True) or {}
+    elenco = body.get("sottocommesse")
+    if not isinstance(elenco, list):
+        return jsonify({"error": "sottocommesse deve essere una lista"}), 400
+    sottocommesse = list(dict.fromkeys(str(s).strip() for s in elenco if str(s).strip()))
+    if len(sottocommesse) > BATCH_MAX:
+        return jsonify({"error": f"massimo {BATCH_MAX} sottocommesse per richiesta"}), 400
+    filtri, errore = leggi_filtri(dict(body, sottocommessa=""))
+    if errore:
+        return jsonify({"error": errore}), 400
+
+    # ogni sottocommessa usa la stessa voce di cache di GET /api/materiali
+    parti = {}
+    mancanti = []
+    for s in sottocommesse:
+        dati = cache_materiali.leggi(chiave_cache(dict(filtri, sottocommessa=s)))
+        if dati is not None:
+            parti[s] = dati
+        else:
+            mancanti.append(s)
+
+    if mancanti:
+        n_ord = len(ORDINE)
+
+        def lettura(sessione):
+            # per codice casefold, come la collation case-insensitive del DB
+            gruppi = {s.casefold(): [] for s in mancanti}
+            for i in range(0, len(mancanti), BATCH_BLOCCO_IN):
+                q = sessione.query(dict(filtri, sottocommessa=mancanti[i:i + BATCH_BLOCCO_IN]))
+                righe, description = sessione.righe(q)
+                conv = ConvertitoreRighe(description, righe[:STREAM_BLOCCO], escludi_coda=n_ord)
+                for row in righe:
+                    d = conv.dict(row)
+                    gruppo = gruppi.get(str(d.get("Cd_DOSottoCommessa")).casefold())
+                    if gruppo is not None:
+                        gruppo.append(d)
+            return gruppi
+
+        try:
+            gruppi, _ = esegui_lettura(lettura)
+        except PoolEsaurito:
+            app.logger.warning("Pool DB esaurito in /api/materiali/batch")
+            return jsonify({"error": "Database occupato, riprovare"}), 503
+        except Exception:
+            app.logger.exception("Errore DB in /api/materiali/batch")
+            return jsonify({"error": "Errore di accesso al database"}), 500
+        for codice, righe in gruppi.items():
+            dati = app.json.dumps(righe).encode("utf-8")
+            cache_materiali.scrivi(chiave_cache(dict(filtri, sottocommessa=codice)), dati)
+            for s in mancanti:
+                if s.casefold() == codice:
+                    parti[s] = dati
+
+    # compongo l'oggetto dai frammenti JSON già pronti (quelli in cache non li rileggo)
+    corpo = b"{" + b",".join(json.dumps(s).encode("utf-8") + b":" + parti[s] for s in sottocommesse) + b"}"
+    resp = app.response_class(corpo, mimetype="application/json")
+    resp.headers["X-Cache-Hit"] = str(len(sottocommesse) - len(mancanti))
+    resp.headers["X-Cache-Miss"] = str(len(mancanti))
+    return resp
+
+@app.route('/api/materiali/cache', methods=['GET'])
+def get_cache_metriche():
+    return jsonify(dict(cache_materiali.metriche(), compressi=compressi.metriche()))
+
+@app.route('/api/materiali/cache/invalida', methods=['POST'])
+def invalida_cache():
+    """Senza parametri svuota tutto; con ?sottocommessa=... solo le voci di quella sottocommessa."""
+    sottocommessa = (request.args.get("sottocommessa")
+                     or (request.get_json(silent=True) or {}).get("sottocommessa") or "").strip()
+    if sottocommessa:
+        n = cache_materiali.invalida(lambda k: k[0] == sottocommessa.casefold())
+    else:
+        n = cache_materiali.invalida()
+    return jsonify({"invalidate": n})
+
+@app.route('/api/materiali/pool', methods=['GET'])
+def get_pool_metriche():
+    return jsonify(pool_db.metriche())
+
+@app.route('/api/materiali/query', methods=['GET'])
+def get_query_metriche():
+    """Tempi per forma di query, dalla più costosa in totale."""
+    return jsonify(tempi_forme.metriche())
+
+@app.route('/api/materiali/snapshot', methods=['GET'])
+def get_snapshot_stato():
+    stato = {"fonte": FONTE, "pronto": snapshot_pronto(), "path": SNAPSHOT_PATH,
+             "sync_in_corso": _lock_sync.locked()}
+    if stato["pronto"]:
+        conn = apri_snapshot()
+        try:
+            meta = _meta(conn)
+            for k in ("ultimo_sync", "ultimo_completo"):
+                if meta.get(k):
+                    stato[k] = _dt.datetime.fromtimestamp(float(meta[k])).isoformat(timespec="seconds")
+            for tabella in COLONNE_SYNC:
+                stato[tabella] = conn.execute(f"SELECT COUNT(*) FROM {tabella}").fetchone()[0]
+        finally:
+            conn.close()
+    return jsonify(stato)
+
+@app.route('/api/materiali/snapshot/sync', methods=['POST'])
+def post_snapshot_sync():
+    """Sync immediata (?completo=1 per la copia completa); 409 se ce n'è già una in corso."""
+    completo = request.args.get("completo", "").strip() in ("1", "true", "yes")
+    try:
+        stats = sincronizza_snapshot(completo=completo)
+    except Exception:
+        app.logger.exception("Sync snapshot materiali fallita")
+        return jsonify({"error": "Sync non riuscita"}), 502
+    if stats.get("in_corso"):
+        return jsonify({"error": "Sync già in corso"}), 409
+    return jsonify(stats)
+
+# ───────────────────────── ETag e compressione ─────────────────────────
+# Il polling del calendario ripete le stesse richieste: con If-None-Match uguale
+# all'ETag rispondo 304 senza corpo; i JSON grandi escono compressi (gzip o
+# deflate), riusando la versione compressa finché l'ETag non cambia.
+COMPRIMI_MIN_BYTES = int(os.environ.get("MATERIALI_GZIP_MIN_BYTES", "1024"))
+COMPRIMI_LIVELLO = int(os.environ.get("MATERIALI_GZIP_LIVELLO", "6"))
+_WBITS = {"gzip": 31, "deflate": 15}  # 31 = header gzip, 15 = formato zlib (Content-Encoding: deflate)
+
+compressi = CacheRisultati(ttl_s=600, max_voci=64, max_bytes=16 * 1024 * 1024)
+
+
+def _codifica_accettata():
+    accettate = request.accept_encodings
+    for codifica in ("gzip", "deflate"):
+        if accettate[codifica]:
+            return codifica
+    return None
+
+
+def _comprimi_iter(pezzi, codifica):
+    z = zlib.compressobj(COMPRIMI_LIVELLO, zlib.DEFLATED, _WBITS[codifica])
+    for pezzo in pezzi:
+        out = z.compress(pezzo.encode("utf-8") if isinstance(pezzo, str) else pezzo)
+        if out:
+            yield out
+    yield z.flush()
+
+
+@app.after_request
+def _condizionale_e_compressione(resp):
+    if (not request.path.startswith("/api/materiali") or resp.status_code != 200
+            or resp.mimetype != "application/json" or "Content-Encoding" in resp.headers):
+        return resp
+    resp.vary.add("Accept-Encoding")
+    codifica = _codifica_accettata()
+    if resp.is_streamed:
+        # stream: niente ETag (il corpo non è ancora noto), compressione al volo
+        if codifica:
+            resp.response = _comprimi_iter(resp.response, codifica)
+            resp.headers["Content-Encoding"] = codifica
+        return resp
+
+    etag, _ = resp.get_etag()
+    if not etag:
+        etag = etag_di(resp.get_data())
+        resp.set_etag(etag, weak=True)  # debole: vale per tutte le codifiche dello stesso JSON
+    resp.make_conditional(request)
+    if resp.status_code == 304:
+        return resp
+
+    if codifica and resp.content_length and resp.content_length >= COMPRIMI_MIN_BYTES:
+        chiave = (etag, codifica)
+        dati = compressi.leggi(chiave)
+        if dati is None:
+            z = zlib.compressobj(COMPRIMI_LIVELLO, zlib.DEFLATED, _WBITS[codifica])
+            dati = z.compress(resp.get_data()) + z.flush()
+            compressi.scrivi(chiave, dati, etag)
+        resp.set_data(dati)
+        resp.headers["Content-Encoding"] = codifica
+    return resp
+
+
+# ───────────────────────── Avvio ─────────────────────────
+SERVER_THREADS = int(os.environ.get("MATERIALI_THREADS", "16"))
+# Chiude le connessioni HTTP inattive (keep-alive parcheggiati, client spariti):
+# non limita la durata di una richiesta, a quella pensa QUERY_TIMEOUT_S sul DB.
+SERVER_INATTIVITA_S = int(os.environ.get("MATERIALI_INATTIVITA_S",
+                                         os.environ.get("MATERIALI_TIMEOUT_S", "120")))
+
+
+def avvia_server(host, port, threads=SERVER_THREADS, inattivita=SERVER_INATTIVITA_S):
+    """
+    Server di produzione multi-thread: waitress se installato (pip install waitress),
+    altrimenti il server threaded di werkzeug senza debugger né reloader.
+    I thread bastano: pyodbc rilascia il GIL durante le query.
+    """
+    try:
+        from waitress import serve
+    except ImportError:
+        serve = None
+    if serve is not None:
+        app.logger.info("Avvio waitress su %s:%s (threads=%s, connessioni inattive chiuse dopo %ss, "
+                        "timeout query %ss)", host, port, threads, inattivita, QUERY_TIMEOUT_S or "-")
+        serve(app, host=host, port=port, threads=threads, channel_timeout=inattivita,
+              connection_limit=max(100, threads * 8), ident="FinestraMateriali")
+    else:
+        from werkzeug.serving import make_server, WSGIRequestHandler
+
+        class _Handler(WSGIRequestHandler):
+            pass
+        _Handler.timeout = inattivita  # timeout sul socket del client (http.server)
+        app.logger.warning("waitress non installato: uso il server threaded di werkzeug su %s:%s", host, port)
+        make_server(host, port, app, threaded=True, request_handler=_Handler).serve_forever()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Backend materiali (/api/materiali)")
+    ap.add_argument("--host", default="0.0.0.0")
+    ap.add_argument("--port", type=int, default=5050)
+    ap.add_argument("--threads", type=int, default=SERVER_THREADS)
+    ap.add_argument("--inattivita", type=int, default=SERVER_INATTIVITA_S,
+                    help="secondi prima di chiudere una connessione HTTP inattiva "
+                         "(la durata delle query la limita MATERIALI_QUERY_TIMEOUT_S)")
+    ap.add_argument("--dev", action="store_true", help="server di sviluppo Flask con debugger e reloader")
+    ap.add_argument("--sync", action="store_true", help="aggiorna la copia locale dall'ERP ed esce")
+    ap.add_argument("--completo", action="store_true", help="con --sync: copia completa invece che incrementale")
+    args = ap.parse_args(argv)
+
+    if args.sync:
+        print(json.dumps(sincronizza_snapshot(completo=args.completo)))
+        return
+
+    if args.dev:
+        app.run(host=args.host, port=args.port, debug=True)
+        return
+    try:
+        configura_log()
+    except OSError as e:
+        print(f"Log su file non disponibile ({e}): uso stderr", file=sys.stderr)
+        app.logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+    if SYNC_S > 0:
+        avvia_sync_periodico(SYNC_S)
+    avvia_server(args.host, args.port, threads=args.threads, inattivita=args.inattivita)
+
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5050, debug=True)
+    main()
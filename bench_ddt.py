@@ -0,0 +1,309 @@
+# File: bench_ddt.py
+# Benchmark locali per genera_excel_ddt.py (nessun accesso alla share di rete).
+#
+#   python bench_ddt.py parser [--files 10000] [--repeat 20]
+#   python bench_ddt.py pipeline [--sizes 100,1000,10000] [--writes 20] [--cold 3] [--json]
+import sys
+import os
+import re
+import json
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+import time
+
+import genera_excel_ddt as ddt
+
+# ───────────────────────────────────────────────────────────────────────────────
+# Implementazione precedente di match_ddt_files (4 re.compile per chiamata,
+# fino a 4 pattern provati per file), tenuta qui solo per il confronto.
+# ───────────────────────────────────────────────────────────────────────────────
+def match_ddt_files_legacy(files, codice_norm, codice_raw):
+    pats_entrata = []
+    pats_uscita = []
+    flags = re.IGNORECASE
+
+    if codice_raw:
+        pats_entrata.append(re.compile(
+            rf'^DDT_(\d{{4}})W_{re.escape(codice_raw)}_(\d{{2}})[\-_](\d{{2}})[\-_](\d{{4}})(?:\D.*)?\.pdf$',
+            flags
+        ))
+        pats_uscita.append(re.compile(
+            rf'^DDT_(\d{{4}})T_{re.escape(codice_raw)}_(\d{{2}})[\-_](\d{{2}})[\-_](\d{{4}})(?:\D.*)?\.pdf$',
+            flags
+        ))
+
+    if codice_norm:
+        pats_entrata.append(re.compile(
+            rf'^DDT_(\d{{4}})W_.*{re.escape(codice_norm)}_(\d{{2}})[\-_](\d{{2}})[\-_](\d{{4}})(?:\D.*)?\.pdf$',
+            flags
+        ))
+        pats_uscita.append(re.compile(
+            rf'^DDT_(\d{{4}})T_.*{re.escape(codice_norm)}_(\d{{2}})[\-_](\d{{2}})[\-_](\d{{4}})(?:\D.*)?\.pdf$',
+            flags
+        ))
+
+    entrata, uscita = [], []
+    for fname in files:
+        for pat in pats_entrata:
+            m = pat.match(fname)
+            if m:
+                entrata.append((int(m.group(1)), fname, f"{m.group(2)}/{m.group(3)}/{m.group(4)}"))
+                break
+        for pat in pats_uscita:
+            m = pat.match(fname)
+            if m:
+                uscita.append((int(m.group(1)), fname, f"{m.group(2)}/{m.group(3)}/{m.group(4)}"))
+                break
+    return entrata, uscita
+
+def nomi_sintetici(n, seed=42):
+    """
+    Nomi file realistici di una cartella MATERIALI: DDT W/T, prefissi, varianti
+    data, rumore. Ritorna (nomi, codici commessa usati).
+    """
+    rnd = random.Random(seed)
+    out, codici = [], []
+    for i in range(n):
+        code = f"C{rnd.randint(1000, 9999)}-{rnd.randint(1, 20):02d}"
+        if rnd.random() < 0.3:
+            code = f"BRAND_Prodotto_P{rnd.randint(1, 99)}_{code}"
+        codici.append(code)
+        kind = rnd.choice("WT")
+        sep = rnd.choice("-_")
+        dd, mm = rnd.randint(1, 28), rnd.randint(1, 12)
+        ext = rnd.choice([".pdf", ".PDF"])
+        r = rnd.random()
+        if r < 0.8:
+            suffix = rnd.choice(["", "", " (1)", "_firmato"])
+            out.append(f"DDT_{i % 10000:04d}{kind}_{code}_{dd:02d}{sep}{mm:02d}{sep}2026{suffix}{ext}")
+        elif r < 0.9:
+            out.append(f"Preventivo_{code}_{i}.pdf")
+        else:
+            out.append(f"foto_{i}.jpg")
+    return out, codici
+
+# Nomi reali che si possono dividere in codice + data in più punti (date nel codice)
+NOMI_AMBIGUI = [
+    "DDT_0005W_AB_12_11_2025_C4924-01_01-10-2026.pdf",
+    "DDT_0006T_AB_12_11_2025_C4924-01_01-10-2026_firmato.PDF",
+    "DDT_0007W_C4924-01_02-10-2026_C4924-01_03-10-2026.pdf",
+]
+CODICI_AMBIGUI = ["C4924-01", "AB", "AB_12_11_2025_C4924-01", "BRAND_X_C4924-01"]
+
+def _tempo_migliore(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def bench_parser(n_files, repeat):
+    files, usati = nomi_sintetici(n_files)
+    files += NOMI_AMBIGUI
+    # commesse da cercare: alcune presenti (raw e con prefisso), una assente
+    prefissati = [c for c in usati if "_" in c][:3]
+    semplici = [c for c in usati if "_" not in c][:3]
+    codici = prefissati + semplici + ["C0000-00"] + CODICI_AMBIGUI
+
+    with tempfile.TemporaryDirectory() as tmp:
+        indice = ddt.IndiceMateriali(tmp, files=files)
+
+        # correttezza: stessi risultati della vecchia implementazione
+        for raw in codici:
+            norm = ddt.normalizza_codice_commessa(raw)
+            vecchio = match_ddt_files_legacy(files, norm, raw)
+            nuovo = ddt.match_ddt_files(indice, norm, raw)
+            if sorted(vecchio[0]) != sorted(nuovo[0]) or sorted(vecchio[1]) != sorted(nuovo[1]):
+                print(f"DIFFERENZA per codice {raw!r}", file=sys.stderr)
+                sys.exit(1)
+
+        def legacy():
+            for raw in codici:
+                match_ddt_files_legacy(files, ddt.normalizza_codice_commessa(raw), raw)
+
+        def nuovo_freddo():
+            indice._voci = None  # include il parse di tutti i nomi
+            for raw in codici:
+                ddt.match_ddt_files(indice, ddt.normalizza_codice_commessa(raw), raw)
+
+        def nuovo_caldo():
+            for raw in codici:
+                ddt.match_ddt_files(indice, ddt.normalizza_codice_commessa(raw), raw)
+
+        t_legacy = _tempo_migliore(legacy, repeat)
+        t_freddo = _tempo_migliore(nuovo_freddo, repeat)
+        t_caldo = _tempo_migliore(nuovo_caldo, repeat)
+
+    n = len(codici)
+    print(f"parser: {len(files)} file, {n} ricerche, migliore su {repeat} ripetizioni")
+    print(f"  legacy (4 regex/chiamata)      {t_legacy * 1000 / n:8.2f} ms/ricerca")
+    print(f"  parser unico, indice freddo    {t_freddo * 1000 / n:8.2f} ms/ricerca  (x{t_legacy / t_freddo:.1f})")
+    print(f"  parser unico, indice già fatto {t_caldo * 1000 / n:8.2f} ms/ricerca  (x{t_legacy / t_caldo:.1f})")
+
+# ───────────────────────────────────────────────────────────────────────────────
+# Pipeline completa: cartelle MATERIALI e workbook mensili sintetici in una
+# temp dir locale, righe da 100 a 10.000. Misura latenza per DDT (p50/p90/p99),
+# throughput e tempi medi per fase, per le modalità singolo / worker / batch
+# e, con --cold, anche il processo nuovo per DDT (come oggi da server.js).
+# ───────────────────────────────────────────────────────────────────────────────
+MESE, ANNO = "10", "2026"
+
+def _percentile(valori, p):
+    v = sorted(valori)
+    if not v:
+        return 0.0
+    k = (len(v) - 1) * p / 100
+    f = int(k)
+    c = min(f + 1, len(v) - 1)
+    return v[f] + (v[c] - v[f]) * (k - f)
+
+def prepara_ambiente(base, n_righe, n_scritture):
+    """
+    Crea in `base`: Template/DDT_Work.xlsx, DDT_Work_10_2026.xlsx con `n_righe`
+    righe già compilate (hyperlink in colonna I come quelle vere) e una commessa
+    con `n_scritture` PDF W in MATERIALI. Ritorna i payload da scrivere.
+    """
+    from openpyxl import Workbook
+
+    os.makedirs(os.path.join(base, "Template"))
+    wb = Workbook()
+    ws = wb.active
+    ws["A1"] = "DDT Work Report"
+    for col, titolo in zip("ABCDEFGHIJKLMN", ["Data", "DDT", "Codice", "Commessa", "Qta", "Colli", "DDT T",
+                                              "Data T", "PDF", "Ore", "K", "L", "M", "Prezzo"]):
+        ws[f"{col}4"] = titolo
+    wb.save(os.path.join(base, "Template", "DDT_Work.xlsx"))
+
+    for r in range(5, 5 + n_righe):
+        ws[f"A{r}"] = "01/10/26"
+        ws[f"B{r}"] = f"{r:05d}X"  # mai uguale ai DDT dei payload
+        ws[f"C{r}"] = f"C{r % 9000 + 1000}-01"
+        ws[f"D{r}"] = "Commessa esistente"
+        ws[f"E{r}"] = 10.0
+        cell = ws[f"I{r}"]; cell.value = "Apri"; cell.hyperlink = os.path.join(base, "vecchi", f"{r}.pdf")
+        ws[f"K{r}"] = f'=IF(E{r}<>0,L{r}/E{r},"")'
+        ws[f"L{r}"] = f'=M{r}*J{r}'
+    wb.save(os.path.join(base, "iniziale.xlsx"))
+
+    cartella = os.path.join(base, "BR_Prodotto_P1_C4924-01")
+    materiali = os.path.join(cartella, "MATERIALI")
+    os.makedirs(materiali)
+    for j in range(200):  # altri file tipici della cartella
+        open(os.path.join(materiali, f"DDT_{j + 5000:04d}T_C4924-01_02-{MESE}-{ANNO}.pdf"), "w").close()
+    payloads = []
+    for j in range(n_scritture):
+        num = j + 1
+        open(os.path.join(materiali, f"DDT_{num:04d}W_C4924-01_03-{MESE}-{ANNO}.pdf"), "w").close()
+        payloads.append({"folderPath": cartella, "codiceCommessa": "C4924-01", "numeroDdt": str(num),
+                         "dataDdt": f"03/{MESE}/{ANNO}", "quantita": "10", "colli": "1",
+                         "descrizione": "Assembraggio BR_Prodotto_P1_C4924-01", "prezzoVendita": "1,5"})
+    return payloads
+
+def _ripristina(base):
+    shutil.copy(os.path.join(base, "iniziale.xlsx"), ddt.percorso_workbook(base, MESE, ANNO))
+
+def _riassunto(modalita, n_righe, latenze_ms, totale_s, tempi):
+    n = len(latenze_ms)
+    return {
+        "modalita": modalita, "righe": n_righe, "scritture": n,
+        "p50_ms": round(_percentile(latenze_ms, 50), 2),
+        "p90_ms": round(_percentile(latenze_ms, 90), 2),
+        "p99_ms": round(_percentile(latenze_ms, 99), 2),
+        "ddt_al_s": round(n / totale_s, 2) if totale_s else 0.0,
+        "fasi_ms_medie": {k: round(v / n, 2) for k, v in tempi.items()} if n else {},
+    }
+
+def bench_pipeline(sizes, n_scritture, n_cold):
+    risultati = []
+    for n_righe in sizes:
+        with tempfile.TemporaryDirectory() as base:
+            payloads = prepara_ambiente(base, n_righe, n_scritture)
+
+            # singolo: load -> upsert -> save per ogni DDT (processo già caldo)
+            _ripristina(base)
+            latenze, tempi = [], {}
+            t_tot = time.perf_counter()
+            for p in payloads:
+                t0 = time.perf_counter()
+                rep = ddt.esegui_batch([p], base)
+                latenze.append((time.perf_counter() - t0) * 1000)
+                tempi = ddt.somma_tempi(tempi, rep["tempi"])
+            risultati.append(_riassunto("singolo", n_righe, latenze, time.perf_counter() - t_tot, tempi))
+
+            # worker: workbook e indici tenuti in memoria tra un DDT e l'altro
+            _ripristina(base)
+            cache = ddt.CacheWorkbook()
+            latenze, tempi = [], {}
+            t_tot = time.perf_counter()
+            for p in payloads:
+                t0 = time.perf_counter()
+                rep = ddt.esegui_batch([p], base, cache=cache)
+                latenze.append((time.perf_counter() - t0) * 1000)
+                tempi = ddt.somma_tempi(tempi, rep["tempi"])
+            risultati.append(_riassunto("worker", n_righe, latenze, time.perf_counter() - t_tot, tempi))
+
+            # batch: tutti i DDT in un giro, un load e un save
+            _ripristina(base)
+            t0 = time.perf_counter()
+            rep = ddt.esegui_batch(payloads, base)
+            totale = time.perf_counter() - t0
+            risultati.append(_riassunto("batch", n_righe, [totale * 1000 / len(payloads)] * len(payloads),
+                                        totale, rep["tempi"]))
+
+            # cold: un interprete nuovo per DDT, come lo spawn attuale di server.js
+            if n_cold:
+                _ripristina(base)
+                script = os.path.join(os.path.dirname(os.path.abspath(ddt.__file__)), "genera_excel_ddt.py")
+                env = dict(os.environ, DDT_LOG_LEVEL="ERROR", DDT_LOG_PATH=os.path.join(base, "log.txt"))
+                latenze = []
+                t_tot = time.perf_counter()
+                for p in payloads[:n_cold]:
+                    dati_path = os.path.join(base, "dati.json")
+                    with open(dati_path, "w", encoding="utf-8") as f:
+                        json.dump(p, f)
+                    t0 = time.perf_counter()
+                    subprocess.run([sys.executable, script, dati_path, base], env=env,
+                                   stdout=subprocess.DEVNULL, check=True)
+                    latenze.append((time.perf_counter() - t0) * 1000)
+                risultati.append(_riassunto("cold", n_righe, latenze, time.perf_counter() - t_tot, {}))
+    return risultati
+
+def stampa_pipeline(risultati):
+    print(f"{'modalita':<8} {'righe':>6} {'n':>4} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'DDT/s':>8}  fasi (ms medi)")
+    for r in risultati:
+        fasi = ", ".join(f"{k}={v}" for k, v in r["fasi_ms_medie"].items())
+        print(f"{r['modalita']:<8} {r['righe']:>6} {r['scritture']:>4} {r['p50_ms']:>9.2f} {r['p90_ms']:>9.2f} "
+              f"{r['p99_ms']:>9.2f} {r['ddt_al_s']:>8.2f}  {fasi}")
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark genera_excel_ddt.py")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("parser", help="match_ddt_files: parser unico vs regex per chiamata")
+    p.add_argument("--files", type=int, default=10000)
+    p.add_argument("--repeat", type=int, default=20)
+    q = sub.add_parser("pipeline", help="pipeline completa su workbook sintetici di dimensione crescente")
+    q.add_argument("--sizes", default="100,1000,10000", help="righe già presenti nel workbook mensile")
+    q.add_argument("--writes", type=int, default=20, help="DDT scritti per ogni dimensione")
+    q.add_argument("--cold", type=int, default=0, help="DDT da scrivere anche con un processo nuovo ciascuno")
+    q.add_argument("--json", action="store_true", help="una riga JSON per risultato (per confronti tra versioni)")
+    args = ap.parse_args()
+
+    ddt.log = lambda *a, **k: None  # niente I/O di log nelle misure
+
+    if args.cmd == "parser":
+        bench_parser(args.files, args.repeat)
+    elif args.cmd == "pipeline":
+        sizes = [int(x) for x in args.sizes.split(",") if x.strip()]
+        risultati = bench_pipeline(sizes, args.writes, args.cold)
+        if args.json:
+            for r in risultati:
+                print(json.dumps(r))
+        else:
+            stampa_pipeline(risultati)
+
+if __name__ == "__main__":
+    main()
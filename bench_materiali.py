@@ -0,0 +1,125 @@
+# File: bench_materiali.py
+# Benchmark locale della serializzazione righe di FinestraMateriali.py (nessun DB:
+# righe sintetiche con cursor.description come la restituisce pyodbc).
+#
+#   python bench_materiali.py [--righe 50000] [--repeat 5] [--json]
+import json
+import random
+import argparse
+import time
+import datetime as _dt
+from decimal import Decimal
+
+import FinestraMateriali as fm
+
+COLONNE = [
+    ("NumeroDoc", int), ("DataDoc", _dt.datetime), ("Cd_CF", str), ("ClienteFornitore", str),
+    ("Cd_AR", str), ("Descrizione", str), ("Qta", Decimal), ("PrezzoUnitarioV", Decimal),
+    ("Cd_DOSottoCommessa", str), ("DataConsegna", _dt.datetime), ("NoteRiga", str),
+    # colonne di ordinamento in coda, come in costruisci_query()
+    ("_DataDoc", _dt.datetime), ("_NumeroDoc", int), ("_IdRiga", int),
+]
+DESCRIPTION = [(nome, tipo, None, None, None, None, True) for nome, tipo in COLONNE]
+
+# ───────────────────────────────────────────────────────────────────────────────
+# Conversione precedente (isinstance su ogni valore, dict costruito a mano),
+# tenuta qui solo per il confronto.
+# ───────────────────────────────────────────────────────────────────────────────
+def riga_dict_legacy(columns, row):
+    d = {}
+    for col, val in zip(columns, row):
+        if isinstance(val, ( _dt.date, _dt.datetime )):
+            d[col] = val.strftime('%d-%m-%Y')
+        elif isinstance(val, Decimal):
+            d[col] = float(val)
+        else:
+            d[col] = val
+    if d.get("NoteRiga") is not None:
+        d["NoteRiga"] = str(d["NoteRiga"])
+    return d
+
+def righe_sintetiche(n, seed=42):
+    rnd = random.Random(seed)
+    base = _dt.datetime(2026, 1, 1)
+    out = []
+    for i in range(n):
+        data = base + _dt.timedelta(days=rnd.randint(0, 300))
+        num = rnd.randint(1, 5000)
+        out.append((
+            num, data, rnd.choice(["C00012", "F00034", "F00100"]), "Ragione sociale srl",
+            f"AR{rnd.randint(1, 99999):05d}", "Lamiera DC01 sp. 2 mm taglio laser",
+            Decimal(rnd.randint(0, 500)) / 4, Decimal(rnd.randint(1, 99999)) / 100,
+            f"C{rnd.randint(1, 9999):04d}-01", data if rnd.random() < 0.7 else None,
+            None if rnd.random() < 0.8 else "consegna urgente",
+            data, num, i,
+        ))
+    return out
+
+def _tempo_migliore(fn, repeat):
+    migliore = None
+    risultato = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        risultato = fn()
+        dt = time.perf_counter() - t0
+        migliore = dt if migliore is None else min(migliore, dt)
+    return migliore * 1000, risultato
+
+def bench(n_righe, repeat):
+    righe = righe_sintetiche(n_righe)
+    n_ord = len(fm.ORDINE)
+    columns = [c[0] for c in DESCRIPTION][:-n_ord]
+    dumps = fm.app.json.dumps  # stesso provider JSON usato da jsonify
+
+    def legacy():
+        return [riga_dict_legacy(columns, row[:-n_ord]) for row in righe]
+
+    def nuovo_dict():
+        conv = fm.ConvertitoreRighe(DESCRIPTION, escludi_coda=n_ord)
+        return [conv.dict(row) for row in righe]
+
+    def nuovo_colonne():
+        conv = fm.ConvertitoreRighe(DESCRIPTION, escludi_coda=n_ord)
+        return {"columns": conv.colonne, "rows": [conv.valori(row) for row in righe]}
+
+    ms_legacy, r_legacy = _tempo_migliore(legacy, repeat)
+    ms_dict, r_dict = _tempo_migliore(nuovo_dict, repeat)
+    ms_col, r_col = _tempo_migliore(nuovo_colonne, repeat)
+    if r_dict != r_legacy:
+        raise SystemExit("ERRORE: conversione per colonna diversa da quella precedente")
+    if [dict(zip(r_col["columns"], v)) for v in r_col["rows"]] != r_legacy:
+        raise SystemExit("ERRORE: formato colonnare diverso da quello a dict")
+
+    ms_json_dict, testo_dict = _tempo_migliore(lambda: dumps(r_dict), repeat)
+    ms_json_col, testo_col = _tempo_migliore(lambda: dumps(r_col), repeat)
+    return [
+        {"variante": "legacy (isinstance)", "conversione_ms": ms_legacy, "json_ms": ms_json_dict,
+         "bytes": len(testo_dict)},
+        {"variante": "per colonna, dict", "conversione_ms": ms_dict, "json_ms": ms_json_dict,
+         "bytes": len(testo_dict)},
+        {"variante": "per colonna, colonnare", "conversione_ms": ms_col, "json_ms": ms_json_col,
+         "bytes": len(testo_col)},
+    ]
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark serializzazione /api/materiali")
+    ap.add_argument("--righe", type=int, default=50000)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--json", action="store_true", help="una riga JSON per variante")
+    args = ap.parse_args()
+
+    risultati = bench(args.righe, args.repeat)
+    if args.json:
+        for r in risultati:
+            print(json.dumps(dict(r, righe=args.righe)))
+        return
+    base = risultati[0]["conversione_ms"] + risultati[0]["json_ms"]
+    print(f"{args.righe} righe, migliore di {args.repeat}")
+    print(f"{'variante':<24} {'conversione':>12} {'json':>10} {'totale':>10} {'MB':>7} {'speedup':>8}")
+    for r in risultati:
+        tot = r["conversione_ms"] + r["json_ms"]
+        print(f"{r['variante']:<24} {r['conversione_ms']:>10.1f}ms {r['json_ms']:>8.1f}ms "
+              f"{tot:>8.1f}ms {r['bytes'] / 1e6:>7.2f} {base / tot:>7.2f}x")
+
+if __name__ == "__main__":
+    main()
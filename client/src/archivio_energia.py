@@ -0,0 +1,295 @@
+"""
+Archivio dei campioni di energia letti da fetch_live.py.
+
+I campioni restano in memoria e vanno su disco a blocchi (ogni FLUSH_N campioni
+o FLUSH_S secondi, e alla chiusura), in un file per contatore e per giorno o mese:
+
+    <cartella>/<contatore>/2026-10.csv     timestamp,today_wh,week_wh,latenza_ms
+    <cartella>/<contatore>/2026-10.bin     record fissi RECORD (little endian, senza header)
+
+Il formato binario si legge con numpy.memmap / numpy.fromfile senza parsing:
+mesi di campioni ad alta frequenza si caricano e filtrano per data in millisecondi.
+I ts sono epoch veri (UTC): nell'ora ripetuta del cambio d'ora restano crescenti.
+
+salva_su_csv() di fetch_live.py continua invece a scrivere il vecchio
+dati_consumi.csv (timestamp,today_wh,week_wh) nella cartella di lavoro.
+
+    python archivio_energia.py carica --contatore generale [--dal 2026-10-01] [--al 2026-10-31]
+    python archivio_energia.py converti --contatore generale      (csv -> bin)
+"""
+import io, os, csv, sys, glob, time, json, struct, atexit, argparse, threading
+from datetime import datetime, timedelta
+
+CARTELLA_DATI = os.environ.get("ENERGIA_DATI", os.path.join(os.path.expanduser("~"), "dati_consumi"))
+CSV_FILE      = os.environ.get("ENERGIA_CSV", "dati_consumi.csv")  # file unico di salva_su_csv (storico)
+FLUSH_N       = 60       # campioni in memoria prima di scrivere
+FLUSH_S       = 300      # età massima del buffer in secondi
+ROTAZIONI     = {"giorno": "%Y-%m-%d", "mese": "%Y-%m"}
+FORMATI       = ("csv", "bin")
+
+# ts epoch (s, float64) | today_wh (int64) | week_wh (int64) | latenza_ms (float32, NaN se ignota)
+RECORD = struct.Struct("<dqqf")
+DTYPE_RECORD = [("ts", "<f8"), ("today_wh", "<i8"), ("week_wh", "<i8"), ("latenza_ms", "<f4")]
+INTESTAZIONE_CSV = ["timestamp", "today_wh", "week_wh", "latenza_ms"]
+INTESTAZIONE_CSV_STORICO = INTESTAZIONE_CSV[:3]  # dati_consumi.csv, senza latenza
+FORMATO_TS = "%Y-%m-%d %H:%M:%S"
+
+
+class ArchivioCampioni:
+    """
+    Buffer thread-safe (più thread del Poller scrivono insieme) con flush a
+    blocchi: ogni file toccato viene aperto una volta per flush, non per campione.
+    Con `file_unico` tutti i campioni vanno in quel CSV, nel formato storico
+    di dati_consumi.csv (niente cartelle per contatore, rotazione né latenza).
+    """
+
+    def __init__(self, cartella=CARTELLA_DATI, rotazione="mese", formato="csv",
+                 flush_n=FLUSH_N, flush_s=FLUSH_S, file_unico=None):
+        if file_unico and formato != "csv":
+            raise ValueError("file_unico è solo per il formato csv")
+        if rotazione not in ROTAZIONI:
+            raise ValueError(f"rotazione non valida: {rotazione!r} (giorno|mese)")
+        if formato not in FORMATI:
+            raise ValueError(f"formato non valido: {formato!r} (csv|bin)")
+        self.cartella = cartella
+        self.rotazione = rotazione
+        self.formato = formato
+        self.flush_n = flush_n
+        self.flush_s = flush_s
+        self.file_unico = file_unico
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._primo = None  # monotonic del campione più vecchio nel buffer
+        self.contatori = {"campioni": 0, "flush": 0, "scritture_file": 0}
+
+    def percorso(self, contatore, ts):
+        if self.file_unico:
+            return self.file_unico
+        return os.path.join(self.cartella, contatore, f"{ts.strftime(ROTAZIONI[self.rotazione])}.{self.formato}")
+
+    def aggiungi(self, contatore, ts, today_wh, week_wh, latenza_ms=None):
+        with self._lock:
+            self._buffer.append((contatore, ts, int(today_wh), int(week_wh), latenza_ms))
+            self.contatori["campioni"] += 1
+            if self._primo is None:
+                self._primo = time.monotonic()
+            pieno = len(self._buffer) >= self.flush_n or time.monotonic() - self._primo >= self.flush_s
+        if pieno:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            buffer, self._buffer, self._primo = self._buffer, [], None
+            if not buffer:
+                return 0
+            per_file = {}
+            for campione in buffer:
+                per_file.setdefault(self.percorso(campione[0], campione[1]), []).append(campione)
+            falliti, errore = [], None
+            for percorso, campioni in per_file.items():
+                try:
+                    if os.path.dirname(percorso):
+                        os.makedirs(os.path.dirname(percorso), exist_ok=True)
+                    if self.formato == "bin":
+                        self._scrivi_bin(percorso, campioni)
+                    else:
+                        self._scrivi_csv(percorso, campioni, storico=bool(self.file_unico))
+                except OSError as e:
+                    falliti += campioni
+                    errore = errore or e
+                    continue
+                self.contatori["scritture_file"] += 1
+            if errore:
+                # solo i file non scritti tornano in buffer (e _accoda li ha riportati com'erano):
+                # quelli riusciti non vanno duplicati
+                self._buffer = falliti + self._buffer
+                self._primo = time.monotonic()
+                raise errore
+            self.contatori["flush"] += 1
+            return len(buffer)
+
+    @staticmethod
+    def _accoda(percorso, dati, record=1):
+        """
+        Accoda `dati` al file. Se la scrittura fallisce a metà il file viene
+        riportato alla lunghezza di prima: al prossimo flush niente righe doppie.
+        `record`: lunghezza dei record fissi, per togliere la coda di un record
+        lasciato a metà da un crash.
+        """
+        with open(percorso, "ab", buffering=0) as f:
+            fine = f.seek(0, os.SEEK_END)
+            if fine % record:
+                fine -= fine % record
+                f.truncate(fine)
+            try:
+                resto = memoryview(dati)
+                while resto:
+                    resto = resto[f.write(resto):]
+            except OSError:
+                try:
+                    f.truncate(fine)
+                except OSError:
+                    pass
+                raise
+
+    @classmethod
+    def _scrivi_csv(cls, percorso, campioni, storico=False):
+        testo = io.StringIO()
+        writer = csv.writer(testo)
+        if not os.path.exists(percorso) or os.path.getsize(percorso) == 0:
+            writer.writerow(INTESTAZIONE_CSV_STORICO if storico else INTESTAZIONE_CSV)
+        if storico:
+            writer.writerows((ts.strftime(FORMATO_TS), today, week) for _, ts, today, week, _ in campioni)
+        else:
+            writer.writerows((ts.strftime(FORMATO_TS), today, week, "" if ms is None else f"{ms:.1f}")
+                             for _, ts, today, week, ms in campioni)
+        cls._accoda(percorso, testo.getvalue().encode("utf-8"))
+
+    @classmethod
+    def _scrivi_bin(cls, percorso, campioni):
+        # ts.timestamp() è l'epoch vero anche per datetime locali naive (rispetta fold nell'ora ripetuta)
+        dati = b"".join(RECORD.pack(ts.timestamp(), today, week, float("nan") if ms is None else ms)
+                        for _, ts, today, week, ms in campioni)
+        cls._accoda(percorso, dati, RECORD.size)
+
+    def chiudi(self):
+        self.flush()
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# Lettura
+# ───────────────────────────────────────────────────────────────────────────────
+def _file_contatore(cartella, contatore, formato):
+    return sorted(glob.glob(os.path.join(cartella, contatore, f"*.{formato}")))
+
+def _periodo(percorso):
+    """(inizio, fine) del giorno o mese nel nome del file, None se il nome non è una data."""
+    nome = os.path.splitext(os.path.basename(percorso))[0]
+    for rotazione, fmt in ROTAZIONI.items():
+        try:
+            inizio = datetime.strptime(nome, fmt)
+        except ValueError:
+            continue
+        if rotazione == "giorno":
+            return inizio, inizio.replace(hour=23, minute=59, second=59, microsecond=999999)
+        prossimo = inizio.replace(year=inizio.year + inizio.month // 12, month=inizio.month % 12 + 1)
+        return inizio, prossimo - timedelta(microseconds=1)
+    return None
+
+def _leggi_bin(percorso, np):
+    n = os.path.getsize(percorso) // RECORD.size
+    if n == 0:
+        return np.empty(0, dtype=DTYPE_RECORD)
+    return np.memmap(percorso, dtype=DTYPE_RECORD, mode="r", shape=(n,))
+
+def _leggi_csv(percorso, np):
+    righe = []
+    with open(percorso, newline="") as f:
+        for r in csv.DictReader(f):
+            righe.append((datetime.strptime(r["timestamp"], FORMATO_TS).timestamp(), int(r["today_wh"]),
+                          int(r["week_wh"]), float(r.get("latenza_ms") or "nan")))
+    return np.array(righe, dtype=DTYPE_RECORD)
+
+def _filtra(dati, t_dal, t_al, np):
+    """Campioni con t_dal <= ts <= t_al, in ordine di ts."""
+    ts = dati["ts"]
+    if len(ts) < 2 or bool(np.all(ts[1:] >= ts[:-1])):
+        i, j = np.searchsorted(ts, t_dal, "left"), np.searchsorted(ts, t_al, "right")
+        return np.array(dati[i:j])
+    # non ordinati (es. CSV con l'ora ripetuta del cambio d'ora, che l'ora locale non distingue)
+    scelti = np.array(dati[(ts >= t_dal) & (ts <= t_al)])
+    return scelti[np.argsort(scelti["ts"], kind="stable")]
+
+def carica(contatore, cartella=CARTELLA_DATI, dal=None, al=None, formato="bin"):
+    """
+    Campioni di un contatore tra `dal` e `al` (datetime, estremi inclusi) come
+    array strutturato numpy (campi di DTYPE_RECORD). I file il cui giorno/mese
+    è fuori intervallo non si aprono; i .bin sono mappati in memoria e filtrati
+    con searchsorted (con una maschera se i ts non sono in ordine).
+    """
+    import numpy as np
+
+    t_dal = dal.timestamp() if dal else -np.inf
+    t_al = al.timestamp() if al else np.inf
+    parti = []
+    for percorso in _file_contatore(cartella, contatore, formato):
+        periodo = _periodo(percorso)
+        if periodo and ((dal and periodo[1] < dal) or (al and periodo[0] > al)):
+            continue
+        dati = _leggi_bin(percorso, np) if formato == "bin" else _leggi_csv(percorso, np)
+        if len(dati):
+            parti.append(_filtra(dati, t_dal, t_al, np))
+    return np.concatenate(parti) if parti else np.empty(0, dtype=DTYPE_RECORD)
+
+def converti_csv_in_bin(contatore, cartella=CARTELLA_DATI):
+    """
+    Porta i .csv di un contatore nei .bin corrispondenti (stessa rotazione). Un
+    .bin già presente non viene sovrascritto: i campioni si uniscono per
+    timestamp (a parità vince quello già nel .bin), così riconvertire è innocuo.
+    Ritorna i campioni aggiunti ai .bin.
+    """
+    import numpy as np
+
+    totale = 0
+    for percorso in _file_contatore(cartella, contatore, "csv"):
+        dati = _leggi_csv(percorso, np)
+        destinazione = os.path.splitext(percorso)[0] + ".bin"
+        n_prima = 0
+        if os.path.exists(destinazione):
+            esistenti = np.array(_leggi_bin(destinazione, np))
+            n_prima = len(esistenti)
+            tutti = np.concatenate([esistenti, dati])
+            _, primi = np.unique(tutti["ts"], return_index=True)  # ordinati per ts, prima occorrenza
+            dati = tutti[primi]
+        tmp = f"{destinazione}.{os.getpid()}.tmp"
+        dati.tofile(tmp)
+        os.replace(tmp, destinazione)
+        totale += len(dati) - n_prima
+    return totale
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# Archivio di default per salva_su_csv() di fetch_live.py
+# ───────────────────────────────────────────────────────────────────────────────
+_archivio_default = None
+
+def archivio_default():
+    global _archivio_default
+    if _archivio_default is None:
+        _archivio_default = ArchivioCampioni(file_unico=CSV_FILE)
+        atexit.register(_archivio_default.chiudi)
+    return _archivio_default
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Archivio campioni energia")
+    ap.add_argument("--cartella", default=CARTELLA_DATI)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("carica", help="carica un intervallo e stampa un riepilogo JSON")
+    c.add_argument("--contatore", default="generale")
+    c.add_argument("--dal")
+    c.add_argument("--al")
+    c.add_argument("--formato", choices=FORMATI, default="bin")
+    v = sub.add_parser("converti", help="converte i .csv di un contatore in .bin")
+    v.add_argument("--contatore", default="generale")
+    args = ap.parse_args()
+
+    if args.cmd == "converti":
+        print(json.dumps({"convertiti": converti_csv_in_bin(args.contatore, args.cartella)}))
+        return
+    dal = datetime.fromisoformat(args.dal) if args.dal else None
+    al = datetime.fromisoformat(args.al) if args.al else None
+    t0 = time.perf_counter()
+    dati = carica(args.contatore, args.cartella, dal, al, args.formato)
+    ms = (time.perf_counter() - t0) * 1000
+    riepilogo = {"campioni": int(len(dati)), "ms": round(ms, 1)}
+    if len(dati):
+        riepilogo.update(primo=datetime.fromtimestamp(dati["ts"][0]).strftime(FORMATO_TS),
+                         ultimo=datetime.fromtimestamp(dati["ts"][-1]).strftime(FORMATO_TS),
+                         today_wh_max=int(dati["today_wh"].max()))
+    json.dump(riepilogo, sys.stdout)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,12 @@
-import requests, json, csv, os
+import requests, json, sys, time, random, argparse, threading
+from collections import deque, namedtuple
 from datetime import datetime
 
+from archivio_energia import ArchivioCampioni, archivio_default, CARTELLA_DATI, ROTAZIONI, FORMATI
+
 BASE_URL = "http://192.168.1.40"
-URL      = f"{BASE_URL}/x/raw?total@read_energy"
+PERCORSO = "/x/raw?total@read_energy"
+URL      = f"{BASE_URL}{PERCORSO}"
 
 HEADERS = {
     "Referer": f"{BASE_URL}/wsmeasure/big?language=it",
@@ -14,29 +18,202 @@ COOKIES = {
     "key": "30dc331cff33ffdd50b04cfd448545c021634e2b55c8e89c8cd4909604cfc22148bfa919013c413d9caf4f2bc2819836b821cb83fe41c28d23bf539a52"
 }
 
-CSV_FILE = "dati_consumi.csv"
+# Polling
+INTERVALLO_S   = 10      # cadenza fissa tra due letture dello stesso contatore
+JITTER         = 0.1     # ± frazione dell'intervallo, per non allineare i contatori
+TIMEOUT_S      = 5
+BACKOFF_MAX_S  = 300     # attesa massima dopo errori consecutivi
+LATENZE_MAX    = 1000    # ultime latenze tenute per contatore
+
+Contatore = namedtuple("Contatore", ["nome", "base_url", "cookies"])
+CONTATORI = [Contatore("generale", BASE_URL, COOKIES)]
 
 def salva_su_csv(today, week):
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    file_exists = os.path.isfile(CSV_FILE)
-    with open(CSV_FILE, "a", newline="") as f:
-        writer = csv.writer(f)
-        if not file_exists:
-            writer.writerow(["timestamp", "today_wh", "week_wh"])
-        writer.writerow([now, today, week])
+    # bufferizzato: finisce nel solito dati_consumi.csv (CSV_FILE) al flush (o all'uscita)
+    archivio_default().aggiungi(CONTATORI[0].nome, datetime.now(), today, week)
 
-def fetch_energy_data():
-    r = requests.get(URL, headers=HEADERS, cookies=COOKIES, timeout=5)
-    r.raise_for_status()
-    raw = r.text.strip()
+def nuova_sessione(contatore):
+    """Sessione keep-alive per un contatore: header e cookie impostati una volta sola."""
+    s = requests.Session()
+    s.headers.update(HEADERS)
+    s.headers["Referer"] = f"{contatore.base_url}/wsmeasure/big?language=it"
+    s.cookies.update(contatore.cookies or {})
+    # una connessione per contatore, nessun retry automatico: i tentativi li governa il Poller
+    adattatore = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0)
+    s.mount("http://", adattatore)
+    s.mount("https://", adattatore)
+    return s
+
+def parse_energia(testo):
+    """Corpo di /x/raw?total@read_energy ('ackdata:{...}') -> (today_wh, week_wh)."""
+    raw = testo.strip()
     if raw.startswith("ackdata:"):
         raw = raw[len("ackdata:"):]
-    data = json.loads(raw)
-    e = data["total"]["energy"]
-    today_wh = int(e["todaytotalenergy"])
-    week_wh  = int(e["thisweektotalenergy"])
+    e = json.loads(raw)["total"]["energy"]
+    return int(e["todaytotalenergy"]), int(e["thisweektotalenergy"])
+
+def leggi_energia(sessione, base_url=BASE_URL, timeout=TIMEOUT_S):
+    r = sessione.get(f"{base_url}{PERCORSO}", timeout=timeout)
+    r.raise_for_status()
+    return parse_energia(r.text)
+
+_sessione = None
+
+def fetch_energy_data():
+    global _sessione
+    if _sessione is None:
+        _sessione = nuova_sessione(CONTATORI[0])
+    today_wh, week_wh = leggi_energia(_sessione)
     salva_su_csv(today_wh, week_wh)
     return {
         "today": today_wh,
         "week": week_wh
     }
+
+# ───────────────────────────────────────────────────────────────────────────────
+# Poller: un thread e una sessione keep-alive per contatore
+# ───────────────────────────────────────────────────────────────────────────────
+class Poller:
+    """
+    Legge ogni contatore a cadenza fissa (le scadenze non slittano con la durata
+    della lettura) con jitter; dopo timeout/errori di rete aspetta in backoff
+    esponenziale fino a BACKOFF_MAX_S e ricrea la sessione. Per ogni lettura
+    riuscita chiama su_campione(nome, timestamp, today_wh, week_wh, latenza_ms)
+    (default: archivio_default().aggiungi, buffer + flush a blocchi).
+    """
+
+    def __init__(self, contatori=None, su_campione=None, intervallo_s=INTERVALLO_S, jitter=JITTER,
+                 timeout_s=TIMEOUT_S, backoff_max_s=BACKOFF_MAX_S):
+        self.contatori = list(contatori or CONTATORI)
+        self.su_campione = su_campione or archivio_default().aggiungi
+        self.intervallo_s = intervallo_s
+        self.jitter = jitter
+        self.timeout_s = timeout_s
+        self.backoff_max_s = backoff_max_s
+        self._stop = threading.Event()
+        self._thread = []
+        self._lock = threading.Lock()
+        self._stato = {c.nome: {"ok": 0, "errori": 0, "timeout": 0, "errori_consecutivi": 0,
+                                "ultimo_errore": None, "ultima_lettura": None,
+                                "latenze_ms": deque(maxlen=LATENZE_MAX)}
+                       for c in self.contatori}
+
+    def _attesa(self, base):
+        return max(0.0, base * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    def _ciclo(self, contatore):
+        stato = self._stato[contatore.nome]
+        sessione = nuova_sessione(contatore)
+        prossima = time.monotonic() + self._attesa(self.intervallo_s) * random.random()  # partenze sfalsate
+        try:
+            while not self._stop.wait(max(0.0, prossima - time.monotonic())):
+                t0 = time.perf_counter()
+                try:
+                    today_wh, week_wh = leggi_energia(sessione, contatore.base_url, self.timeout_s)
+                except (requests.RequestException, ValueError, KeyError) as e:
+                    with self._lock:
+                        stato["errori"] += 1
+                        stato["timeout"] += isinstance(e, requests.Timeout)
+                        stato["errori_consecutivi"] += 1
+                        stato["ultimo_errore"] = f"{type(e).__name__}: {e}"
+                        n = stato["errori_consecutivi"]
+                    if isinstance(e, (requests.ConnectionError, requests.Timeout)):
+                        sessione.close()
+                        sessione = nuova_sessione(contatore)
+                    prossima = time.monotonic() + self._attesa(min(self.intervallo_s * 2 ** n, self.backoff_max_s))
+                    continue
+                latenza_ms = (time.perf_counter() - t0) * 1000
+                adesso = datetime.now()
+                with self._lock:
+                    stato["ok"] += 1
+                    stato["errori_consecutivi"] = 0
+                    stato["ultima_lettura"] = adesso.isoformat(timespec="seconds")
+                    stato["latenze_ms"].append(latenza_ms)
+                try:
+                    self.su_campione(contatore.nome, adesso, today_wh, week_wh, latenza_ms)
+                except Exception as e:  # un salvataggio fallito non deve fermare il polling
+                    print(f"[{contatore.nome}] salvataggio fallito: {e}", file=sys.stderr)
+                prossima += self._attesa(self.intervallo_s)
+                if prossima < time.monotonic():  # in ritardo di più di un giro: si riparte da adesso
+                    prossima = time.monotonic() + self._attesa(self.intervallo_s)
+        finally:
+            sessione.close()
+
+    def avvia(self):
+        for c in self.contatori:
+            t = threading.Thread(target=self._ciclo, args=(c,), name=f"poller-{c.nome}", daemon=True)
+            t.start()
+            self._thread.append(t)
+        return self
+
+    def ferma(self, timeout=None):
+        self._stop.set()
+        for t in self._thread:
+            t.join(timeout)
+
+    def metriche(self):
+        out = {}
+        with self._lock:
+            for nome, s in self._stato.items():
+                lat = sorted(s["latenze_ms"])
+                out[nome] = {k: v for k, v in s.items() if k != "latenze_ms"}
+                if lat:
+                    out[nome].update(latenza_p50_ms=round(lat[len(lat) // 2], 1),
+                                     latenza_p95_ms=round(lat[min(len(lat) - 1, int(len(lat) * 0.95))], 1),
+                                     latenza_max_ms=round(lat[-1], 1))
+        return out
+
+def _contatore_da_testo(testo):
+    """'nome=http://ip' -> Contatore (cookie di default)."""
+    nome, separatore, url = testo.partition("=")
+    if not separatore:
+        nome = url = testo
+    return Contatore(nome, url.rstrip("/"), COOKIES)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Polling dei contatori di energia")
+    ap.add_argument("--contatore", action="append", metavar="NOME=URL",
+                    help=f"contatore da leggere (ripetibile, default: {BASE_URL})")
+    ap.add_argument("--intervallo", type=float, default=INTERVALLO_S, help="secondi tra due letture")
+    ap.add_argument("--jitter", type=float, default=JITTER)
+    ap.add_argument("--timeout", type=float, default=TIMEOUT_S)
+    ap.add_argument("--durata", type=float, help="secondi di polling (default: finché non si interrompe)")
+    ap.add_argument("--stub", action="store_true", help="legge da un server di prova locale (stub_energia.py)")
+    ap.add_argument("--cartella", default=CARTELLA_DATI, help="dove salvare i campioni")
+    ap.add_argument("--formato", choices=FORMATI, default="csv", help="csv oppure record binari fissi")
+    ap.add_argument("--rotazione", choices=list(ROTAZIONI), default="mese", help="un file per giorno o per mese")
+    args = ap.parse_args(argv)
+
+    archivio = ArchivioCampioni(args.cartella, rotazione=args.rotazione, formato=args.formato)
+
+    server = None
+    if args.stub:
+        from stub_energia import avvia_stub
+        server = avvia_stub()
+        contatori = [Contatore("stub", f"http://127.0.0.1:{server.server_address[1]}", COOKIES)]
+    else:
+        contatori = [_contatore_da_testo(t) for t in args.contatore] if args.contatore else CONTATORI
+
+    def stampa(nome, ts, today, week, ms):
+        print(f"{ts:%Y-%m-%d %H:%M:%S} {nome}: oggi {today} Wh, settimana {week} Wh ({ms:.0f} ms)")
+        archivio.aggiungi(nome, ts, today, week, ms)
+
+    poller = Poller(contatori, stampa, intervallo_s=args.intervallo, jitter=args.jitter,
+                    timeout_s=args.timeout).avvia()
+    try:
+        if args.durata:
+            time.sleep(args.durata)
+        else:
+            while True:
+                time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        poller.ferma(timeout=args.timeout + 1)
+        archivio.chiudi()
+        if server:
+            server.shutdown()
+        print(json.dumps(poller.metriche(), indent=2))
+
+if __name__ == "__main__":
+    main()
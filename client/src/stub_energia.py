@@ -0,0 +1,71 @@
+"""
+Server HTTP di prova che imita /x/raw?total@read_energy del contatore:
+risponde 'ackdata:{"total": {"energy": {...}}}' con contatori che crescono a
+ogni lettura. Serve a provare fetch_live.Poller senza il contatore vero.
+
+    python stub_energia.py [--porta 8040] [--ritardo-ms 20] [--errori 0.1]
+"""
+import json, time, random, argparse, threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+class GestoreStub(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, come il contatore
+
+    def do_GET(self):
+        srv = self.server
+        with srv.lock:
+            srv.richieste += 1
+            srv.connessioni.add(self.client_address)
+            srv.today_wh += random.randint(0, 50)
+            srv.week_wh += random.randint(0, 50)
+            today, week = srv.today_wh, srv.week_wh
+        if srv.ritardo_ms:
+            time.sleep(srv.ritardo_ms / 1000)
+        if not self.path.startswith("/x/raw?total@read_energy"):
+            return self._rispondi(404, b"not found")
+        if random.random() < srv.errori:
+            return self._rispondi(503, b"busy")
+        if "key" not in self.headers.get("Cookie", ""):
+            return self._rispondi(403, b"forbidden")
+        corpo = {"total": {"energy": {"todaytotalenergy": str(today), "thisweektotalenergy": str(week)}}}
+        self._rispondi(200, b"ackdata:" + json.dumps(corpo).encode())
+
+    def _rispondi(self, codice, corpo):
+        self.send_response(codice)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        try:
+            self.wfile.write(corpo)
+        except (BrokenPipeError, ConnectionResetError):  # il client è andato in timeout prima
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+def avvia_stub(porta=0, ritardo_ms=0, errori=0.0):
+    """Avvia lo stub in un thread (porta 0 = libera) e ritorna il server; .shutdown() per fermarlo."""
+    server = ThreadingHTTPServer(("127.0.0.1", porta), GestoreStub)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.richieste = 0
+    server.connessioni = set()  # (ip, porta sorgente) visti: con keep-alive resta uno per contatore
+    server.today_wh, server.week_wh = 1000, 20000
+    server.ritardo_ms = ritardo_ms
+    server.errori = errori
+    threading.Thread(target=server.serve_forever, name="stub-energia", daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Stub del contatore di energia")
+    ap.add_argument("--porta", type=int, default=8040)
+    ap.add_argument("--ritardo-ms", type=float, default=0)
+    ap.add_argument("--errori", type=float, default=0.0, help="frazione di risposte 503")
+    args = ap.parse_args()
+    server = avvia_stub(args.porta, args.ritardo_ms, args.errori)
+    print(f"stub su http://127.0.0.1:{server.server_address[1]}/x/raw?total@read_energy")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -3,24 +3,122 @@ import os
 import json
 import datetime
 import shutil
+import time
+import threading
+_t_import = time.perf_counter()
 from openpyxl import load_workbook
 from openpyxl.styles import Alignment
+TEMPO_IMPORT_OPENPYXL_MS = round((time.perf_counter() - _t_import) * 1000, 2)
 import re
+import socket
+import logging
+from logging.handlers import RotatingFileHandler
+from contextlib import contextmanager
+from collections import OrderedDict, namedtuple
 
-LOG_PATH = os.path.join(os.path.dirname(__file__), "log_ddt.txt")
+# Configurabili da ambiente (server.js può passarli allo spawn):
+#   DDT_LOG_PATH   = file di log (default log_ddt.txt accanto allo script)
+#   DDT_LOG_LEVEL  = DEBUG | INFO (default) | WARNING | ERROR
+#   DDT_LOG_FORMAT = text (default) | json  -> una riga JSON per evento, con i campi extra
+LOG_PATH = os.environ.get("DDT_LOG_PATH") or os.path.join(os.path.dirname(__file__), "log_ddt.txt")
+LOG_LEVEL = os.environ.get("DDT_LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("DDT_LOG_FORMAT", "text").lower()
+LOG_MAX_BYTES = 1_000_000   # rotazione log_ddt.txt -> log_ddt.txt.1 ... .3
+LOG_BACKUP_COUNT = 3
+
+_logger = logging.getLogger("genera_excel_ddt")
+
+class _FormatterTesto(logging.Formatter):
+    """Stesso formato di sempre: "[YYYY-mm-dd HH:MM:SS] msg", "DEBUG " davanti ai debug."""
+
+    def format(self, record):
+        ts = datetime.datetime.fromtimestamp(record.created).strftime("%Y-%m-%d %H:%M:%S")
+        prefisso = "DEBUG " if record.levelno == logging.DEBUG else ""
+        return f"[{ts}] {prefisso}{record.getMessage()}"
+
+class _FormatterJson(logging.Formatter):
+    def format(self, record):
+        out = {
+            "ts": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "pid": record.process,
+            "msg": record.getMessage(),
+        }
+        out.update(getattr(record, "campi", None) or {})
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+class _RotatingFileHandlerSilenzioso(RotatingFileHandler):
+    # Il log non deve mai far fallire la scrittura del DDT (share lenta, file bloccato...)
+    def handleError(self, record):
+        pass
+
+def configura_log(stream=None, level=None, fmt=None):
+    """
+    (Ri)configura il logger del processo: un solo handle sul file (con rotazione)
+    più la console. In modalità worker `stream` è stderr, perché stdout è
+    riservato alle risposte JSON.
+    """
+    for h in list(_logger.handlers):
+        _logger.removeHandler(h)
+        h.close()
+    livello = getattr(logging, (level or LOG_LEVEL), logging.INFO)
+    formatter = _FormatterJson() if (fmt or LOG_FORMAT) == "json" else _FormatterTesto()
 
-def log(msg):
-    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    line = f"[{now}] {msg}\n"
     try:
-        with open(LOG_PATH, "a", encoding="utf-8") as f:
-            f.write(line)
+        fh = _RotatingFileHandlerSilenzioso(LOG_PATH, maxBytes=LOG_MAX_BYTES,
+                                            backupCount=LOG_BACKUP_COUNT, encoding="utf-8", delay=True)
+        fh.setFormatter(formatter)
+        _logger.addHandler(fh)
     except Exception:
         pass
-    print(line.strip())
+    ch = logging.StreamHandler(stream or sys.stdout)
+    ch.setFormatter(_FormatterTesto())
+    _logger.addHandler(ch)
+
+    _logger.setLevel(livello)
+    _logger.propagate = False
+
+def _assicura_log():
+    if not _logger.handlers:
+        configura_log()
+
+def log(msg, level=logging.INFO, **campi):
+    _assicura_log()
+    _logger.log(level, msg, extra={"campi": campi} if campi else None)
+
+def log_debug(msg, **campi):
+    log(msg, logging.DEBUG, **campi)
+
+def debug_attivo():
+    _assicura_log()
+    return _logger.isEnabledFor(logging.DEBUG)
 
 def log_non_eseguito(msg):
-    log(f"NON ESEGUITO: {msg}")
+    log(f"NON ESEGUITO: {msg}", logging.WARNING)
+
+# Fasi misurate: lettura_json, cartella, ricerca_pdf, attesa_lock, apertura_workbook,
+# dedup, scrittura, salvataggio (più import_openpyxl, una volta per processo)
+@contextmanager
+def fase(nome, tempi=None, **campi):
+    """
+    Misura una fase della pipeline e la registra (campi "fase"/"ms" nel formato json).
+    Se `tempi` è un dict, vi somma i ms sotto la chiave `nome`.
+    """
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        ms = round((time.perf_counter() - t0) * 1000, 2)
+        if tempi is not None:
+            tempi[nome] = round(tempi.get(nome, 0.0) + ms, 2)
+        log_debug(f"TEMPO {nome}: {ms} ms", fase=nome, ms=ms, **campi)
+
+def somma_tempi(*dizionari):
+    out = {}
+    for d in dizionari:
+        for k, v in (d or {}).items():
+            out[k] = round(out.get(k, 0.0) + v, 2)
+    return out
 
 def format_date_short(date_str):
     if not date_str:
@@ -118,86 +216,172 @@ def build_expected_filenames(numero_ddt, codice_commessa_norm, codice_commessa_r
             out.append(b + ".PDF")
     return out
 
+# ───────────────────────────────────────────────────────────────────────────────
+# Indice cartella MATERIALI: un solo os.listdir per cartella (su share SMB ogni
+# listdir/exists è un round trip di rete). Le ricerche per nome atteso e la
+# scansione regex lavorano sull'elenco in memoria.
+# Con CACHE_MATERIALI_ATTIVA (batch/worker) l'indice viene riusato finché
+# l'mtime della cartella non cambia: costa un solo stat invece di un listdir.
+# ───────────────────────────────────────────────────────────────────────────────
+CACHE_MATERIALI_ATTIVA = False
+CACHE_MATERIALI_MAX = 256
+_cache_materiali = OrderedDict()  # folder -> IndiceMateriali
+
+# Nome file DDT: DDT_<num4><W|T>_<codice>_<dd>[-_]<mm>[-_]<yyyy>[suffisso].pdf
+# Compilati una volta. Il codice può contenere a sua volta "_dd_mm_yyyy": si
+# tengono tutti i punti in cui nome si può dividere in codice + data, e
+# match_ddt_files sceglie quello col codice cercato, come le vecchie regex.
+_RE_NOME_DDT = re.compile(r'^DDT_(\d{4})([WT])_', re.IGNORECASE)
+_RE_DATA_DDT = re.compile(r'_(\d{2})[\-_](\d{2})[\-_](\d{4})(?:\D.*)?\.pdf$', re.IGNORECASE)
+
+# codice/data: la divisione col codice più corto; divisioni: tutte, dalla più corta
+VoceDDT = namedtuple("VoceDDT", "tipo numero codice data fname divisioni")
+
+def parse_nome_ddt(fname):
+    """
+    Scompone un nome file DDT in VoceDDT(tipo 'W'/'T', numero int,
+    codice casefold, (dd, mm, yyyy), fname, divisioni). None se il nome non è
+    un DDT. `divisioni` sono le coppie (codice, data) possibili, in ordine di
+    lunghezza del codice.
+    """
+    m = _RE_NOME_DDT.match(fname)
+    if not m:
+        return None
+    inizio = m.end()
+    divisioni = []
+    i = fname.find("_", inizio + 1)  # codice non vuoto
+    while i != -1:
+        d = _RE_DATA_DDT.match(fname, i)
+        if d:
+            divisioni.append((fname[inizio:i].casefold(), (d.group(1), d.group(2), d.group(3))))
+        i = fname.find("_", i + 1)
+    if not divisioni:
+        return None
+    codice, data = divisioni[0]
+    return VoceDDT(m.group(2).upper(), int(m.group(1)), codice, data, fname, tuple(divisioni))
+
+class IndiceMateriali:
+    def __init__(self, folder, mtime=None, files=None):
+        """`files`: elenco già letto (es. da os.scandir), evita un nuovo listdir."""
+        self.folder = folder
+        self.mtime = mtime
+        self.esiste = files is not None
+        self.files = list(files) if files is not None else []
+        if files is None:
+            try:
+                self.files = os.listdir(folder)
+                self.esiste = True
+            except FileNotFoundError:
+                log_debug(f"MATERIALI non presente: {folder}")  # caso normale, non un errore
+            except Exception as e:
+                log(f"ERRORE os.listdir: {e}", logging.ERROR)
+        # normcase: su Windows il confronto nomi è case-insensitive come os.path.exists
+        self._per_nome = {os.path.normcase(f): f for f in self.files}
+        self._voci = None
+        if debug_attivo():
+            preview = ", ".join(self.files[:20])
+            log_debug(f"MATERIALI contiene ({len(self.files)} file): {preview}{'...' if len(self.files)>20 else ''}")
+
+    @property
+    def voci(self):
+        """Nomi DDT già scomposti (parse una sola volta per file, al primo uso)."""
+        if self._voci is None:
+            self._voci = [v for v in map(parse_nome_ddt, self.files) if v]
+        return self._voci
+
+    def trova(self, fname):
+        """Percorso completo del file se presente nella cartella, altrimenti ''."""
+        reale = self._per_nome.get(os.path.normcase(fname))
+        return os.path.join(self.folder, reale) if reale else ""
+
+def _mtime_cartella(folder):
+    try:
+        return os.stat(folder).st_mtime_ns
+    except OSError:
+        return None
+
+def indice_materiali(folder):
+    if not CACHE_MATERIALI_ATTIVA:
+        return IndiceMateriali(folder)
+    mtime = _mtime_cartella(folder)
+    indice = _cache_materiali.get(folder)
+    if indice is not None and mtime is not None and indice.mtime == mtime:
+        _cache_materiali.move_to_end(folder)
+        return indice
+    indice = IndiceMateriali(folder, mtime)
+    if mtime is not None:
+        _cache_materiali[folder] = indice
+        _cache_materiali.move_to_end(folder)
+        while len(_cache_materiali) > CACHE_MATERIALI_MAX:
+            _cache_materiali.popitem(last=False)
+    return indice
+
 def match_ddt_files(folder, codice_norm, codice_raw):
     """
     Scansione robusta:
-    - pattern 1: RAW esatto (W_<raw>_dd-mm-yyyy)
-    - pattern 2: qualsiasi prefisso prima del codice NORMALIZZATO (W_.*<norm>_dd-mm-yyyy)
+    - RAW esatto (W_<raw>_dd-mm-yyyy)
+    - qualsiasi prefisso prima del codice NORMALIZZATO (W_.*<norm>_dd-mm-yyyy)
     Estensione .pdf/.PDF, case-insensitive, '-' o '_' nella data, permetti suffissi dopo la data.
+    I nomi sono già scomposti da parse_nome_ddt: qui si confrontano solo i codici.
+    Se il nome si divide in più modi vale, come nelle vecchie regex, il codice
+    uguale al RAW, altrimenti il più lungo che finisce col NORMALIZZATO.
+    `folder` può essere un percorso o un IndiceMateriali già costruito.
     Ritorna: liste [(num, fname, dd/mm/yyyy)] per ENTRATA (W) e USCITA (T).
     """
-    pats_entrata = []
-    pats_uscita = []
-    flags = re.IGNORECASE
-
-    if codice_raw:
-        pats_entrata.append(re.compile(
-            rf'^DDT_(\d{{4}})W_{re.escape(codice_raw)}_(\d{{2}})[\-_](\d{{2}})[\-_](\d{{4}})(?:\D.*)?\.pdf$',
-            flags
-        ))
-        pats_uscita.append(re.compile(
-            rf'^DDT_(\d{{4}})T_{re.escape(codice_raw)}_(\d{{2}})[\-_](\d{{2}})[\-_](\d{{4}})(?:\D.*)?\.pdf$',
-            flags
-        ))
-
-    if codice_norm:
-        pats_entrata.append(re.compile(
-            rf'^DDT_(\d{{4}})W_.*{re.escape(codice_norm)}_(\d{{2}})[\-_](\d{{2}})[\-_](\d{{4}})(?:\D.*)?\.pdf$',
-            flags
-        ))
-        pats_uscita.append(re.compile(
-            rf'^DDT_(\d{{4}})T_.*{re.escape(codice_norm)}_(\d{{2}})[\-_](\d{{2}})[\-_](\d{{4}})(?:\D.*)?\.pdf$',
-            flags
-        ))
-
     entrata, uscita = [], []
-    try:
-        files = os.listdir(folder)
-    except Exception as e:
-        log(f"ERRORE os.listdir: {e}")
+    indice = folder if isinstance(folder, IndiceMateriali) else indice_materiali(folder)
+
+    raw = str(codice_raw).casefold() if codice_raw else ""
+    norm = str(codice_norm).casefold() if codice_norm else ""
+    if not (raw or norm):
         return entrata, uscita
 
-    preview = ", ".join(files[:20])
-    log(f"DEBUG MATERIALI contiene ({len(files)} file): {preview}{'...' if len(files)>20 else ''}")
-
-    for fname in files:
-        for pat in pats_entrata:
-            m = pat.match(fname)
-            if m:
-                num = int(m.group(1))
-                g, mth, a = m.group(2), m.group(3), m.group(4)
-                entrata.append((num, fname, f"{g}/{mth}/{a}"))
-                break  # evita doppioni
-        for pat in pats_uscita:
-            m = pat.match(fname)
-            if m:
-                num = int(m.group(1))
-                g, mth, a = m.group(2), m.group(3), m.group(4)
-                uscita.append((num, fname, f"{g}/{mth}/{a}"))
-                break
+    for voce in indice.voci:
+        if len(voce.divisioni) == 1:  # caso normale: un solo modo di dividere il nome
+            c = voce.codice
+            data = voce.data if ((raw and c == raw) or (norm and c.endswith(norm))) else None
+        else:
+            data = next((d for c, d in voce.divisioni if c == raw), None) if raw else None
+            if data is None and norm:
+                data = next((d for c, d in reversed(voce.divisioni) if c.endswith(norm)), None)
+        if data is None:
+            continue
+        dd, mm, yyyy = data
+        (entrata if voce.tipo == "W" else uscita).append((voce.numero, voce.fname, f"{dd}/{mm}/{yyyy}"))
     return entrata, uscita
 
-def main():
-    if len(sys.argv) != 3:
-        print("Usage: genera_excel_ddt.py dati.json basePath", file=sys.stderr)
-        sys.exit(1)
+MESI_IT = ["", "GENNAIO", "FEBBRAIO", "MARZO", "APRILE", "MAGGIO", "GIUGNO",
+           "LUGLIO", "AGOSTO", "SETTEMBRE", "OTTOBRE", "NOVEMBRE", "DICEMBRE"]
 
-    dati_path = sys.argv[1]
-    base_path = sys.argv[2]
-    template_path = os.path.join(base_path, "Template", "DDT_Work.xlsx")
-
-    # --- Leggi dati JSON ---
-    with open(dati_path, "r", encoding="utf-8") as f:
-        dati = json.load(f)
+def leggi_payloads(path):
+    """
+    Legge i payload per la modalità batch: accetta sia un array JSON
+    sia un file JSON-lines (un oggetto per riga).
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        txt = f.read()
+    s = txt.strip()
+    if not s:
+        return []
+    if s.startswith("["):
+        return json.loads(s)
+    return [json.loads(line) for line in txt.splitlines() if line.strip()]
 
+def prepara_riga(dati, tempi=None):
+    """
+    Risolve i PDF DDT (entrata obbligatoria, uscita opzionale) e prepara
+    i valori della riga Excel. Non tocca il workbook.
+    Ritorna (riga, None) oppure (None, motivo) se il DDT entrata manca.
+    `tempi` (dict) raccoglie i ms delle fasi "cartella" e "ricerca_pdf".
+    """
     # Log ingresso
-    log(f"DEBUG DATI keys={list(dati.keys())}")
-    log(f"DEBUG nomeCommessa='{dati.get('nomeCommessa','')}' descrizione='{dati.get('descrizione','')}'")
+    log_debug(f"DATI keys={list(dati.keys())}")
+    log_debug(f"nomeCommessa='{dati.get('nomeCommessa','')}' descrizione='{dati.get('descrizione','')}'")
 
     # Nome commessa (visivo colonna D)
     sorgente_descr = dati.get("descrizione") or dati.get("nomeCommessa") or ""
     nome_commessa = estrai_nome_commessa_da_underscores(sorgente_descr)
-    log(f"DEBUG estrazione: sorgente='{sorgente_descr}' -> estratto='{nome_commessa}'")
+    log_debug(f"estrazione: sorgente='{sorgente_descr}' -> estratto='{nome_commessa}'")
 
     # Cartella MATERIALI
     folder_materiali = ""
@@ -206,12 +390,14 @@ def main():
     elif dati.get("folderPath", ""):
         folder_materiali = os.path.join(dati["folderPath"], "MATERIALI")
     folder_materiali = os.path.normpath(folder_materiali)
-    log(f"DEBUG folder_materiali='{folder_materiali}' esiste={os.path.isdir(folder_materiali)}")
+    with fase("cartella", tempi):
+        materiali = indice_materiali(folder_materiali)
+    log_debug(f"folder_materiali='{folder_materiali}' esiste={materiali.esiste}")
 
     # Codici commessa
     codice_commessa_raw = dati.get("codiceCommessa", "")
     codice_commessa_norm = normalizza_codice_commessa(codice_commessa_raw)
-    log(f"DEBUG codice_commessa_norm='{codice_commessa_norm}' (raw='{codice_commessa_raw}')")
+    log_debug(f"codice_commessa_norm='{codice_commessa_norm}' (raw='{codice_commessa_raw}')")
 
     # Dati DDT da JSON
     numero_ddt_json = (str(dati.get("numeroDdt", "")).strip() or str(dati.get("numeroDdtEntrata","")).strip())
@@ -224,82 +410,83 @@ def main():
     numero_ddt_entrata = ""
     data_ddt_entrata = ""
 
-    if os.path.isdir(folder_materiali):
-        # 1) Nomi attesi da numero + data, sia con raw che con norm
-        date_cmp = parse_date_components_any(data_ddt_json)
-        if date_cmp:
-            for cand in build_expected_filenames(numero_ddt_json, codice_commessa_norm, codice_commessa_raw, date_cmp):
-                cand_path = os.path.join(folder_materiali, cand)
-                if os.path.exists(cand_path):
-                    link_pdf_entrata = cand_path
-                    numero_ddt_entrata = re.search(r'DDT_(\d{4})W_', cand, re.IGNORECASE).group(1) + "W"
-                    dd, mm, yyyy = date_cmp
-                    data_ddt_entrata = f"{dd}/{mm}/{yyyy}"
-                    log(f"DEBUG match atteso ENTRATA: {cand}")
-                    break
+    # Scansione regex fatta al massimo una volta e condivisa tra ENTRATA e USCITA
+    candidati_regex = None
+
+    with fase("ricerca_pdf", tempi):
+        if materiali.esiste:
+            # 1) Nomi attesi da numero + data, sia con raw che con norm
+            date_cmp = parse_date_components_any(data_ddt_json)
+            if date_cmp:
+                for cand in build_expected_filenames(numero_ddt_json, codice_commessa_norm, codice_commessa_raw, date_cmp):
+                    cand_path = materiali.trova(cand)
+                    if cand_path:
+                        link_pdf_entrata = cand_path
+                        numero_ddt_entrata = re.search(r'DDT_(\d{4})W_', cand, re.IGNORECASE).group(1) + "W"
+                        dd, mm, yyyy = date_cmp
+                        data_ddt_entrata = f"{dd}/{mm}/{yyyy}"
+                        log_debug(f"match atteso ENTRATA: {cand}")
+                        break
 
-        # 2) Scansione regex permissiva (raw esatto oppure qualunque prefisso + code norm)
-        if not link_pdf_entrata:
-            pdf_entrata_candidates, pdf_uscita_candidates = match_ddt_files(
-                folder_materiali, codice_commessa_norm, codice_commessa_raw
-            )
-            if pdf_entrata_candidates:
-                pdf_entrata_candidates.sort(reverse=True)  # prendo il numero più alto
-                num_w, fname_w, data_w = pdf_entrata_candidates[0]
-                link_pdf_entrata = os.path.join(folder_materiali, fname_w)
-                numero_ddt_entrata = f"{str(num_w).zfill(4)}W"
-                data_ddt_entrata = data_w
-                log(f"DEBUG match regex ENTRATA: {fname_w}")
+            # 2) Scansione regex permissiva (raw esatto oppure qualunque prefisso + code norm)
+            if not link_pdf_entrata:
+                candidati_regex = match_ddt_files(materiali, codice_commessa_norm, codice_commessa_raw)
+                pdf_entrata_candidates = list(candidati_regex[0])
+                if pdf_entrata_candidates:
+                    pdf_entrata_candidates.sort(reverse=True)  # prendo il numero più alto
+                    num_w, fname_w, data_w = pdf_entrata_candidates[0]
+                    link_pdf_entrata = os.path.join(folder_materiali, fname_w)
+                    numero_ddt_entrata = f"{str(num_w).zfill(4)}W"
+                    data_ddt_entrata = data_w
+                    log_debug(f"match regex ENTRATA: {fname_w}")
 
     # Obbligatorio: se non trovo ENTRATA, esco
-    if not link_pdf_entrata or not os.path.exists(link_pdf_entrata):
-        log_non_eseguito(f"Excel DDT NON aggiornato: DDT Entrata NON trovato (folder='{folder_materiali}')")
-        return
+    if not link_pdf_entrata:
+        return None, f"Excel DDT NON aggiornato: DDT Entrata NON trovato (folder='{folder_materiali}')"
 
     # ------------ TROVA PDF USCITA (OPZIONALE) ------------
     link_pdf_uscita = ""
     numero_ddt_uscita = ""
     data_ddt_uscita = ""
 
-    if os.path.isdir(folder_materiali):
-        # tentativo da JSON
-        date_cmp_u = parse_date_components_any(data_ddt_uscita_json)
-        if date_cmp_u and num_ddt_uscita_json:
-            dd, mm, yyyy = date_cmp_u
-            num4 = f"{int(str(num_ddt_uscita_json)) :04d}" if str(num_ddt_uscita_json).isdigit() else f"{str(num_ddt_uscita_json):0>4}"
-            candidates = [
-                f"DDT_{num4}T_{codice_commessa_raw}_{dd}-{mm}-{yyyy}.pdf",
-                f"DDT_{num4}T_{codice_commessa_raw}_{dd}_{mm}_{yyyy}.pdf",
-                f"DDT_{num4}T_{codice_commessa_norm}_{dd}-{mm}-{yyyy}.pdf",
-                f"DDT_{num4}T_{codice_commessa_norm}_{dd}_{mm}_{yyyy}.pdf",
-                f"DDT_{num4}T_{codice_commessa_raw}_{dd}-{mm}-{yyyy}.PDF",
-                f"DDT_{num4}T_{codice_commessa_raw}_{dd}_{mm}_{yyyy}.PDF",
-                f"DDT_{num4}T_{codice_commessa_norm}_{dd}-{mm}-{yyyy}.PDF",
-                f"DDT_{num4}T_{codice_commessa_norm}_{dd}_{mm}_{yyyy}.PDF",
-            ]
-            for cand in candidates:
-                p = os.path.join(folder_materiali, cand)
-                if os.path.exists(p):
-                    link_pdf_uscita = p
-                    numero_ddt_uscita = f"{num4}T"
-                    data_ddt_uscita = f"{dd}/{mm}/{yyyy}"
-                    log(f"DEBUG match atteso USCITA: {cand}")
-                    break
+    with fase("ricerca_pdf", tempi):
+        if materiali.esiste:
+            # tentativo da JSON
+            date_cmp_u = parse_date_components_any(data_ddt_uscita_json)
+            if date_cmp_u and num_ddt_uscita_json:
+                dd, mm, yyyy = date_cmp_u
+                num4 = f"{int(str(num_ddt_uscita_json)) :04d}" if str(num_ddt_uscita_json).isdigit() else f"{str(num_ddt_uscita_json):0>4}"
+                candidates = [
+                    f"DDT_{num4}T_{codice_commessa_raw}_{dd}-{mm}-{yyyy}.pdf",
+                    f"DDT_{num4}T_{codice_commessa_raw}_{dd}_{mm}_{yyyy}.pdf",
+                    f"DDT_{num4}T_{codice_commessa_norm}_{dd}-{mm}-{yyyy}.pdf",
+                    f"DDT_{num4}T_{codice_commessa_norm}_{dd}_{mm}_{yyyy}.pdf",
+                    f"DDT_{num4}T_{codice_commessa_raw}_{dd}-{mm}-{yyyy}.PDF",
+                    f"DDT_{num4}T_{codice_commessa_raw}_{dd}_{mm}_{yyyy}.PDF",
+                    f"DDT_{num4}T_{codice_commessa_norm}_{dd}-{mm}-{yyyy}.PDF",
+                    f"DDT_{num4}T_{codice_commessa_norm}_{dd}_{mm}_{yyyy}.PDF",
+                ]
+                for cand in candidates:
+                    p = materiali.trova(cand)
+                    if p:
+                        link_pdf_uscita = p
+                        numero_ddt_uscita = f"{num4}T"
+                        data_ddt_uscita = f"{dd}/{mm}/{yyyy}"
+                        log_debug(f"match atteso USCITA: {cand}")
+                        break
 
-        # regex permissiva
-        if not numero_ddt_uscita:
-            ent, usc = match_ddt_files(folder_materiali, codice_commessa_norm, codice_commessa_raw)
-            if usc:
-                usc.sort(reverse=True)
-                num_t, fname_t, data_t = usc[0]
-                link_pdf_uscita = os.path.join(folder_materiali, fname_t)
-                numero_ddt_uscita = f"{str(num_t).zfill(4)}T"
-                data_ddt_uscita = data_t
-                log(f"DEBUG match regex USCITA: {fname_t}")
-
-    # ------------ PREPARA EXCEL ------------
-    data_ddt_entrata_short = format_date_short(data_ddt_entrata)
-    data_ddt_uscita_short = format_date_short(data_ddt_uscita)
+            # regex permissiva
+            if not numero_ddt_uscita:
+                if candidati_regex is None:
+                    candidati_regex = match_ddt_files(materiali, codice_commessa_norm, codice_commessa_raw)
+                usc = list(candidati_regex[1])
+                if usc:
+                    usc.sort(reverse=True)
+                    num_t, fname_t, data_t = usc[0]
+                    link_pdf_uscita = os.path.join(folder_materiali, fname_t)
+                    numero_ddt_uscita = f"{str(num_t).zfill(4)}T"
+                    data_ddt_uscita = data_t
+                    log_debug(f"match regex USCITA: {fname_t}")
 
     # Mese/anno per file e intestazione
     try:
@@ -309,90 +496,968 @@ def main():
         mese = f"{now.month:02d}"
         anno = str(now.year)
 
-    file_name = f"DDT_Work_{mese}_{anno}.xlsx"
-    file_path = os.path.join(base_path, file_name)
+    # Prezzo vendita unitario
+    prezzo_vendita = dati.get("prezzoVendita", 0)
+    prezzo_vendita_num = _parse_float_safe(prezzo_vendita, default=0.0)
+    log_debug(f"prezzoVendita ricevuto='{prezzo_vendita}' -> usato={prezzo_vendita_num}")
+
+    riga = {
+        "mese": mese,
+        "anno": anno,
+        "data_ddt_entrata_short": format_date_short(data_ddt_entrata),
+        "numero_ddt_entrata": numero_ddt_entrata,
+        "codice_commessa": normalizza_codice_commessa(dati.get("codiceCommessa", "")),  # C8888-11 in chiaro
+        "nome": nome_commessa if nome_commessa else "(NO NOME)",
+        "quantita": _parse_float_safe(dati.get("quantita"), default=""),
+        "colli": dati.get("colli", ""),
+        "numero_ddt_uscita": numero_ddt_uscita,
+        "data_ddt_uscita_short": format_date_short(data_ddt_uscita),
+        "link_pdf_entrata": link_pdf_entrata,
+        "link_pdf_uscita": link_pdf_uscita,
+        "ore": _parse_float_safe(dati.get("oreLavorazione"), default=""),
+        "prezzo_vendita": prezzo_vendita_num,
+    }
+    return riga, None
+
+def percorso_workbook(base_path, mese, anno):
+    return os.path.join(base_path, f"DDT_Work_{mese}_{anno}.xlsx")
+
+def apri_workbook(base_path, mese, anno):
+    """
+    Apre (o crea dal Template) il DDT_Work_MM_YYYY.xlsx del mese.
+    Solleva FileNotFoundError se manca il template.
+    """
+    file_path = percorso_workbook(base_path, mese, anno)
+    template_path = os.path.join(base_path, "Template", "DDT_Work.xlsx")
 
     if not os.path.exists(file_path):
         if not os.path.exists(template_path):
-            print("Template non trovato:", template_path, file=sys.stderr)
-            sys.exit(2)
+            raise FileNotFoundError(template_path)
         shutil.copy(template_path, file_path)
 
     wb = load_workbook(file_path)
     ws = wb.active
+    ws["A1"] = f"DDT Work Report {MESI_IT[int(mese)]} {anno}"
+    return wb, ws, file_path
+
+# ───────────────────────────────────────────────────────────────────────────────
+# Scritture concorrenti sullo stesso DDT_Work_MM_YYYY.xlsx (più utenti insieme):
+# - lock file "<xlsx>.lock" creato in esclusiva, con timeout e pulizia se stale
+# - salvataggio su file temporaneo + os.replace: mai un xlsx scritto a metà
+# - coda "<xlsx>.coda/": solo chi NON ottiene il lock lascia la sua riga in coda, e chi
+#   tiene il lock applica anche le righe in coda nello stesso load/save; le voci
+#   prese in carico passano da <id>.json a <id>.in_corso (rename atomico), così
+#   chi va in timeout ritira solo righe che nessuno sta ancora scrivendo
+# - chi tiene il lock ne aggiorna l'mtime ogni LOCK_HEARTBEAT_S: un lock che chi
+#   aspetta vede fermo per più di LOCK_STALE_S (misurati col proprio orologio
+#   monotono, mai confrontando orologi di PC diversi) è di un processo morto o
+#   ucciso (es. worker killato da server.js) e si rimuove ben prima che scada
+#   LOCK_TIMEOUT_S di chi aspetta
+# ───────────────────────────────────────────────────────────────────────────────
+# attesa massima del lock / dell'esito in coda; server.js legge la stessa variabile per il suo timeout
+LOCK_TIMEOUT_S = float(os.environ.get("DDT_LOCK_TIMEOUT_S", "60"))
+LOCK_STALE_S = 20       # lock visto fermo da così tanto = processo morto, si può rimuovere
+LOCK_HEARTBEAT_S = 5    # ogni quanto chi tiene il lock ne aggiorna l'mtime
+ATTESA_POLL_S = 0.1
+
+class WorkbookOccupato(TimeoutError):
+    pass
+
+# lock -> ((mtime_ns, size), time.monotonic() della prima volta che l'ho visto così)
+_lock_osservati = {}
+
+class LockWorkbook:
+    def __init__(self, file_path, timeout=LOCK_TIMEOUT_S, stale=LOCK_STALE_S):
+        self.path = file_path + ".lock"
+        self.timeout = timeout
+        self.stale = stale
+        self.acquisito = False
+        self._fine_heartbeat = None
+
+    def _stale(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return True
+        # L'mtime è dell'orologio di chi tiene il lock (o della share): non lo confronto col
+        # mio, guardo solo da quanto tempo non cambia più
+        firma = (st.st_mtime_ns, st.st_size)
+        adesso = time.monotonic()
+        visto = _lock_osservati.get(self.path)
+        if visto is None or visto[0] != firma:
+            _lock_osservati[self.path] = (firma, adesso)
+        elif adesso - visto[1] > self.stale:
+            return True
+        # Stesso PC e processo non più vivo (os.kill(pid, 0) su Windows termina il processo: solo POSIX)
+        if os.name != "nt":
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    info = json.load(f)
+                if info.get("host") == socket.gethostname():
+                    os.kill(int(info["pid"]), 0)
+            except ProcessLookupError:
+                return True
+            except Exception:
+                pass
+        return False
+
+    def prova(self):
+        """Un solo tentativo, non bloccante. True se il lock è nostro."""
+        for _ in range(2):
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self._stale():
+                    return False
+                log(f"Lock stale rimosso: {self.path}", logging.WARNING)
+                _lock_osservati.pop(self.path, None)
+                try:
+                    os.remove(self.path)
+                except OSError:
+                    pass
+                continue
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"pid": os.getpid(), "host": socket.gethostname(),
+                           "ts": datetime.datetime.now().isoformat(timespec="seconds")}, f)
+            _lock_osservati.pop(self.path, None)
+            self.acquisito = True
+            self._avvia_heartbeat()
+            return True
+        return False
+
+    def _avvia_heartbeat(self):
+        fine = self._fine_heartbeat = threading.Event()
+        def battito():
+            while not fine.wait(LOCK_HEARTBEAT_S):
+                try:
+                    os.utime(self.path)
+                except OSError:
+                    pass
+        threading.Thread(target=battito, name="heartbeat-lock", daemon=True).start()
+
+    def acquisisci(self):
+        limite = time.monotonic() + self.timeout
+        while not self.prova():
+            if time.monotonic() >= limite:
+                raise WorkbookOccupato(f"Workbook occupato da altro processo: {self.path}")
+            time.sleep(ATTESA_POLL_S)
+
+    def rilascia(self):
+        if self._fine_heartbeat is not None:
+            self._fine_heartbeat.set()
+            self._fine_heartbeat = None
+        if self.acquisito:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            self.acquisito = False
+
+    def __enter__(self):
+        self.acquisisci()
+        return self
+
+    def __exit__(self, *exc):
+        self.rilascia()
+
+def salva_atomico(wb, file_path, tentativi=5):
+    """Salva su un temporaneo nella stessa cartella e lo sostituisce all'originale."""
+    tmp = f"{file_path}.{os.getpid()}.tmp"
+    wb.save(tmp)
+    for n in range(tentativi):
+        try:
+            os.replace(tmp, file_path)
+            return
+        except PermissionError:
+            # Su Windows fallisce se il file è aperto (es. in Excel): riprovo un po'
+            if n == tentativi - 1:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+                raise
+            time.sleep(0.5)
+
+def _cartella_coda(file_path):
+    return file_path + ".coda"
 
-    mesi_it = ["", "GENNAIO", "FEBBRAIO", "MARZO", "APRILE", "MAGGIO", "GIUGNO",
-               "LUGLIO", "AGOSTO", "SETTEMBRE", "OTTOBRE", "NOVEMBRE", "DICEMBRE"]
-    ws["A1"] = f"DDT Work Report {mesi_it[int(mese)]} {anno}"
+def _scrivi_json_atomico(path, obj):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False)
+    os.replace(tmp, path)
 
-       # Dedup: se esiste già una riga con lo stesso Numero DDT ENTRATA (col. B)
-    # oppure lo stesso hyperlink del PDF (col. I), sovrascrivo quella riga
-    existing_row = None
+def _rimuovi_cartella_coda(file_path):
+    """Toglie "<xlsx>.coda" se è vuota (altrimenti os.rmdir fallisce e resta)."""
     try:
-        maxr = ws.max_row or 5
-        for r in range(5, maxr + 1):
-            # match su Numero DDT (es. "0078W")
-            valB = ws[f"B{r}"].value
-            if valB and str(valB).strip() == str(numero_ddt_entrata).strip():
-                existing_row = r
-                break
-            # match su hyperlink (target) in colonna I
+        os.rmdir(_cartella_coda(file_path))
+    except OSError:
+        pass
+
+def accoda_riga(file_path, riga):
+    """Lascia la riga nella coda del workbook. Ritorna l'id della voce."""
+    cartella = _cartella_coda(file_path)
+    id_voce = f"{time.time_ns()}-{os.getpid()}-{os.urandom(3).hex()}"
+    for n in range(3):
+        os.makedirs(cartella, exist_ok=True)
+        try:
+            _scrivi_json_atomico(os.path.join(cartella, id_voce + ".json"), riga)
+            return id_voce
+        except FileNotFoundError:
+            if n == 2:  # cartella vuota rimossa da un altro processo tra makedirs e scrittura
+                raise
+
+def leggi_coda(file_path):
+    """
+    Solo per chi tiene il lock: prende in carico le voci in coda ([(id, riga)] in
+    ordine di arrivo) rinominandole in .in_corso; una voce già ritirata dal suo
+    processo non viene presa. Riprende anche le .in_corso rimaste da un processo
+    morto col lock in mano. Le voci restano su disco finché non c'è un esito.
+    """
+    cartella = _cartella_coda(file_path)
+    try:
+        nomi = sorted(n for n in os.listdir(cartella) if n.endswith((".json", ".in_corso")))
+    except FileNotFoundError:
+        return []
+    out = []
+    for nome in nomi:
+        id_voce = nome.rsplit(".", 1)[0]
+        in_corso = os.path.join(cartella, id_voce + ".in_corso")
+        if nome.endswith(".json"):
             try:
-                hl = ws[f"I{r}"].hyperlink
+                os.replace(os.path.join(cartella, nome), in_corso)
+            except OSError:
+                continue  # ritirata nel frattempo
+        try:
+            with open(in_corso, "r", encoding="utf-8") as f:
+                out.append((id_voce, json.load(f)))
+        except (OSError, ValueError) as e:
+            chiudi_voce_coda(file_path, id_voce, {"ok": False, "file": file_path,
+                                                  "error": f"Voce in coda illeggibile: {e}"})
+    return out
+
+def chiudi_voce_coda(file_path, id_voce, esito):
+    cartella = _cartella_coda(file_path)
+    _scrivi_json_atomico(os.path.join(cartella, id_voce + ".esito"), esito)
+    try:
+        os.remove(os.path.join(cartella, id_voce + ".in_corso"))
+    except OSError:
+        pass
+
+def scarta_voce_coda(file_path, id_voce):
+    """Toglie una voce presa in carico senza scrivere l'esito (la riga è del processo che scrive)."""
+    try:
+        os.remove(os.path.join(_cartella_coda(file_path), id_voce + ".in_corso"))
+    except OSError:
+        pass
+    _rimuovi_cartella_coda(file_path)
+
+def leggi_esito(file_path, id_voce):
+    path = os.path.join(_cartella_coda(file_path), id_voce + ".esito")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            esito = json.load(f)
+    except (OSError, ValueError):
+        return None
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    _rimuovi_cartella_coda(file_path)
+    return esito
+
+def ritira_voce_coda(file_path, id_voce):
+    """
+    True se la voce era ancora in coda (nessuno l'ha presa): ritirata. False se
+    è già .in_corso: l'esito arriverà da chi tiene il lock.
+    """
+    try:
+        os.remove(os.path.join(_cartella_coda(file_path), id_voce + ".json"))
+    except OSError:
+        return False
+    _rimuovi_cartella_coda(file_path)
+    return True
+
+def _testo_errore(e):
+    return f"Template non trovato: {e}" if isinstance(e, FileNotFoundError) else f"{type(e).__name__}: {e}"
+
+def aggiorna_workbook(base_path, mese, anno, righe, cache=None, tempi=None, tempi_righe=None,
+                      lock_timeout=LOCK_TIMEOUT_S, propria=None):
+    """
+    Sotto lock: apre il workbook del mese (dalla cache se c'è), applica `righe`
+    e poi le righe lasciate in coda da altri processi, salva in modo atomico e
+    scrive l'esito per ogni voce della coda. Un solo load/save per tutte; se
+    non c'è niente da scrivere il workbook non si apre nemmeno.
+    `propria`: id di una voce che il chiamante stesso ha messo in coda
+    (scrivi_con_coda); se nessuno l'ha ancora presa viene scritta dopo `righe`
+    come riga nostra, senza esito su disco.
+    Ritorna (file_path, [riga Excel scritta per ogni elemento di `righe`, più
+    quella di `propria` se scritta qui]).
+    Solleva WorkbookOccupato se il lock non arriva entro `lock_timeout`.
+    """
+    file_path = percorso_workbook(base_path, mese, anno)
+    righe = list(righe)
+    tempi_righe = list(tempi_righe or [tempi] * len(righe))
+    lock = LockWorkbook(file_path, timeout=lock_timeout)
+    with fase("attesa_lock", tempi, file=file_path):
+        lock.acquisisci()
+    try:
+        in_coda = leggi_coda(file_path)
+        nostre = [(id_voce, riga) for id_voce, riga in in_coda if id_voce == propria]
+        in_coda = [(id_voce, riga) for id_voce, riga in in_coda if id_voce != propria]
+        righe += [riga for _, riga in nostre]
+        tempi_righe += [tempi] * len(nostre)
+        if not righe and not in_coda:
+            return file_path, []
+        try:
+            with fase("apertura_workbook", tempi, file=file_path):
+                if cache is not None:
+                    wb, ws, file_path = cache.apri(base_path, mese, anno)
+                else:
+                    wb, ws, file_path = apri_workbook(base_path, mese, anno)
+            with fase("dedup", tempi):
+                indice = cache.indice(file_path) if cache is not None else IndiceRighe(ws)
+            rows = [scrivi_riga(ws, riga, indice, t) for riga, t in zip(righe, tempi_righe)]
+            rows_coda = [scrivi_riga(ws, riga, indice, tempi) for _, riga in in_coda]
+            with fase("salvataggio", tempi, file=file_path):
+                if cache is not None:
+                    cache.salva(file_path)
+                else:
+                    salva_atomico(wb, file_path)
+        except Exception as e:
+            if cache is not None:
+                cache.scarta(file_path)  # stato in memoria non più affidabile
+            for id_voce, _ in nostre + in_coda:
+                chiudi_voce_coda(file_path, id_voce, {"ok": False, "file": file_path, "error": _testo_errore(e)})
+            raise
+        for id_voce, _ in nostre:
+            scarta_voce_coda(file_path, id_voce)
+        for (id_voce, _), row in zip(in_coda, rows_coda):
+            chiudi_voce_coda(file_path, id_voce, {"ok": True, "file": file_path, "row": row})
+        if in_coda:
+            log(f"CODA: {len(in_coda)} righe di altri processi unite al salvataggio di {os.path.basename(file_path)}")
+        return file_path, rows
+    finally:
+        lock.rilascia()
+
+def scrivi_con_coda(base_path, riga, tempi=None, timeout=LOCK_TIMEOUT_S):
+    """
+    Percorso per il processo singolo. Con il lock libero la riga si scrive
+    subito (nessun file di coda sulla share); se è occupato la riga va in coda e
+    la scrive chi tiene il lock insieme alle sue, oppure noi appena si libera.
+    Ritorna l'esito {"ok", "file", "row" | "error"} della nostra riga.
+    Se scade il timeout mentre la riga è già in lavorazione da un altro processo
+    si continua ad aspettarne l'esito; altrimenti la voce viene ritirata.
+    """
+    mese, anno = riga["mese"], riga["anno"]
+    file_path = percorso_workbook(base_path, mese, anno)
+    id_voce = None
+    limite = time.monotonic() + timeout
+    while True:
+        try:
+            _, rows = aggiorna_workbook(base_path, mese, anno, [riga] if id_voce is None else [],
+                                        tempi=tempi, lock_timeout=0, propria=id_voce)
+            if rows:
+                return {"ok": True, "file": file_path, "row": rows[0]}
+            # la nostra voce l'ha presa un altro processo: l'esito è o sarà su disco
+        except WorkbookOccupato:
+            if id_voce is None:
+                id_voce = accoda_riga(file_path, riga)
+                continue  # riprovo subito: il lock può essersi liberato intanto
+        except Exception as e:
+            if id_voce is None or ritira_voce_coda(file_path, id_voce):
+                return {"ok": False, "file": file_path, "error": _testo_errore(e)}
+            # voce già presa in carico (anche da noi): l'esito, anche d'errore, è o sarà su disco
+        esito = leggi_esito(file_path, id_voce)
+        if esito is not None:
+            return esito
+        if time.monotonic() >= limite and ritira_voce_coda(file_path, id_voce):
+            raise WorkbookOccupato(f"Timeout in coda dopo {timeout}s: {file_path}")
+        time.sleep(ATTESA_POLL_S)
+
+class IndiceRighe:
+    """
+    Indice delle righe dati (dalla 5 in giù) di un foglio DDT_Work, costruito
+    con una sola passata e aggiornato a ogni upsert:
+    - Numero DDT entrata (col. B) -> riga
+    - target hyperlink del PDF (col. I, normcase) -> riga
+    - prima riga libera (col. A vuota)
+    A parità di chiavi vale la prima riga, come nella vecchia scansione lineare.
+    """
+
+    PRIMA_RIGA = 5
+
+    def __init__(self, ws):
+        self.per_numero = {}
+        self.per_link = {}
+        self.chiavi_riga = {}  # riga -> (chiave numero, chiave link)
+        self.libera = None
+        maxr = max(ws.max_row or self.PRIMA_RIGA, self.PRIMA_RIGA)
+        r = self.PRIMA_RIGA
+        for cells in ws.iter_rows(min_row=self.PRIMA_RIGA, max_row=maxr, min_col=1, max_col=9):
+            valA, valB, cellI = cells[0].value, cells[1].value, cells[8]
+            if self.libera is None and not valA:
+                self.libera = r
+            k_num = str(valB).strip() if valB else None
+            if k_num:
+                self.per_numero.setdefault(k_num, r)
+            k_link = None
+            try:
+                hl = cellI.hyperlink
                 target = getattr(hl, "target", None) if hl else None
-                if target and os.path.normcase(target) == os.path.normcase(link_pdf_entrata):
-                    existing_row = r
-                    break
+                if target:
+                    k_link = os.path.normcase(target)
+                    self.per_link.setdefault(k_link, r)
             except Exception:
                 pass
-    except Exception:
-        pass
+            if k_num or k_link:
+                self.chiavi_riga[r] = (k_num, k_link)
+            r += 1
+        if self.libera is None:
+            self.libera = maxr + 1
+
+    def trova(self, numero_ddt, link_pdf):
+        righe = []
+        if numero_ddt:
+            r = self.per_numero.get(str(numero_ddt).strip())
+            if r:
+                righe.append(r)
+        if link_pdf:
+            r = self.per_link.get(os.path.normcase(link_pdf))
+            if r:
+                righe.append(r)
+        return min(righe) if righe else None
+
+    def registra(self, ws, row, numero_ddt, link_pdf):
+        # Rimuovo le chiavi vecchie che puntavano a questa riga
+        old_num, old_link = self.chiavi_riga.get(row, (None, None))
+        if old_num and self.per_numero.get(old_num) == row:
+            del self.per_numero[old_num]
+        if old_link and self.per_link.get(old_link) == row:
+            del self.per_link[old_link]
+        k_num = str(numero_ddt).strip() if numero_ddt else None
+        k_link = os.path.normcase(link_pdf) if link_pdf else None
+        if k_num and self.per_numero.get(k_num, row + 1) > row:
+            self.per_numero[k_num] = row
+        if k_link and self.per_link.get(k_link, row + 1) > row:
+            self.per_link[k_link] = row
+        self.chiavi_riga[row] = (k_num, k_link)
+        if row == self.libera:
+            r = row + 1
+            while ws[f"A{r}"].value:
+                r += 1
+            self.libera = r
+
+def scrivi_riga(ws, riga, indice=None, tempi=None):
+    """
+    Upsert della riga nel foglio: se esiste già una riga con lo stesso
+    Numero DDT ENTRATA (col. B) o lo stesso hyperlink del PDF (col. I)
+    la sovrascrive, altrimenti scrive nella prima riga libera.
+    `indice` (IndiceRighe) va riusato tra più scritture sullo stesso foglio;
+    se assente viene costruito al volo.
+    `tempi` (dict) raccoglie i ms delle fasi "dedup" e "scrittura".
+    Ritorna il numero di riga scritto.
+    """
+    numero_ddt_entrata = riga["numero_ddt_entrata"]
+    link_pdf_entrata = riga["link_pdf_entrata"]
+    with fase("dedup", tempi):
+        if indice is None:
+            indice = IndiceRighe(ws)
+        existing_row = indice.trova(numero_ddt_entrata, link_pdf_entrata)
 
     if existing_row:
         row = existing_row
-        log(f"DEBUG dedupe: sovrascrivo riga esistente {row} per DDT {numero_ddt_entrata}")
+        log_debug(f"dedupe: sovrascrivo riga esistente {row} per DDT {numero_ddt_entrata}")
     else:
         # Prima riga libera
-        row = 5
-        while ws[f"A{row}"].value:
-            row += 1
-        log(f"DEBUG dedupe: nessuna riga esistente, scrivo in nuova riga {row}")
+        row = indice.libera
+        log_debug(f"dedupe: nessuna riga esistente, scrivo in nuova riga {row}")
 
+    with fase("scrittura", tempi):
+        # Scrivi riga
+        ws[f"A{row}"] = riga["data_ddt_entrata_short"]
+        ws[f"B{row}"] = numero_ddt_entrata
+        ws[f"C{row}"] = riga["codice_commessa"]
+        ws[f"D{row}"] = riga["nome"]
+        ws[f"E{row}"] = riga["quantita"]
+        ws[f"F{row}"] = riga["colli"]
+        ws[f"G{row}"] = riga["numero_ddt_uscita"]
+        ws[f"H{row}"] = riga["data_ddt_uscita_short"]
 
-    # Nome visivo
-    valore_nome = nome_commessa if nome_commessa else "(NO NOME)"
+        cell = ws[f"I{row}"]; cell.value = "Apri"; cell.hyperlink = link_pdf_entrata; cell.style = "Hyperlink"
 
-    # Prezzo vendita unitario
-    prezzo_vendita = dati.get("prezzoVendita", 0)
-    prezzo_vendita_num = _parse_float_safe(prezzo_vendita, default=0.0)
-    log(f"DEBUG prezzoVendita ricevuto='{prezzo_vendita}' -> usato={prezzo_vendita_num}")
-
-    # Scrivi riga
-    ws[f"A{row}"] = data_ddt_entrata_short
-    ws[f"B{row}"] = numero_ddt_entrata
-    ws[f"C{row}"] = normalizza_codice_commessa(dati.get("codiceCommessa", ""))  # C8888-11 in chiaro
-    ws[f"D{row}"] = valore_nome
-    ws[f"E{row}"] = _parse_float_safe(dati.get("quantita"), default="")
-    ws[f"F{row}"] = dati.get("colli", "")
-    ws[f"G{row}"] = numero_ddt_uscita
-    ws[f"H{row}"] = data_ddt_uscita_short
-
-    cell = ws[f"I{row}"]; cell.value = "Apri"; cell.hyperlink = link_pdf_entrata; cell.style = "Hyperlink"
-
-    ore = dati.get("oreLavorazione")
-    ws[f"J{row}"] = _parse_float_safe(ore, default="")
-
-    ws[f"K{row}"] = f'=IF(E{row}<>0,L{row}/E{row},"")'
-    ws[f"L{row}"] = f'=M{row}*J{row}'
-    ws[f"M{row}"] = ""
-    ws[f"N{row}"] = prezzo_vendita_num
-
-    # Allinea
-    for col in "ABCDEFGHIJKLMN":
-        ws[f"{col}{row}"].alignment = Alignment(horizontal="center")
-
-    wb.save(file_path)
-    log(f"OK: scritto su {file_path} (riga {row}) | NomeCommessa='{valore_nome}' | Codice='{normalizza_codice_commessa(dati.get('codiceCommessa',''))}' | PrezzoVendita={prezzo_vendita_num} | PDF_IN='{os.path.basename(link_pdf_entrata)}'")
+        ws[f"J{row}"] = riga["ore"]
+
+        ws[f"K{row}"] = f'=IF(E{row}<>0,L{row}/E{row},"")'
+        ws[f"L{row}"] = f'=M{row}*J{row}'
+        ws[f"M{row}"] = ""
+        ws[f"N{row}"] = riga["prezzo_vendita"]
+
+        # Allinea
+        for col in "ABCDEFGHIJKLMN":
+            ws[f"{col}{row}"].alignment = Alignment(horizontal="center")
+
+    indice.registra(ws, row, numero_ddt_entrata, link_pdf_entrata)
+    return row
+
+def log_ok(file_path, row, riga, tempi=None):
+    msg = f"OK: scritto su {file_path} (riga {row}) | NomeCommessa='{riga['nome']}' | Codice='{riga['codice_commessa']}' | PrezzoVendita={riga['prezzo_vendita']} | PDF_IN='{os.path.basename(riga['link_pdf_entrata'])}'"
+    if tempi:
+        msg += f" | tempi_ms={json.dumps(tempi)}"
+    log(msg, tempi=tempi or {})
+
+class CacheWorkbook:
+    """
+    Tiene in memoria gli ultimi workbook mensili usati (LRU) per il worker.
+    Un workbook viene ricaricato se il file su disco è cambiato (mtime/size)
+    da quando l'abbiamo salvato noi, es. modificato a mano in Excel.
+    """
+
+    def __init__(self, max_workbook=4):
+        self.max_workbook = max_workbook
+        self._voci = OrderedDict()  # file_path -> (wb, ws, indice, firma)
+
+    @staticmethod
+    def _firma(file_path):
+        try:
+            st = os.stat(file_path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def apri(self, base_path, mese, anno):
+        file_path = percorso_workbook(base_path, mese, anno)
+        voce = self._voci.get(file_path)
+        if voce and voce[3] == self._firma(file_path):
+            self._voci.move_to_end(file_path)
+            return voce[0], voce[1], file_path
+        wb, ws, file_path = apri_workbook(base_path, mese, anno)
+        self._voci[file_path] = (wb, ws, IndiceRighe(ws), None)
+        self._voci.move_to_end(file_path)
+        while len(self._voci) > self.max_workbook:
+            self._voci.popitem(last=False)
+        return wb, ws, file_path
+
+    def indice(self, file_path):
+        return self._voci[file_path][2]
+
+    def salva(self, file_path):
+        wb, ws, indice, _ = self._voci[file_path]
+        salva_atomico(wb, file_path)
+        self._voci[file_path] = (wb, ws, indice, self._firma(file_path))
+
+    def scarta(self, file_path):
+        self._voci.pop(file_path, None)
+
+def esegui_batch(payloads, base_path, cache=None):
+    """
+    Elabora più payload in un solo giro: le righe vengono raggruppate per
+    workbook mensile, ogni DDT_Work_MM_YYYY.xlsx viene aperto e salvato una
+    sola volta. Ritorna un report con un esito per ogni payload (stesso ordine).
+    Con `cache` (CacheWorkbook) i workbook restano aperti tra una chiamata e l'altra.
+    """
+    risultati = [None] * len(payloads)
+    gruppi = {}  # (mese, anno) -> [(indice, riga)]
+
+    tempi_payload = [{} for _ in payloads]   # cartella, ricerca_pdf, dedup, scrittura
+    tempi_workbook = []                       # apertura_workbook, salvataggio (condivisi)
+
+    for i, dati in enumerate(payloads):
+        try:
+            riga, motivo = prepara_riga(dati, tempi_payload[i])
+        except Exception as e:
+            risultati[i] = {"index": i, "ok": False, "error": f"{type(e).__name__}: {e}",
+                            "tempi": tempi_payload[i]}
+            continue
+        if motivo:
+            log_non_eseguito(motivo)
+            risultati[i] = {"index": i, "ok": False, "error": motivo, "tempi": tempi_payload[i]}
+            continue
+        gruppi.setdefault((riga["mese"], riga["anno"]), []).append((i, riga))
+
+    for (mese, anno), righe in gruppi.items():
+        file_path = percorso_workbook(base_path, mese, anno)
+        tempi_wb = {}
+        tempi_workbook.append(tempi_wb)
+        try:
+            file_path, rows = aggiorna_workbook(base_path, mese, anno, [riga for _, riga in righe],
+                                                cache=cache, tempi=tempi_wb,
+                                                tempi_righe=[tempi_payload[i] for i, _ in righe])
+        except Exception as e:
+            errore = f"Template non trovato: {e}" if isinstance(e, FileNotFoundError) else f"{type(e).__name__}: {e}"
+            log(f"ERRORE batch {os.path.basename(file_path)}: {errore}", logging.ERROR)
+            for i, riga in righe:
+                risultati[i] = {"index": i, "ok": False, "file": file_path,
+                                "numeroDdt": riga["numero_ddt_entrata"], "error": errore,
+                                "tempi": tempi_payload[i]}
+            continue
+        for (i, riga), row in zip(righe, rows):
+            log_ok(file_path, row, riga, tempi_payload[i])
+            risultati[i] = {"index": i, "ok": True, "file": file_path, "row": row,
+                            "numeroDdt": riga["numero_ddt_entrata"], "tempi": tempi_payload[i]}
+
+    return {
+        "totale": len(payloads),
+        "ok": sum(1 for r in risultati if r["ok"]),
+        "errori": sum(1 for r in risultati if not r["ok"]),
+        "workbook": len(gruppi),
+        "tempi": somma_tempi(*tempi_payload, *tempi_workbook),
+        "risultati": risultati,
+    }
+
+def main_batch(payloads_path, base_path):
+    global CACHE_MATERIALI_ATTIVA
+    CACHE_MATERIALI_ATTIVA = True  # più payload possono puntare alla stessa cartella
+    tempi = {"import_openpyxl": TEMPO_IMPORT_OPENPYXL_MS}
+    with fase("lettura_json", tempi):
+        payloads = leggi_payloads(payloads_path)
+    report = esegui_batch(payloads, base_path)
+    report["tempi"] = somma_tempi(tempi, report["tempi"])
+    log(f"BATCH: {report['ok']}/{report['totale']} DDT scritti su {report['workbook']} workbook")
+    print(json.dumps(report, ensure_ascii=False))
+    if report["errori"]:
+        sys.exit(3)
+
+# ───────────────────────────────────────────────────────────────────────────────
+# Journal: invece di riscrivere l'xlsx a ogni DDT, la riga già preparata viene
+# aggiunta (append) a "<xlsx>.journal/corrente.jsonl", chiave = Numero DDT entrata.
+# Il DDT_Work_MM_YYYY.xlsx si materializza poi in un solo passaggio, a richiesta
+# (--materializza) o periodicamente (--ogni N); l'operazione è idempotente.
+# Segmenti del journal, letti in quest'ordine (vince l'ultima riga per chiave):
+#   base.jsonl      stato compattato dall'ultima materializzazione
+#   seg-<ns>.jsonl  corrente.jsonl "ruotato" da una materializzazione in corso/fallita
+#   corrente.jsonl  append dei nuovi DDT
+# Append e rotazione di corrente.jsonl passano dal lock breve "corrente.jsonl.lock"
+# (non da quello della materializzazione, che dura tutto il salvataggio): una
+# riga non può finire in un segmento già letto e poi cancellato.
+# ───────────────────────────────────────────────────────────────────────────────
+def cartella_journal(base_path, mese, anno):
+    return percorso_workbook(base_path, mese, anno) + ".journal"
+
+def journal_append(base_path, riga):
+    """Aggiunge la riga al journal del suo mese. Una sola write in append."""
+    cartella = cartella_journal(base_path, riga["mese"], riga["anno"])
+    os.makedirs(cartella, exist_ok=True)
+    voce = {"ts": datetime.datetime.now().isoformat(timespec="milliseconds"),
+            "chiave": riga["numero_ddt_entrata"], "riga": riga}
+    corrente = os.path.join(cartella, "corrente.jsonl")
+    with LockWorkbook(corrente):
+        with open(corrente, "a", encoding="utf-8") as f:
+            f.write(json.dumps(voce, ensure_ascii=False) + "\n")
+    return cartella
+
+def _segmenti_journal(cartella):
+    try:
+        nomi = os.listdir(cartella)
+    except FileNotFoundError:
+        return []
+    segmenti = sorted(n for n in nomi if n.startswith("seg-") and n.endswith(".jsonl"))
+    out = ["base.jsonl"] if "base.jsonl" in nomi else []
+    return [os.path.join(cartella, n) for n in out + segmenti]
+
+def leggi_journal(segmenti):
+    """Riduce i segmenti a {chiave: riga}: ultima versione, ordine di prima comparsa."""
+    righe = {}
+    for path in segmenti:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        voce = json.loads(line)
+                    except ValueError:
+                        continue  # riga troncata (es. crash durante l'append)
+                    righe[voce["chiave"]] = voce["riga"]
+        except FileNotFoundError:
+            pass
+    return righe
+
+def materializza(base_path, mese, anno, cache=None, tempi=None, ricostruisci=False):
+    """
+    Applica al DDT_Work_MM_YYYY.xlsx (dal Template se manca) le righe arrivate nel
+    journal dall'ultima volta, con un solo load/save, poi compatta il journal in
+    base.jsonl. Le righe già materializzate non vengono riscritte (eventuali
+    modifiche a mano in Excel restano), salvo `ricostruisci=True` che riapplica
+    tutto il journal, es. se l'xlsx è andato perso.
+    Ritorna {"file", "righe", "segmenti"}.
+    """
+    cartella = cartella_journal(base_path, mese, anno)
+    file_path = percorso_workbook(base_path, mese, anno)
+    with LockWorkbook(cartella.rstrip(os.sep)):
+        corrente = os.path.join(cartella, "corrente.jsonl")
+        with LockWorkbook(corrente):
+            if os.path.exists(corrente):
+                # ruoto: i nuovi append vanno in un corrente.jsonl nuovo
+                ruotato = os.path.join(cartella, f"seg-{time.time_ns()}.jsonl")
+                for n in range(5):
+                    try:
+                        os.replace(corrente, ruotato)
+                        break
+                    except PermissionError:
+                        if n == 4:
+                            raise
+                        time.sleep(0.2)
+        segmenti = _segmenti_journal(cartella)
+        nuovi = [p for p in segmenti if os.path.basename(p) != "base.jsonl"]
+        with fase("lettura_journal", tempi):
+            tutte = leggi_journal(segmenti)
+            da_applicare = tutte if ricostruisci else leggi_journal(nuovi)
+        if not da_applicare:
+            return {"file": file_path, "righe": 0, "segmenti": len(segmenti)}
+
+        file_path, _ = aggiorna_workbook(base_path, mese, anno, list(da_applicare.values()),
+                                         cache=cache, tempi=tempi)
+
+        # compattazione: una riga per chiave in base.jsonl, via i segmenti assorbiti
+        with fase("compattazione_journal", tempi):
+            tmp = os.path.join(cartella, f"base.jsonl.{os.getpid()}.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                for chiave, riga in tutte.items():
+                    f.write(json.dumps({"chiave": chiave, "riga": riga}, ensure_ascii=False) + "\n")
+            os.replace(tmp, os.path.join(cartella, "base.jsonl"))
+            for path in nuovi:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+    log(f"JOURNAL: materializzate {len(da_applicare)} righe in {os.path.basename(file_path)} "
+        f"({len(segmenti)} segmenti)", tempi=tempi or {})
+    return {"file": file_path, "righe": len(da_applicare), "segmenti": len(segmenti)}
+
+def mesi_con_journal(base_path):
+    """[(mese, anno)] per ogni DDT_Work_MM_YYYY.xlsx.journal presente in base_path."""
+    out = []
+    for nome in os.listdir(base_path):
+        m = re.match(r'^DDT_Work_(\d{2})_(\d{4})\.xlsx\.journal$', nome)
+        if m:
+            out.append((m.group(1), m.group(2)))
+    return sorted(out, key=lambda x: (x[1], x[0]))
+
+def main_journal(dati_path, base_path):
+    tempi = {"import_openpyxl": TEMPO_IMPORT_OPENPYXL_MS}
+    with fase("lettura_json", tempi):
+        with open(dati_path, "r", encoding="utf-8") as f:
+            dati = json.load(f)
+    riga, motivo = prepara_riga(dati, tempi)
+    if motivo:
+        log_non_eseguito(motivo)
+        return
+    with fase("journal_append", tempi):
+        cartella = journal_append(base_path, riga)
+    log(f"OK: DDT {riga['numero_ddt_entrata']} registrato nel journal {os.path.basename(cartella)} "
+        f"| Codice='{riga['codice_commessa']}' | tempi_ms={json.dumps(tempi)}", tempi=tempi)
+
+def main_materializza(argv):
+    if not argv:
+        print("Usage: genera_excel_ddt.py --materializza basePath [MM_YYYY] [--ogni SECONDI] [--ricostruisci]",
+              file=sys.stderr)
+        sys.exit(1)
+    base_path = argv[0]
+    mese_anno = None
+    ogni = None
+    ricostruisci = False
+    i = 1
+    while i < len(argv):
+        if argv[i] == "--ogni" and i + 1 < len(argv):
+            ogni = float(argv[i + 1]); i += 2
+        elif argv[i] == "--ricostruisci":
+            ricostruisci = True; i += 1
+        else:
+            mese_anno = argv[i]; i += 1
+    cache = CacheWorkbook() if ogni else None
+    while True:
+        mesi = [tuple(mese_anno.split("_"))] if mese_anno else mesi_con_journal(base_path)
+        errori = 0
+        for mese, anno in mesi:
+            try:
+                materializza(base_path, mese, anno, cache=cache, ricostruisci=ricostruisci)
+            except Exception as e:
+                errori += 1
+                log(f"ERRORE materializzazione {mese}_{anno}: {type(e).__name__}: {e}", logging.ERROR)
+        if not ogni:
+            if errori:
+                sys.exit(3)
+            return
+        time.sleep(ogni)
+
+# ───────────────────────────────────────────────────────────────────────────────
+# Worker residente: un job JSON per riga (stdin o socket locale), una risposta
+# JSON per riga. Job:
+#   {"id": 1, "basePath": "...", "dati": {...stesso JSON di dati.json...}}
+#   {"id": 2, "basePath": "...", "batch": [{...}, {...}]}
+#   {"id": 3, "basePath": "...", "dati": {...}, "journal": true}   solo append al journal
+#   {"id": 4, "basePath": "...", "cmd": "materializza", "mese": "10", "anno": "2026", "ricostruisci": false}
+#   {"cmd": "ping"} | {"cmd": "quit"}
+# ───────────────────────────────────────────────────────────────────────────────
+def esegui_job(job, cache):
+    t0 = time.perf_counter()
+    risposta = {"id": job.get("id")}
+    cmd = job.get("cmd")
+    if cmd == "ping":
+        risposta.update(ok=True, pong=True, workbook_in_cache=len(cache._voci))
+        return risposta
+    if cmd == "quit":
+        risposta.update(ok=True, quit=True)
+        return risposta
+
+    base_path = job.get("basePath") or job.get("reportDdtPath")
+    if not base_path:
+        risposta.update(ok=False, error="basePath mancante")
+        return risposta
+
+    if cmd == "materializza":
+        tempi = {}
+        mesi = ([(job["mese"], job["anno"])] if job.get("mese") and job.get("anno")
+                else mesi_con_journal(base_path))
+        risposta["mesi"] = [materializza(base_path, m, a, cache=cache, tempi=tempi,
+                                         ricostruisci=bool(job.get("ricostruisci"))) for m, a in mesi]
+        risposta.update(ok=True, tempi=tempi)
+    elif job.get("journal"):
+        tempi = {}
+        riga, motivo = prepara_riga(job.get("dati") or {}, tempi)
+        if motivo:
+            log_non_eseguito(motivo)
+            risposta.update(ok=False, error=motivo)
+        else:
+            with fase("journal_append", tempi):
+                journal_append(base_path, riga)
+            risposta.update(ok=True, journal=True, numeroDdt=riga["numero_ddt_entrata"])
+        risposta["tempi"] = tempi
+    elif "batch" in job:
+        report = esegui_batch(job.get("batch") or [], base_path, cache=cache)
+        risposta.update(report)
+        risposta["ok"] = report["errori"] == 0
+    else:
+        report = esegui_batch([job.get("dati") or {}], base_path, cache=cache)
+        risposta.update(report["risultati"][0])
+        risposta.pop("index", None)
+        risposta["tempi"] = report["tempi"]  # include apertura/salvataggio del workbook
+    risposta["ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    return risposta
+
+def gestisci_riga_job(line, cache):
+    try:
+        job = json.loads(line)
+    except ValueError as e:
+        return {"id": None, "ok": False, "error": f"JSON non valido: {e}"}
+    try:
+        return esegui_job(job, cache)
+    except Exception as e:
+        log(f"ERRORE worker: {type(e).__name__}: {e}", logging.ERROR)
+        return {"id": job.get("id"), "ok": False, "error": f"{type(e).__name__}: {e}"}
+
+def main_worker_stdin(cache):
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        risposta = gestisci_riga_job(line, cache)
+        sys.stdout.write(json.dumps(risposta, ensure_ascii=False) + "\n")
+        sys.stdout.flush()
+        if risposta.get("quit"):
+            break
+
+def main_worker_socket(cache, port):
+    import socketserver
+
+    class _Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for raw in self.rfile:
+                line = raw.decode("utf-8")
+                if not line.strip():
+                    continue
+                risposta = gestisci_riga_job(line, cache)
+                self.wfile.write((json.dumps(risposta, ensure_ascii=False) + "\n").encode("utf-8"))
+                self.wfile.flush()
+                if risposta.get("quit"):
+                    self.server._stop = True
+                    break
+
+    # TCPServer non threaded: i job vengono serializzati, un solo writer per workbook
+    with socketserver.TCPServer(("127.0.0.1", port), _Handler) as server:
+        server._stop = False
+        log(f"WORKER in ascolto su 127.0.0.1:{server.server_address[1]}")
+        while not server._stop:
+            server.handle_request()
+
+def main_worker(argv):
+    global CACHE_MATERIALI_ATTIVA
+    configura_log(stream=sys.stderr)
+    CACHE_MATERIALI_ATTIVA = True
+    port = None
+    max_workbook = 4
+    i = 0
+    while i < len(argv):
+        if argv[i] == "--port" and i + 1 < len(argv):
+            port = int(argv[i + 1]); i += 2
+        elif argv[i] == "--max-workbook" and i + 1 < len(argv):
+            max_workbook = int(argv[i + 1]); i += 2
+        else:
+            print(f"Argomento worker non riconosciuto: {argv[i]}", file=sys.stderr)
+            sys.exit(1)
+    cache = CacheWorkbook(max_workbook=max_workbook)
+    log(f"WORKER avviato (pid {os.getpid()}, max_workbook={max_workbook})")
+    if port is None:
+        main_worker_stdin(cache)
+    else:
+        main_worker_socket(cache, port)
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == "--batch":
+        main_batch(sys.argv[2], sys.argv[3])
+        return
+
+    if len(sys.argv) >= 2 and sys.argv[1] == "--worker":
+        main_worker(sys.argv[2:])
+        return
+
+    if len(sys.argv) == 4 and sys.argv[1] == "--journal":
+        main_journal(sys.argv[2], sys.argv[3])
+        return
+
+    if len(sys.argv) >= 2 and sys.argv[1] == "--materializza":
+        main_materializza(sys.argv[2:])
+        return
+
+    if len(sys.argv) != 3:
+        print("Usage: genera_excel_ddt.py dati.json basePath", file=sys.stderr)
+        print("       genera_excel_ddt.py --batch payloads.json|.jsonl basePath", file=sys.stderr)
+        print("       genera_excel_ddt.py --worker [--port N] [--max-workbook N]", file=sys.stderr)
+        print("       genera_excel_ddt.py --journal dati.json basePath", file=sys.stderr)
+        print("       genera_excel_ddt.py --materializza basePath [MM_YYYY] [--ogni SECONDI] [--ricostruisci]",
+              file=sys.stderr)
+        sys.exit(1)
+
+    dati_path = sys.argv[1]
+    base_path = sys.argv[2]
+
+    tempi = {"import_openpyxl": TEMPO_IMPORT_OPENPYXL_MS}
+
+    # --- Leggi dati JSON ---
+    with fase("lettura_json", tempi):
+        with open(dati_path, "r", encoding="utf-8") as f:
+            dati = json.load(f)
+
+    riga, motivo = prepara_riga(dati, tempi)
+    if motivo:
+        log_non_eseguito(motivo)
+        return
+
+    # ------------ SCRIVI EXCEL (in coda con gli altri processi) ------------
+    try:
+        esito = scrivi_con_coda(base_path, riga, tempi)
+    except WorkbookOccupato as e:
+        log(f"ERRORE: {e}", logging.ERROR)
+        print(str(e), file=sys.stderr)
+        sys.exit(4)
+
+    if not esito.get("ok"):
+        errore = esito.get("error", "")
+        if errore.startswith("Template non trovato"):
+            print(errore, file=sys.stderr)
+            sys.exit(2)
+        log(f"ERRORE scrittura {esito.get('file', '')}: {errore}", logging.ERROR)
+        print(errore, file=sys.stderr)
+        sys.exit(5)
+    log_ok(esito["file"], esito["row"], riga, tempi)
 
 if __name__ == "__main__":
     main()
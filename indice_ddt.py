@@ -0,0 +1,246 @@
+# File: indice_ddt.py
+# Indice persistente (SQLite) di tutti i PDF DDT presenti nelle cartelle
+# MATERIALI dell'archivio commesse, per evitare di riscandire la share a ogni ricerca.
+#
+# Struttura attesa sotto la radice (entrambe supportate):
+#   ARCHIVIO/<anno>/COMMESSE/<commessa>/MATERIALI/DDT_....pdf
+#   <baseFolder>/<commessa>/MATERIALI/DDT_....pdf      (come percorsoCartella in server.js)
+#
+# Uso:
+#   python indice_ddt.py aggiorna "\\192.168.1.248\time dati\ARCHIVIO TECNICO\ARCHIVIO" [--db file] [--workers 16]
+#   python indice_ddt.py cerca --codice C4924 [--tipo W] [--numero 78] [--dal 2025-01-01] [--al 2025-12-31]
+import os
+import json
+import time
+import sqlite3
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from genera_excel_ddt import parse_nome_ddt, normalizza_codice_commessa
+
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "indice_ddt.sqlite")
+WORKERS_DEFAULT = 16  # I/O bound su SMB: i thread passano il tempo in attesa della rete
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS contenitori (
+    path      TEXT PRIMARY KEY    -- cartella che contiene le commesse (es. ARCHIVIO/2025/COMMESSE)
+);
+CREATE TABLE IF NOT EXISTS cartelle (
+    path      TEXT PRIMARY KEY,   -- .../<commessa>/MATERIALI
+    padre     TEXT NOT NULL,      -- contenitore di appartenenza
+    commessa  TEXT NOT NULL,      -- nome cartella commessa
+    mtime_ns  INTEGER
+);
+CREATE TABLE IF NOT EXISTS ddt (
+    cartella     TEXT NOT NULL,
+    fname        TEXT NOT NULL,
+    tipo         TEXT NOT NULL,   -- 'W' entrata, 'T' uscita
+    numero       INTEGER NOT NULL,
+    codice       TEXT NOT NULL,   -- codice dal nome file, casefold
+    codice_norm  TEXT NOT NULL,   -- normalizza_codice_commessa(codice)
+    data         TEXT NOT NULL,   -- yyyy-mm-dd
+    PRIMARY KEY (cartella, fname)
+);
+CREATE INDEX IF NOT EXISTS ix_ddt_codice ON ddt (codice_norm, tipo, data);
+CREATE INDEX IF NOT EXISTS ix_ddt_numero ON ddt (numero, tipo);
+CREATE INDEX IF NOT EXISTS ix_ddt_data   ON ddt (data);
+CREATE INDEX IF NOT EXISTS ix_cartelle_padre ON cartelle (padre);
+"""
+
+def apri_db(db_path=DB_PATH):
+    d = os.path.dirname(db_path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def _sotto(path, radice):
+    """True se `path` è `radice` o sta sotto di essa (più radici possono stare nello stesso DB)."""
+    p = os.path.normcase(os.path.normpath(path))
+    r = os.path.normcase(os.path.normpath(radice))
+    return p == r or p.startswith(r.rstrip(os.sep) + os.sep)
+
+def _sottocartelle(path):
+    try:
+        with os.scandir(path) as it:
+            return [e.name for e in it if e.is_dir()]
+    except OSError:
+        return []
+
+def trova_contenitori(radice):
+    """
+    Cartelle che contengono direttamente le commesse.
+    Se la radice ha sottocartelle <anno>/COMMESSE usa quelle, altrimenti la radice stessa.
+    """
+    out = []
+    for nome in _sottocartelle(radice):
+        if nome.isdigit() and len(nome) == 4:
+            for sub in _sottocartelle(os.path.join(radice, nome)):
+                if sub.upper() == "COMMESSE":
+                    out.append(os.path.join(radice, nome, sub))
+    return out or [radice]
+
+def _elenca_materiali(contenitore):
+    """[(path MATERIALI, nome commessa)] per ogni commessa del contenitore."""
+    out = []
+    for commessa in _sottocartelle(contenitore):
+        out.append((os.path.join(contenitore, commessa, "MATERIALI"), commessa))
+    return out
+
+def _leggi_cartella(path):
+    """Stat + listing di una MATERIALI: (mtime, [VoceDDT]) oppure (None, None) se sparita."""
+    mtime = _mtime(path)
+    if mtime is None:
+        return None, None
+    try:
+        files = os.listdir(path)
+    except OSError:
+        return None, None
+    return mtime, [v for v in map(parse_nome_ddt, files) if v]
+
+def aggiorna(radice, db_path=DB_PATH, workers=WORKERS_DEFAULT, completo=False):
+    """
+    Aggiornamento incrementale: i contenitori si rilistano sempre (uno per anno)
+    e ogni <commessa>/MATERIALI viene controllata con uno stat, perché server.js
+    crea MATERIALI solo alla prima bolla e l'mtime del contenitore non cambia;
+    si rilegge solo il contenuto delle MATERIALI il cui mtime è cambiato
+    (completo=True le rilegge tutte).
+    Stat/listdir in parallelo su un pool di thread; le scritture SQLite restano
+    nel thread chiamante. Si toccano solo righe sotto `radice`: altre radici
+    indicizzate nello stesso DB restano com'erano. Ritorna statistiche del giro.
+    """
+    t0 = time.perf_counter()
+    conn = apri_db(db_path)
+    stats = {"contenitori": 0, "cartelle": 0, "cartelle_rilette": 0, "cartelle_rimosse": 0, "ddt": 0}
+
+    note_cartelle = {r["path"]: r["mtime_ns"] for r in conn.execute("SELECT path, mtime_ns FROM cartelle")
+                     if _sotto(r["path"], radice)}
+    noti_contenitori = [r["path"] for r in conn.execute("SELECT path FROM contenitori") if _sotto(r["path"], radice)]
+
+    contenitori = trova_contenitori(radice)
+    stats["contenitori"] = len(contenitori)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # 1) contenitori: sempre rilistati, una MATERIALI nuova in una commessa esistente
+        #    non cambia l'mtime del contenitore
+        esistenti = [c for c, ok in zip(contenitori, pool.map(os.path.isdir, contenitori)) if ok]
+
+        materiali = {}  # path MATERIALI -> (padre, commessa)
+        for c, elenco in zip(contenitori, pool.map(_elenca_materiali, contenitori)):
+            for path, commessa in elenco:
+                materiali[path] = (c, commessa)
+
+        # 2) cartelle MATERIALI (anche quelle mai viste): stat in parallelo, listdir solo se mtime cambiato
+        paths = list(materiali)
+        mtimes_mat = dict(zip(paths, pool.map(_mtime, paths)))
+        cambiate = [p for p in paths
+                    if mtimes_mat[p] is not None and (completo or note_cartelle.get(p) != mtimes_mat[p])]
+        letture = dict(zip(cambiate, pool.map(_leggi_cartella, cambiate)))
+
+    with conn:
+        conn.executemany("INSERT OR IGNORE INTO contenitori (path) VALUES (?)", [(c,) for c in esistenti])
+        conn.executemany("DELETE FROM contenitori WHERE path = ?",
+                         [(c,) for c in set(noti_contenitori) - set(esistenti)])
+
+        # cartelle sparite (o senza MATERIALI): via anche i loro DDT
+        presenti = {p for p in paths if mtimes_mat[p] is not None}
+        for p in set(note_cartelle) - presenti:
+            conn.execute("DELETE FROM ddt WHERE cartella = ?", (p,))
+            conn.execute("DELETE FROM cartelle WHERE path = ?", (p,))
+            stats["cartelle_rimosse"] += 1
+
+        for p, (mtime, voci) in letture.items():
+            if mtime is None:
+                continue
+            padre, commessa = materiali[p]
+            conn.execute("DELETE FROM ddt WHERE cartella = ?", (p,))
+            conn.executemany(
+                "INSERT OR REPLACE INTO ddt (cartella, fname, tipo, numero, codice, codice_norm, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(p, v.fname, v.tipo, v.numero, v.codice, normalizza_codice_commessa(v.codice),
+                  f"{v.data[2]}-{v.data[1]}-{v.data[0]}") for v in voci]
+            )
+            conn.execute("INSERT OR REPLACE INTO cartelle (path, padre, commessa, mtime_ns) VALUES (?, ?, ?, ?)",
+                         (p, padre, commessa, mtime))
+            stats["cartelle_rilette"] += 1
+
+    stats["cartelle"] = len(presenti)
+    stats["ddt"] = conn.execute("SELECT COUNT(*) FROM ddt").fetchone()[0]
+    stats["secondi"] = round(time.perf_counter() - t0, 3)
+    conn.close()
+    return stats
+
+def cerca(conn, codice=None, tipo=None, numero=None, dal=None, al=None, limite=None):
+    """
+    Interroga l'indice. `codice` è confrontato col codice normalizzato come
+    prefisso case-insensitive ("C4924" trova C4924-01, C4924-02...).
+    `dal`/`al` in formato yyyy-mm-dd. Ritorna una lista di dict ordinata per data desc.
+    """
+    where, params = [], []
+    if codice:
+        pref = normalizza_codice_commessa(codice).casefold()
+        # range invece di LIKE: sfrutta l'indice su codice_norm
+        where.append("codice_norm >= ? AND codice_norm < ?")
+        params += [pref, pref + "\U0010ffff"]
+    if tipo:
+        where.append("tipo = ?")
+        params.append(str(tipo).upper())
+    if numero is not None:
+        where.append("numero = ?")
+        params.append(int(numero))
+    if dal:
+        where.append("data >= ?")
+        params.append(dal)
+    if al:
+        where.append("data <= ?")
+        params.append(al)
+    sql = "SELECT cartella, fname, tipo, numero, codice, codice_norm, data FROM ddt"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY data DESC, numero DESC"
+    if limite:
+        sql += f" LIMIT {int(limite)}"
+    return [dict(r, path=os.path.join(r["cartella"], r["fname"])) for r in conn.execute(sql, params)]
+
+def main():
+    ap = argparse.ArgumentParser(description="Indice DDT dell'archivio commesse")
+    ap.add_argument("--db", default=DB_PATH)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("aggiorna", help="scansione (incrementale) dell'archivio")
+    p.add_argument("radice")
+    p.add_argument("--workers", type=int, default=WORKERS_DEFAULT)
+    p.add_argument("--completo", action="store_true", help="ignora gli mtime e rilegge tutto")
+
+    q = sub.add_parser("cerca", help="interroga l'indice (output JSON)")
+    q.add_argument("--codice")
+    q.add_argument("--tipo", choices=["W", "T", "w", "t"])
+    q.add_argument("--numero", type=int)
+    q.add_argument("--dal")
+    q.add_argument("--al")
+    q.add_argument("--limite", type=int)
+
+    args = ap.parse_args()
+    if args.cmd == "aggiorna":
+        stats = aggiorna(args.radice, db_path=args.db, workers=args.workers, completo=args.completo)
+        print(json.dumps(stats, ensure_ascii=False))
+    else:
+        conn = apri_db(args.db)
+        t0 = time.perf_counter()
+        righe = cerca(conn, codice=args.codice, tipo=args.tipo, numero=args.numero,
+                      dal=args.dal, al=args.al, limite=args.limite)
+        ms = (time.perf_counter() - t0) * 1000
+        print(json.dumps({"ms": round(ms, 3), "risultati": righe}, ensure_ascii=False))
+        conn.close()
+
+if __name__ == "__main__":
+    main()
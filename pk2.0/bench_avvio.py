@@ -0,0 +1,84 @@
+# File: bench_avvio.py
+# Tempo di avvio a freddo di PrintKalculator: ogni variante è un processo nuovo,
+# cronometrato dal lancio all'uscita.
+#
+#   python bench_avvio.py [--repeat 10] [--exe dist\pk2.0.exe] [--exe-cli dist\pk2.0-cli.exe] [--json]
+#
+# Varianti:
+#   python --quote    percorso da riga di comando (non importa tkinter)
+#   python GUI        costruisce la finestra ed esce al primo giro del mainloop
+#   bundle GUI        l'eseguibile PyInstaller della finestra (--misura-avvio)
+#   bundle --quote    l'eseguibile console pk2.0-cli
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+QUI = os.path.dirname(os.path.abspath(__file__))
+SCRIPT = os.path.join(QUI, "pk2.0.py")
+PREVENTIVO = ["--quote", "500", "300", "10", "--mode", "CMYK+2W"]
+
+
+def _display_disponibile():
+    return sys.platform == "win32" or bool(os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"))
+
+
+def _cronometra(comando, repeat):
+    tempi = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        r = subprocess.run(comando, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, cwd=QUI)
+        tempi.append((time.perf_counter() - t0) * 1000)
+        if r.returncode != 0:
+            raise RuntimeError(f"{comando[0]} uscito con {r.returncode}: {r.stderr.decode(errors='replace').strip()}")
+    tempi.sort()
+    return {"min_ms": tempi[0], "mediana_ms": tempi[len(tempi) // 2], "max_ms": tempi[-1]}
+
+
+def _moduli_caricati(argv):
+    """Esegue pk2.0.py in un interprete pulito e dice se tkinter è stato importato."""
+    codice = ("import runpy, sys; sys.argv = %r\n"
+              "try:\n    runpy.run_path(%r, run_name='__main__')\n"
+              "except SystemExit:\n    pass\n"
+              "print('tkinter' in sys.modules, file=sys.stderr)") % ([SCRIPT] + argv, SCRIPT)
+    r = subprocess.run([sys.executable, "-c", codice], stdout=subprocess.DEVNULL,
+                       stderr=subprocess.PIPE, cwd=QUI)
+    return r.stderr.decode().strip().splitlines()[-1] == "True"
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark avvio a freddo PrintKalculator")
+    ap.add_argument("--repeat", type=int, default=10)
+    ap.add_argument("--exe", help="eseguibile PyInstaller della finestra (pk2.0.exe)")
+    ap.add_argument("--exe-cli", help="eseguibile PyInstaller console (pk2.0-cli.exe)")
+    ap.add_argument("--json", action="store_true", help="una riga JSON per variante")
+    args = ap.parse_args()
+
+    varianti = [("python --quote", [sys.executable, SCRIPT] + PREVENTIVO)]
+    if _display_disponibile():
+        varianti.append(("python GUI", [sys.executable, SCRIPT, "--misura-avvio"]))
+    if args.exe:
+        varianti.append(("bundle GUI", [args.exe, "--misura-avvio"]))
+    if args.exe_cli:
+        varianti.append(("bundle --quote", [args.exe_cli] + PREVENTIVO))
+
+    if _moduli_caricati(PREVENTIVO):
+        raise SystemExit("ERRORE: il percorso --quote importa tkinter")
+
+    risultati = [dict(_cronometra(cmd, args.repeat), variante=nome) for nome, cmd in varianti]
+    if args.json:
+        for r in risultati:
+            print(json.dumps(dict(r, repeat=args.repeat)))
+        return
+    print(f"avvio a freddo, {args.repeat} lanci per variante")
+    print(f"{'variante':<16} {'min':>9} {'mediana':>9} {'max':>9}")
+    for r in risultati:
+        print(f"{r['variante']:<16} {r['min_ms']:>7.0f}ms {r['mediana_ms']:>7.0f}ms {r['max_ms']:>7.0f}ms")
+    if not _display_disponibile():
+        print("(nessun display: variante GUI saltata)")
+
+
+if __name__ == "__main__":
+    main()
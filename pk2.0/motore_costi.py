@@ -0,0 +1,595 @@
+# File: motore_costi.py
+# Motore di calcolo dei costi di stampa di PrintKalculator, senza interfaccia:
+# lo usa pk2.0.py per il preventivo singolo e si può importare o lanciare da
+# riga di comando per prezzare in blocco un CSV di lavori.
+#
+#   python motore_costi.py lavori.csv [-o prezzati.csv] [--parametri configurazione.json]
+#   python motore_costi.py --listino [-o listino.csv] [--formati A4=297x210,...] [--quantita 1,10,100] [--modi 1W,2W]
+#
+# Colonne del CSV: lunghezza_mm, larghezza_mm, quantita, modo
+# (modo: "CMYK", "2W", "CMYK+2W", ... ; vuoto = nessun inchiostro selezionato)
+import os
+import csv
+import sys
+import json
+import math
+import time
+import hashlib
+import argparse
+import threading
+from dataclasses import dataclass, fields, asdict
+from collections import namedtuple, OrderedDict
+
+# Ottieni il percorso della directory home dell'utente e definisci il percorso del file di configurazione
+directory_home = os.path.expanduser('~')
+percorso_file_configurazione = os.path.join(directory_home, 'configurazione.json')
+
+PARAMETRI_DEFAULT = {
+    "Volume,estimato per anno mq": 16000,
+    "costo_C_litro": 175,
+    "costo_M_litro": 175,
+    "costo_Y_litro": 175,
+    "costo_K_litro": 175,
+    "costo_W_litro": 210,
+    "consumo_CMYK_mq": 0.006,
+    "consumo_W_mq": 0.015,
+    "costi_vari_operatore_mq": 0.96,
+    "investimento_mq": 1.66,
+    "assistenza_ricambi_mq": 0.96,
+    "costo_orario_prestampa": 25
+}
+
+# strati di bianco -> (moltiplicatore consumo W, moltiplicatore costi vari/investimento/assistenza).
+# Senza strati selezionati il W resta contato una volta e i costi non si moltiplicano
+# (stesso comportamento della finestra di calcolo).
+MOLTIPLICATORI_W = {0: (1, 1), 1: (1, 2), 2: (2, 3), 3: (3, 4), 4: (4, 5)}
+
+Preventivo = namedtuple("Preventivo", [
+    "area_mq", "consumo_cmyk", "consumo_w", "costo_cmyk", "costo_w",
+    "costi_vari", "prestampa_unita", "costo_totale", "versione_parametri",
+])
+
+COLONNE_USCITA = list(Preventivo._fields[:-1])
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# Parametri: struttura tipizzata, validata e versionata
+# ───────────────────────────────────────────────────────────────────────────────
+VERIFICA_MTIME_S = 1.0  # ogni quanto ArchivioParametri.correnti() guarda se il file è cambiato
+
+# campo della dataclass -> chiave nel JSON (i nomi del file restano quelli di sempre)
+CHIAVI_JSON = {"volume_annuo_mq": "Volume,estimato per anno mq"}
+CHIAVE_VERSIONE = "_versione"
+
+
+class ParametriNonValidi(ValueError):
+    """File o valori dei parametri non utilizzabili; .errori elenca i problemi."""
+
+    def __init__(self, errori):
+        self.errori = list(errori)
+        super().__init__("; ".join(self.errori))
+
+
+@dataclass(frozen=True, slots=True)
+class Parametri:
+    volume_annuo_mq: float
+    costo_C_litro: float
+    costo_M_litro: float
+    costo_Y_litro: float
+    costo_K_litro: float
+    costo_W_litro: float
+    consumo_CMYK_mq: float
+    consumo_W_mq: float
+    costi_vari_operatore_mq: float
+    investimento_mq: float
+    assistenza_ricambi_mq: float
+    costo_orario_prestampa: float
+    versione: int = 0
+    impronta: str = ""
+
+    @classmethod
+    def da_dict(cls, dati, versione=None):
+        """
+        Dal dict del file (chiavi JSON). Valori numerici finiti e >= 0, anche come
+        stringhe con la virgola; le chiavi mancanti prendono il default, quelle
+        sconosciute sono ignorate. ParametriNonValidi con tutti gli errori trovati.
+        """
+        if not isinstance(dati, dict):
+            raise ParametriNonValidi(["il file dei parametri non contiene un oggetto JSON"])
+        valori, errori = {}, []
+        for campo in _CAMPI_VALORE:
+            chiave = CHIAVI_JSON.get(campo, campo)
+            grezzo = dati.get(chiave, PARAMETRI_DEFAULT[chiave])
+            try:
+                if isinstance(grezzo, bool):
+                    raise ValueError
+                valore = float(grezzo.replace(",", ".")) if isinstance(grezzo, str) else float(grezzo)
+            except (TypeError, ValueError):
+                errori.append(f"{chiave}: {grezzo!r} non è un numero")
+                continue
+            if not math.isfinite(valore) or valore < 0:
+                errori.append(f"{chiave}: {grezzo!r} deve essere un numero maggiore o uguale a 0")
+                continue
+            valori[campo] = valore
+        if errori:
+            raise ParametriNonValidi(errori)
+        if versione is None:
+            versione = dati.get(CHIAVE_VERSIONE, 0)
+        versione = versione if isinstance(versione, int) and not isinstance(versione, bool) else 0
+        impronta = hashlib.blake2b(json.dumps(valori, sort_keys=True).encode(), digest_size=8).hexdigest()
+        return cls(**valori, versione=versione, impronta=impronta)
+
+    def come_dict(self):
+        """Dict con le chiavi del file, senza versione (quello che mostra la finestra Impostazioni)."""
+        return {CHIAVI_JSON.get(campo, campo): valore
+                for campo, valore in asdict(self).items() if campo in _CAMPI_VALORE}
+
+
+_CAMPI_VALORE = tuple(f.name for f in fields(Parametri) if f.name not in ("versione", "impronta"))
+
+
+def come_parametri(parametri):
+    """Parametri così come sono, o convertiti (e validati) se arrivano come dict."""
+    return parametri if isinstance(parametri, Parametri) else Parametri.da_dict(parametri)
+
+
+def _leggi_file_parametri(percorso):
+    try:
+        with open(percorso, 'r') as file:
+            dati = json.load(file)
+    except FileNotFoundError:
+        return Parametri.da_dict(PARAMETRI_DEFAULT, versione=0)
+    except (OSError, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ParametriNonValidi([f"{percorso}: {e}"]) from None
+    return Parametri.da_dict(dati)
+
+
+def _scrivi_file_parametri(percorso, parametri):
+    dati = dict(parametri.come_dict(), **{CHIAVE_VERSIONE: parametri.versione})
+    temporaneo = percorso + ".tmp"
+    with open(temporaneo, 'w') as file:
+        json.dump(dati, file, indent=4)
+    os.replace(temporaneo, percorso)  # chi rilegge a caldo non vede mai un file a metà
+
+
+class ArchivioParametri:
+    """
+    Parametri di un file di configurazione, caricati una volta e ricaricati a
+    caldo quando cambia l'mtime (controllato al massimo ogni VERIFICA_MTIME_S).
+    Se il file diventa illeggibile o non valido restano in uso gli ultimi
+    parametri buoni e l'errore finisce in .ultimo_errore.
+    """
+
+    def __init__(self, percorso=percorso_file_configurazione, verifica_s=VERIFICA_MTIME_S):
+        self.percorso = percorso
+        self.verifica_s = verifica_s
+        self._lock = threading.Lock()
+        self._parametri = None
+        self._mtime = None
+        self._prossima_verifica = 0.0
+        self.ultimo_errore = None
+        self.ricaricamenti = 0
+
+    def _mtime_file(self):
+        try:
+            return os.stat(self.percorso).st_mtime_ns
+        except OSError:
+            return None
+
+    def correnti(self):
+        adesso = time.monotonic()
+        if self._parametri is not None and adesso < self._prossima_verifica:
+            return self._parametri
+        with self._lock:
+            self._prossima_verifica = adesso + self.verifica_s
+            mtime = self._mtime_file()
+            if self._parametri is None or mtime != self._mtime:
+                try:
+                    self._parametri = _leggi_file_parametri(self.percorso)
+                    self.ultimo_errore = None
+                    self.ricaricamenti += 1
+                except ParametriNonValidi as e:
+                    self.ultimo_errore = e
+                    if self._parametri is None:
+                        self._parametri = Parametri.da_dict(PARAMETRI_DEFAULT, versione=0)
+                self._mtime = mtime
+            return self._parametri
+
+    def salva(self, dati):
+        """Valida `dati` (dict con le chiavi del file), scrive con versione +1 e ritorna i nuovi Parametri."""
+        with self._lock:
+            precedente = self._parametri.versione if self._parametri is not None else 0
+            try:
+                precedente = max(precedente, _leggi_file_parametri(self.percorso).versione)
+            except ParametriNonValidi:
+                pass
+            nuovi = Parametri.da_dict(dati, versione=precedente + 1)
+            _scrivi_file_parametri(self.percorso, nuovi)
+            self._parametri, self._mtime = nuovi, self._mtime_file()
+            self._prossima_verifica = time.monotonic() + self.verifica_s
+            self.ultimo_errore = None
+        cache_preventivi.invalida()
+        return nuovi
+
+
+# Carica i parametri di configurazione (default se il file non c'è, ParametriNonValidi se è rovinato)
+def carica_parametri(percorso=percorso_file_configurazione):
+    return _leggi_file_parametri(percorso)
+
+# Salva i parametri modificati (i preventivi memorizzati con i valori vecchi non valgono più)
+def salva_parametri(parametri, percorso=percorso_file_configurazione):
+    dati = parametri.come_dict() if isinstance(parametri, Parametri) else parametri
+    return ArchivioParametri(percorso).salva(dati)
+
+
+def impronta_parametri(parametri):
+    """Hash corto del set di parametri: entra nella chiave dei preventivi e nei listini esportati."""
+    return come_parametri(parametri).impronta
+
+
+def parse_modo(modo):
+    """'CMYK+2W' -> (True, 2); accetta separatori + , spazio e maiuscole/minuscole."""
+    cmyk, strati_w = False, 0
+    for parte in str(modo or "").upper().replace(",", "+").replace(" ", "+").split("+"):
+        if not parte:
+            continue
+        if parte == "CMYK":
+            cmyk = True
+        elif len(parte) == 2 and parte[1] == "W" and parte[0] in "1234":
+            strati_w = int(parte[0])
+        else:
+            raise ValueError(f"modo di stampa non valido: {modo!r}")
+    return cmyk, strati_w
+
+
+def calcola_costo(parametri, lunghezza_mm, larghezza_mm, quantita, cmyk=False, strati_w=0):
+    """
+    Costo unitario di una stampa (area da mm, inchiostri CMYK/W, costi vari al mq
+    con il moltiplicatore degli strati di bianco, prestampa divisa sulla quantità).
+    ValueError se le misure o la quantità non sono positive. `parametri` è un
+    Parametri (un dict viene convertito e validato a ogni chiamata).
+    """
+    parametri = come_parametri(parametri)
+    if lunghezza_mm <= 0 or larghezza_mm <= 0 or quantita <= 0:
+        raise ValueError("Valori di lunghezza, larghezza e quantità devono essere maggiori di 0.")
+    moltiplicatore_w, moltiplicatore_costi = MOLTIPLICATORI_W[strati_w]
+    area_mq = (lunghezza_mm / 1000) * (larghezza_mm / 1000)
+    consumo_cmyk = parametri.consumo_CMYK_mq * area_mq if cmyk else 0
+    consumo_w = parametri.consumo_W_mq * area_mq * moltiplicatore_w
+    costi_vari = ((parametri.costi_vari_operatore_mq + parametri.investimento_mq
+                   + parametri.assistenza_ricambi_mq) * area_mq) * moltiplicatore_costi
+    costo_cmyk = parametri.costo_C_litro * consumo_cmyk
+    costo_w = parametri.costo_W_litro * consumo_w
+    prestampa_unita = parametri.costo_orario_prestampa / quantita
+    costo_totale = costo_cmyk + costo_w + costi_vari + prestampa_unita
+    return Preventivo(area_mq, consumo_cmyk, consumo_w, costo_cmyk, costo_w,
+                      costi_vari, prestampa_unita, costo_totale, parametri.versione)
+
+
+def calcola_costi_batch(parametri, lunghezza_mm, larghezza_mm, quantita, cmyk, strati_w):
+    """
+    Stessa formula di calcola_costo su array NumPy (un elemento per lavoro).
+    Ritorna un dict campo di Preventivo -> array (versione_parametri resta un
+    intero), più "valido" (bool): le righe con misure o quantità non positive
+    hanno NaN nei costi.
+    """
+    import numpy as np  # solo qui: la finestra e calcola_costo non ne hanno bisogno
+
+    parametri = come_parametri(parametri)
+    lunghezza_mm = np.asarray(lunghezza_mm, dtype=float)
+    larghezza_mm = np.asarray(larghezza_mm, dtype=float)
+    quantita = np.asarray(quantita, dtype=float)
+    cmyk = np.asarray(cmyk, dtype=bool)
+    strati_w = np.asarray(strati_w, dtype=int)
+
+    valido = (lunghezza_mm > 0) & (larghezza_mm > 0) & (quantita > 0) & (strati_w >= 0) & (strati_w <= 4)
+    tabella = np.array([MOLTIPLICATORI_W[k] for k in range(5)], dtype=float)
+    moltiplicatori = tabella[np.clip(strati_w, 0, 4)]
+
+    area_mq = (lunghezza_mm / 1000) * (larghezza_mm / 1000)
+    consumo_cmyk = np.where(cmyk, parametri.consumo_CMYK_mq * area_mq, 0.0)
+    consumo_w = parametri.consumo_W_mq * area_mq * moltiplicatori[..., 0]
+    costi_vari = ((parametri.costi_vari_operatore_mq + parametri.investimento_mq
+                   + parametri.assistenza_ricambi_mq) * area_mq) * moltiplicatori[..., 1]
+    costo_cmyk = parametri.costo_C_litro * consumo_cmyk
+    costo_w = parametri.costo_W_litro * consumo_w
+    with np.errstate(divide="ignore", invalid="ignore"):
+        prestampa_unita = parametri.costo_orario_prestampa / np.where(quantita > 0, quantita, np.nan)
+    costo_totale = costo_cmyk + costo_w + costi_vari + prestampa_unita
+
+    out = {"area_mq": area_mq, "consumo_cmyk": consumo_cmyk, "consumo_w": consumo_w,
+           "costo_cmyk": costo_cmyk, "costo_w": costo_w, "costi_vari": costi_vari,
+           "prestampa_unita": prestampa_unita, "costo_totale": costo_totale}
+    for k in out:
+        out[k] = np.where(valido, out[k], np.nan)
+    out["valido"] = valido
+    out["versione_parametri"] = parametri.versione
+    return out
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# Preventivi memorizzati e listino precalcolato
+# ───────────────────────────────────────────────────────────────────────────────
+CACHE_PREVENTIVI_MAX = 4096
+
+FORMATI_STANDARD = {
+    "A5": (210, 148), "A4": (297, 210), "A3": (420, 297), "SRA3": (450, 320),
+    "A2": (594, 420), "50x70": (700, 500), "A1": (841, 594), "70x100": (1000, 700),
+}
+QUANTITA_STANDARD = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+MODI_STANDARD = ("1W", "2W", "3W", "4W", "CMYK+1W", "CMYK+2W", "CMYK+3W", "CMYK+4W")
+
+
+class CachePreventivi:
+    """
+    LRU (versione e impronta parametri, dimensioni, quantità, modo) -> Preventivo.
+    Parametri nuovi (salvati o ricaricati a caldo) hanno un'altra impronta o
+    almeno un'altra versione: non pescano preventivi vecchi, né preventivi con
+    la versione_parametri di prima; salva_parametri svuota comunque la cache.
+    """
+
+    def __init__(self, max_voci=CACHE_PREVENTIVI_MAX):
+        self.max_voci = max_voci
+        self._lock = threading.Lock()  # finestra_pk e i batch chiamano da più thread
+        self._voci = OrderedDict()
+        self.contatori = {"hit": 0, "miss": 0, "evizioni": 0, "invalidazioni": 0}
+
+    def preventivo(self, parametri, lunghezza_mm, larghezza_mm, quantita, cmyk=False, strati_w=0):
+        parametri = come_parametri(parametri)
+        chiave = (parametri.versione, parametri.impronta, lunghezza_mm, larghezza_mm, quantita, bool(cmyk), strati_w)
+        with self._lock:
+            voce = self._voci.get(chiave)
+            if voce is not None:
+                self._voci.move_to_end(chiave)
+                self.contatori["hit"] += 1
+                return voce
+            self.contatori["miss"] += 1
+        # calcolo fuori dal lock: due thread sulla stessa chiave calcolano entrambi, stesso risultato
+        voce = calcola_costo(parametri, lunghezza_mm, larghezza_mm, quantita, cmyk, strati_w)
+        with self._lock:
+            self._voci[chiave] = voce
+            self._voci.move_to_end(chiave)
+            if len(self._voci) > self.max_voci:
+                self._voci.popitem(last=False)
+                self.contatori["evizioni"] += 1
+        return voce
+
+    def invalida(self):
+        with self._lock:
+            self.contatori["invalidazioni"] += len(self._voci)
+            self._voci.clear()
+
+    def metriche(self):
+        with self._lock:
+            return dict(self.contatori, voci=len(self._voci), max_voci=self.max_voci)
+
+
+cache_preventivi = CachePreventivi()
+
+
+def calcola_costo_memo(parametri, lunghezza_mm, larghezza_mm, quantita, cmyk=False, strati_w=0):
+    """calcola_costo passando per cache_preventivi (stessi argomenti, stessi errori)."""
+    return cache_preventivi.preventivo(parametri, lunghezza_mm, larghezza_mm, quantita, cmyk, strati_w)
+
+
+class Listino:
+    """
+    Matrice formati × quantità × modi di costo_totale, calcolata in un colpo con
+    calcola_costi_batch. prezzo() è un accesso per indice; l'impronta dei parametri
+    usati resta nel listino (e nel CSV esportato) per capire se è ancora valido.
+    """
+
+    def __init__(self, parametri, formati=None, quantita=QUANTITA_STANDARD, modi=MODI_STANDARD):
+        import numpy as np
+
+        self.formati = dict(formati or FORMATI_STANDARD)
+        self.quantita = tuple(quantita)
+        self.modi = tuple(modi)
+        parametri = come_parametri(parametri)
+        self.impronta = parametri.impronta
+        self.versione = parametri.versione
+        self._i_formato = {nome: i for i, nome in enumerate(self.formati)}
+        self._i_dimensioni = {}
+        for i, (lunghezza, larghezza) in enumerate(self.formati.values()):
+            self._i_dimensioni.setdefault((lunghezza, larghezza), i)
+            self._i_dimensioni.setdefault((larghezza, lunghezza), i)  # stessa area, stesso prezzo
+        self._i_quantita = {q: i for i, q in enumerate(self.quantita)}
+        self._i_modo = {parse_modo(m): i for i, m in enumerate(self.modi)}
+
+        dimensioni = np.array(list(self.formati.values()), dtype=float).reshape(-1, 2)
+        modi_parsati = [parse_modo(m) for m in self.modi]
+        f, q, m = np.meshgrid(np.arange(len(self.formati)), np.arange(len(self.quantita)),
+                              np.arange(len(self.modi)), indexing="ij")
+        risultati = calcola_costi_batch(
+            parametri, dimensioni[f, 0], dimensioni[f, 1], np.asarray(self.quantita, dtype=float)[q],
+            np.array([c for c, _ in modi_parsati], dtype=bool)[m],
+            np.array([s for _, s in modi_parsati], dtype=int)[m],
+        )
+        self.prezzi = risultati["costo_totale"]  # shape (formati, quantità, modi)
+
+    def prezzo(self, formato, quantita, modo):
+        """Costo unitario dal listino; KeyError se la combinazione non è nella griglia."""
+        return float(self.prezzi[self._i_formato[formato], self._i_quantita[quantita], self._i_modo[parse_modo(modo)]])
+
+    def cerca(self, lunghezza_mm, larghezza_mm, quantita, cmyk=False, strati_w=0):
+        """Come prezzo() ma per dimensioni e modo già parsato; None se fuori griglia."""
+        try:
+            return float(self.prezzi[self._i_dimensioni[(lunghezza_mm, larghezza_mm)],
+                                     self._i_quantita[quantita], self._i_modo[(bool(cmyk), strati_w)]])
+        except KeyError:
+            return None
+
+    def esporta_csv(self, percorso, separatore=";"):
+        virgola = separatore == ";"
+        with open(percorso, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f, delimiter=separatore)
+            w.writerow(["formato", "lunghezza_mm", "larghezza_mm", "quantita"] + list(self.modi)
+                       + ["versione_parametri", "parametri"])
+            for i, (nome, (lunghezza, larghezza)) in enumerate(self.formati.items()):
+                for j, q in enumerate(self.quantita):
+                    prezzi = [f"{p:.4f}".replace(".", ",") if virgola else f"{p:.4f}" for p in self.prezzi[i, j]]
+                    w.writerow([nome, lunghezza, larghezza, q] + prezzi + [self.versione, self.impronta])
+
+
+def _formati_da_testo(testo):
+    """'A4,SRA3,Banner=2000x1000' -> {nome: (lunghezza, larghezza)}; senza misure vale FORMATI_STANDARD."""
+    formati = {}
+    for voce in testo.split(","):
+        nome, _, misure = voce.strip().partition("=")
+        if not misure and nome in FORMATI_STANDARD:
+            formati[nome] = FORMATI_STANDARD[nome]
+            continue
+        lunghezza, _, larghezza = misure.lower().partition("x")
+        try:
+            formati[nome] = (int(lunghezza), int(larghezza))
+        except ValueError:
+            raise ValueError(f"formato non valido: {voce!r} (atteso NOME=LUNGHEZZAxLARGHEZZA in mm)") from None
+    return formati
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# CSV
+# ───────────────────────────────────────────────────────────────────────────────
+BLOCCO_CSV = 10000  # righe prezzate per chiamata batch (tra un blocco e l'altro i parametri si possono ricaricare)
+
+ALIAS_COLONNE = {
+    "lunghezza_mm": ("lunghezza_mm", "lunghezza", "length"),
+    "larghezza_mm": ("larghezza_mm", "larghezza", "width"),
+    "quantita": ("quantita", "quantità", "qta", "quantity"),
+    "modo": ("modo", "inchiostri", "mode"),
+}
+
+
+def _numero(testo, virgola_decimale):
+    """
+    Con la virgola decimale (CSV ';') i punti sono separatori delle migliaia solo
+    se c'è anche la virgola ("1.234,5"); senza virgola il punto resta decimale
+    ("297.5" = 297,5 mm, non 2975).
+    """
+    testo = (testo or "").strip()
+    if virgola_decimale and "," in testo:
+        testo = testo.replace(".", "").replace(",", ".")
+    try:
+        return float(testo)
+    except ValueError:
+        raise ValueError(f"valore non numerico: {testo!r}") from None
+
+
+def prezza_csv(percorso_in, percorso_out, parametri, blocco=BLOCCO_CSV):
+    """
+    Legge i lavori da `percorso_in`, li prezza in blocco e scrive `percorso_out`
+    con le colonne originali più quelle di Preventivo ed "errore".
+    Con separatore ';' (Excel italiano) i numeri usano la virgola decimale, in
+    lettura e in scrittura. Con un ArchivioParametri i parametri si rileggono a
+    ogni blocco di righe: versione_parametri dice con quali è stata prezzata
+    ciascuna. Ritorna (righe, righe con errore).
+    """
+    import numpy as np
+
+    with open(percorso_in, newline="", encoding="utf-8-sig") as f:
+        testo = f.read()
+    try:
+        separatore = csv.Sniffer().sniff(testo.splitlines()[0], delimiters=";,\t").delimiter
+    except (csv.Error, IndexError):
+        separatore = ","
+    virgola = separatore == ";"
+    righe = list(csv.DictReader(testo.splitlines(), delimiter=separatore))
+    intestazione = list(righe[0].keys()) if righe else []
+    mappa = {}
+    for campo, alias in ALIAS_COLONNE.items():
+        trovata = next((c for c in intestazione if c and c.strip().lower() in alias), None)
+        if trovata is None and campo != "modo":
+            raise ValueError(f"colonna '{campo}' mancante in {percorso_in}")
+        mappa[campo] = trovata
+
+    n = len(righe)
+    lunghezze, larghezze, quantita = np.zeros(n), np.zeros(n), np.zeros(n)
+    cmyk, strati = np.zeros(n, dtype=bool), np.zeros(n, dtype=int)
+    errori = [""] * n
+    for i, r in enumerate(righe):
+        try:
+            lunghezze[i] = _numero(r[mappa["lunghezza_mm"]], virgola)
+            larghezze[i] = _numero(r[mappa["larghezza_mm"]], virgola)
+            quantita[i] = _numero(r[mappa["quantita"]], virgola)
+            cmyk[i], strati[i] = parse_modo(r.get(mappa["modo"]) if mappa["modo"] else "")
+        except (ValueError, TypeError) as e:
+            errori[i] = str(e)
+            lunghezze[i] = 0  # riga scartata dal calcolo
+
+    risultati = {c: np.empty(n) for c in COLONNE_USCITA}
+    risultati["valido"] = np.zeros(n, dtype=bool)
+    versioni = [0] * n
+    for inizio in range(0, n, blocco):
+        fine = min(inizio + blocco, n)
+        correnti = parametri.correnti() if isinstance(parametri, ArchivioParametri) else parametri
+        parziali = calcola_costi_batch(correnti, lunghezze[inizio:fine], larghezze[inizio:fine],
+                                       quantita[inizio:fine], cmyk[inizio:fine], strati[inizio:fine])
+        for c in COLONNE_USCITA + ["valido"]:
+            risultati[c][inizio:fine] = parziali[c]
+        versioni[inizio:fine] = [parziali["versione_parametri"]] * (fine - inizio)
+
+    def formatta(v):
+        testo = f"{v:.6f}".rstrip("0").rstrip(".")
+        return testo.replace(".", ",") if virgola else testo
+
+    n_errori = 0
+    with open(percorso_out, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f, delimiter=separatore)
+        w.writerow(intestazione + COLONNE_USCITA + ["versione_parametri", "errore"])
+        for i, r in enumerate(righe):
+            valido = bool(risultati["valido"][i]) and not errori[i]
+            if not valido:
+                n_errori += 1
+                errori[i] = errori[i] or "misure e quantità devono essere maggiori di 0"
+            valori = [formatta(risultati[c][i]) if valido else "" for c in COLONNE_USCITA]
+            w.writerow([r.get(c, "") for c in intestazione] + valori + [versioni[i], errori[i]])
+    return n, n_errori
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Prezza in blocco un CSV di lavori di stampa o esporta il listino")
+    ap.add_argument("csv_lavori", nargs="?")
+    ap.add_argument("-o", "--output", help="CSV di uscita (default: <input>_prezzato.csv, listino.csv)")
+    ap.add_argument("--parametri", default=percorso_file_configurazione,
+                    help="file JSON dei parametri (default: quello di PrintKalculator)")
+    ap.add_argument("--listino", action="store_true", help="esporta la matrice formati × quantità × modi")
+    ap.add_argument("--formati", help="griglia formati, es. A4=297x210,A3=420x297 (default: standard)")
+    ap.add_argument("--quantita", help="griglia quantità, es. 1,10,100 (default: standard)")
+    ap.add_argument("--modi", help="griglia modi, es. 1W,2W,CMYK+2W (default: 1W-4W con e senza CMYK)")
+    args = ap.parse_args(argv)
+
+    if args.listino:
+        try:
+            listino = Listino(
+                carica_parametri(args.parametri),
+                formati=_formati_da_testo(args.formati) if args.formati else None,
+                quantita=[int(q) for q in args.quantita.split(",")] if args.quantita else QUANTITA_STANDARD,
+                modi=[m.strip() for m in args.modi.split(",")] if args.modi else MODI_STANDARD,
+            )
+            uscita = args.output or "listino.csv"
+            listino.esporta_csv(uscita)
+        except (OSError, ValueError) as e:
+            print(f"Errore: {e}", file=sys.stderr)
+            sys.exit(1)
+        print(f"listino {len(listino.formati)} formati × {len(listino.quantita)} quantità × "
+              f"{len(listino.modi)} modi in {uscita} (parametri v{listino.versione} {listino.impronta})")
+        return
+    if not args.csv_lavori:
+        ap.error("serve il CSV dei lavori oppure --listino")
+
+    uscita = args.output or os.path.splitext(args.csv_lavori)[0] + "_prezzato.csv"
+    try:
+        archivio = ArchivioParametri(args.parametri)
+        archivio.correnti()
+        if archivio.ultimo_errore:
+            raise archivio.ultimo_errore
+        n, n_errori = prezza_csv(args.csv_lavori, uscita, archivio)
+    except (OSError, ValueError) as e:
+        print(f"Errore: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(f"{n} lavori prezzati in {uscita}" + (f" ({n_errori} con errore)" if n_errori else ""))
+    sys.exit(3 if n_errori else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,7 +10,8 @@ a = Analysis(
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    # numpy serve solo a motore_costi.calcola_costi_batch (riga di comando), non alla finestra
+    excludes=['numpy'],
     noarchive=False,
 )
 pyz = PYZ(a.pure)
@@ -36,3 +37,41 @@ exe = EXE(
     entitlements_file=None,
     icon=['C:\\Users\\Simone\\Desktop\\Pk1.0\\assets\\PK.ico'],
 )
+
+# Preventivo da riga di comando (pk2.0-cli.exe --quote L W Q --mode 2W): console, senza Tk
+# né numpy, così l'eseguibile one-file ha poco da scompattare a ogni avvio.
+a_cli = Analysis(
+    ['pk2.0.py'],
+    pathex=[],
+    binaries=[],
+    datas=[],
+    hiddenimports=[],
+    hookspath=[],
+    hooksconfig={},
+    runtime_hooks=[],
+    excludes=['tkinter', 'finestra_pk', 'numpy'],
+    noarchive=False,
+)
+pyz_cli = PYZ(a_cli.pure)
+
+exe_cli = EXE(
+    pyz_cli,
+    a_cli.scripts,
+    a_cli.binaries,
+    a_cli.datas,
+    [],
+    name='pk2.0-cli',
+    debug=False,
+    bootloader_ignore_signals=False,
+    strip=False,
+    upx=True,
+    upx_exclude=[],
+    runtime_tmpdir=None,
+    console=True,
+    disable_windowed_traceback=False,
+    argv_emulation=False,
+    target_arch=None,
+    codesign_identity=None,
+    entitlements_file=None,
+    icon=['C:\\Users\\Simone\\Desktop\\Pk1.0\\assets\\PK.ico'],
+)
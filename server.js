@@ -22,6 +22,7 @@ const { spawn } = require('child_process');
 const TEMPLATE_DDT_PATH = path.join(__dirname, 'Template', 'DDT_Work.xlsx');
 const PYTHON_PATH = 'python'; // o 'python3'
 const MATERIALI_SCRIPT = 'C:\\Users\\Applicazioni\\Gestione Commesse\\FinestraMateriali.py';
+const MATERIALI_THREADS = String(process.env.MATERIALI_THREADS || 16); // thread del server WSGI dei materiali
 
 // ───────────────────────────────────────────────────────────────────────────────
 // Target automatico: mappa IP chiamante -> PC (da presence files degli agent)
@@ -76,7 +77,10 @@ try {
 
   if (!list.includes('finestramateriali.py')) {
     console.log('Avvio backend materiali Flask…');
-    const materialiProc = spawn(PYTHON_PATH, [MATERIALI_SCRIPT], { detached: false, stdio: 'ignore' });
+    // server WSGI multi-thread (waitress se installato); log con latenze in log_materiali.txt
+    const materialiProc = spawn(PYTHON_PATH, [MATERIALI_SCRIPT, '--threads', MATERIALI_THREADS], {
+      detached: false, stdio: 'ignore', windowsHide: true,
+    });
 
     materialiProc.on('error', (e) => {
       console.warn('[materiali] errore avvio:', e?.message || String(e));
@@ -389,68 +393,194 @@ app.post('/api/save-excel-report', (req, res) => {
 // ───────────────────────────────────────────────────────────────────────────────
 // DDT Excel via Python
 // ───────────────────────────────────────────────────────────────────────────────
-app.post('/api/genera-ddt-excel', (req, res) => {
+// Completa descrizione/nomeCommessa (da report.json o dai campi commessa) prima di passare a Python
+function arricchisciDatiDdt(datiDdtIn) {
+  let descrizione = (datiDdtIn.descrizione || '').trim();
+  let nomeCommessa = (datiDdtIn.nomeCommessa || '').trim();
+
+  const folderPath =
+    datiDdtIn.folderPath ||
+    datiDdtIn.percorso ||
+    (datiDdtIn.percorsoPdf && path.dirname(datiDdtIn.percorsoPdf) && path.dirname(path.dirname(datiDdtIn.percorsoPdf)));
+
+  if ((!descrizione || !nomeCommessa) && folderPath) {
+    try {
+      const reportFile = path.join(folderPath, 'report.json');
+      if (fs.existsSync(reportFile)) {
+        const rep = JSON.parse(fs.readFileSync(reportFile, 'utf8') || '{}');
+        const nomeCartella = rep?.brand && rep?.nomeProdotto && rep?.codiceProgetto && rep?.codiceCommessa
+          ? `${rep.brand}_${rep.nomeProdotto}_${rep.codiceProgetto}_${rep.codiceCommessa}` : '';
+        if (!descrizione) descrizione = nomeCartella ? `Assembraggio ${nomeCartella}` : '';
+        if (!nomeCommessa && nomeCartella) {
+          const m = String(descrizione || (`Assembraggio ${nomeCartella}`)).split('_');
+          if (m.length >= 3) nomeCommessa = m[1].trim();
+        }
+      }
+    } catch (e) { console.warn('[/api/genera-ddt-excel] Warning leggendo report.json:', e.toString()); }
+  }
+
+  if (!nomeCommessa && descrizione) {
+    const parti = String(descrizione).split('_'); if (parti.length >= 3) nomeCommessa = parti[1].trim();
+  }
+  if (!descrizione) {
+    const brand = (datiDdtIn.brand || '').trim();
+    const nomeProdotto = (datiDdtIn.nomeProdotto || '').trim();
+    const codiceProgetto = (datiDdtIn.codiceProgetto || '').trim();
+    const codiceCommessa = (datiDdtIn.codiceCommessa || '').trim();
+    const nomeCartella = (brand && nomeProdotto && codiceProgetto && codiceCommessa) ? `${brand}_${nomeProdotto}_${codiceProgetto}_${codiceCommessa}` : '';
+    descrizione = nomeCartella ? `Assembraggio ${nomeCartella}` : '';
+  }
+
+  return { ...datiDdtIn, descrizione, nomeCommessa };
+}
+
+// Worker Python residente (genera_excel_ddt.py --worker): evita il cold start per ogni bolla.
+// Protocollo: una riga JSON per job su stdin, una riga JSON di risposta su stdout.
+// Il timeout del job deve superare l'attesa del lock del workbook (stessa variabile letta da
+// genera_excel_ddt.py, che eredita l'ambiente) più il salvataggio: un job che aspetta il lock
+// correttamente non va ucciso e rifatto in one-shot (riga scritta due volte).
+const DDT_LOCK_TIMEOUT_S = Number(process.env.DDT_LOCK_TIMEOUT_S || 60);
+const DDT_MARGINE_SALVATAGGIO_S = 60;
+const DDT_WORKER_TIMEOUT_MS = (DDT_LOCK_TIMEOUT_S + DDT_MARGINE_SALVATAGGIO_S) * 1000;
+let ddtWorker = null;         // { proc, pending: Map<id, {resolve, reject, timer}> }
+let ddtWorkerNextId = 1;
+
+// un solo handler per tutta la vita del server: chiude il worker corrente, qualunque respawn sia
+process.on('exit', () => { try { ddtWorker?.proc.kill(); } catch {} });
+
+function getDdtWorker() {
+  if (ddtWorker) return ddtWorker;
+  const proc = spawn(PYTHON_PATH, [path.join(__dirname, 'genera_excel_ddt.py'), '--worker']);
+  const w = { proc, pending: new Map() };
+  let buffer = '';
+  proc.stdout.on('data', (d) => {
+    buffer += d.toString();
+    let nl;
+    while ((nl = buffer.indexOf('\n')) !== -1) {
+      const line = buffer.slice(0, nl).trim(); buffer = buffer.slice(nl + 1);
+      if (!line) continue;
+      let msg; try { msg = JSON.parse(line); } catch { continue; }
+      const p = w.pending.get(msg.id);
+      if (!p) continue;
+      clearTimeout(p.timer); w.pending.delete(msg.id); p.resolve(msg);
+    }
+  });
+  proc.stderr.on('data', () => {}); // log già scritto su log_ddt.txt
+  const chiudi = (err) => {
+    if (ddtWorker === w) ddtWorker = null;
+    for (const p of w.pending.values()) { clearTimeout(p.timer); p.reject(err); }
+    w.pending.clear();
+  };
+  proc.on('exit', (code) => chiudi(new Error(`DDT worker terminato (code ${code})`)));
+  proc.on('error', (e) => chiudi(e));
+  // EPIPE se il worker è morto o sta morendo: senza handler l'evento 'error' farebbe cadere node
+  proc.stdin.on('error', (e) => {
+    chiudi(new Error(`DDT worker stdin: ${e?.message || String(e)}`));
+    try { proc.kill(); } catch {}
+  });
+  ddtWorker = w;
+  return w;
+}
+
+function inviaJobDdtWorker(job) {
+  return new Promise((resolve, reject) => {
+    let w;
+    try { w = getDdtWorker(); } catch (e) { return reject(e); }
+    if (!w.proc.stdin.writable) {
+      if (ddtWorker === w) ddtWorker = null;
+      return reject(new Error('DDT worker non scrivibile'));
+    }
+    const id = ddtWorkerNextId++;
+    const timer = setTimeout(() => {
+      w.pending.delete(id);
+      reject(new Error('Timeout DDT worker'));
+      try { w.proc.kill(); } catch {}
+    }, DDT_WORKER_TIMEOUT_MS);
+    w.pending.set(id, { resolve, reject, timer });
+    w.proc.stdin.write(JSON.stringify({ ...job, id }) + '\n');
+  });
+}
+
+// Esecuzione classica: un processo Python per DDT (fallback se il worker non risponde)
+function generaDdtExcelOneShot(datiPerPython, reportDdtPath, res) {
+  const tempJsonPath = path.join(__dirname, 'data', `temp_ddt_${Date.now()}.json`);
+  fs.writeFileSync(tempJsonPath, JSON.stringify(datiPerPython, null, 2), 'utf8');
+
+  const pythonScript = path.join(__dirname, 'genera_excel_ddt.py');
+  const proc = spawn(PYTHON_PATH, [pythonScript, tempJsonPath, reportDdtPath]);
+
+  let stdoutData = '', stderrData = '';
+  proc.stdout?.on('data', d => { stdoutData += d.toString(); });
+  proc.stderr?.on('data', d => { stderrData += d.toString(); });
+
+  proc.on('exit', (code) => {
+    try { fs.unlinkSync(tempJsonPath); } catch {}
+    if (stdoutData.includes('NON aggiornato')) return res.status(409).json({ message: stdoutData.trim(), debug: stdoutData });
+    if (code === 0) return res.json({ message: 'Report Excel generato!', debug: stdoutData.trim() });
+    return res.status(500).json({ error: `Python script failed (code ${code})`, stderr: stderrData, stdout: stdoutData });
+  });
+
+  proc.on('error', (err) => {
+    try { fs.unlinkSync(tempJsonPath); } catch {}
+    res.status(500).json({ error: err.toString() });
+  });
+}
+
+app.post('/api/genera-ddt-excel', async (req, res) => {
   try {
     const reportDdtPath = req.body.reportDdtPath || req.body.reportDdtBasePath || req.body.basePath;
     const datiDdtIn = req.body.datiDdt || req.body;
     if (!reportDdtPath || !datiDdtIn) return res.status(400).json({ error: 'reportDdtPath e datiDdt sono obbligatori' });
 
-    let descrizione = (datiDdtIn.descrizione || '').trim();
-    let nomeCommessa = (datiDdtIn.nomeCommessa || '').trim();
+    const datiPerPython = arricchisciDatiDdt(datiDdtIn);
 
-    const folderPath =
-      datiDdtIn.folderPath ||
-      datiDdtIn.percorso ||
-      (datiDdtIn.percorsoPdf && path.dirname(datiDdtIn.percorsoPdf) && path.dirname(path.dirname(datiDdtIn.percorsoPdf)));
-
-    if ((!descrizione || !nomeCommessa) && folderPath) {
-      try {
-        const reportFile = path.join(folderPath, 'report.json');
-        if (fs.existsSync(reportFile)) {
-          const rep = JSON.parse(fs.readFileSync(reportFile, 'utf8') || '{}');
-          const nomeCartella = rep?.brand && rep?.nomeProdotto && rep?.codiceProgetto && rep?.codiceCommessa
-            ? `${rep.brand}_${rep.nomeProdotto}_${rep.codiceProgetto}_${rep.codiceCommessa}` : '';
-          if (!descrizione) descrizione = nomeCartella ? `Assembraggio ${nomeCartella}` : '';
-          if (!nomeCommessa && nomeCartella) {
-            const m = String(descrizione || (`Assembraggio ${nomeCartella}`)).split('_');
-            if (m.length >= 3) nomeCommessa = m[1].trim();
-          }
-        }
-      } catch (e) { console.warn('[/api/genera-ddt-excel] Warning leggendo report.json:', e.toString()); }
+    let esito;
+    try {
+      esito = await inviaJobDdtWorker({ basePath: reportDdtPath, dati: datiPerPython });
+    } catch (e) {
+      console.warn('[/api/genera-ddt-excel] worker non disponibile, uso processo singolo:', e?.message || String(e));
+      return generaDdtExcelOneShot(datiPerPython, reportDdtPath, res);
     }
 
-    if (!nomeCommessa && descrizione) {
-      const parti = String(descrizione).split('_'); if (parti.length >= 3) nomeCommessa = parti[1].trim();
-    }
-    if (!descrizione) {
-      const brand = (datiDdtIn.brand || '').trim();
-      const nomeProdotto = (datiDdtIn.nomeProdotto || '').trim();
-      const codiceProgetto = (datiDdtIn.codiceProgetto || '').trim();
-      const codiceCommessa = (datiDdtIn.codiceCommessa || '').trim();
-      const nomeCartella = (brand && nomeProdotto && codiceProgetto && codiceCommessa) ? `${brand}_${nomeProdotto}_${codiceProgetto}_${codiceCommessa}` : '';
-      descrizione = nomeCartella ? `Assembraggio ${nomeCartella}` : '';
+    if (esito.ok) return res.json({ message: 'Report Excel generato!', debug: JSON.stringify(esito) });
+    if (String(esito.error || '').includes('NON aggiornato')) return res.status(409).json({ message: esito.error, debug: JSON.stringify(esito) });
+    return res.status(500).json({ error: esito.error || 'Errore DDT worker', debug: JSON.stringify(esito) });
+  } catch (err) {
+    res.status(500).json({ error: err.toString() });
+  }
+});
+
+// Batch: più DDT in un solo processo Python, un load/save per workbook mensile
+app.post('/api/genera-ddt-excel-batch', (req, res) => {
+  try {
+    const reportDdtPath = req.body.reportDdtPath || req.body.reportDdtBasePath || req.body.basePath;
+    const lista = req.body.datiDdt;
+    if (!reportDdtPath || !Array.isArray(lista) || !lista.length) {
+      return res.status(400).json({ error: 'reportDdtPath e datiDdt (array) sono obbligatori' });
     }
 
-    const datiPerPython = { ...datiDdtIn, descrizione, nomeCommessa };
-    const tempJsonPath = path.join(__dirname, 'data', `temp_ddt_${Date.now()}.json`);
-    fs.writeFileSync(tempJsonPath, JSON.stringify(datiPerPython, null, 2), 'utf8');
+    const tempJsonlPath = path.join(__dirname, 'data', `temp_ddt_batch_${Date.now()}.jsonl`);
+    fs.writeFileSync(tempJsonlPath, lista.map(d => JSON.stringify(arricchisciDatiDdt(d))).join('\n'), 'utf8');
 
     const pythonScript = path.join(__dirname, 'genera_excel_ddt.py');
-    const proc = spawn(PYTHON_PATH, [pythonScript, tempJsonPath, reportDdtPath]);
+    const proc = spawn(PYTHON_PATH, [pythonScript, '--batch', tempJsonlPath, reportDdtPath]);
 
     let stdoutData = '', stderrData = '';
     proc.stdout?.on('data', d => { stdoutData += d.toString(); });
     proc.stderr?.on('data', d => { stderrData += d.toString(); });
 
     proc.on('exit', (code) => {
-      try { fs.unlinkSync(tempJsonPath); } catch {}
-      if (stdoutData.includes('NON aggiornato')) return res.status(409).json({ message: stdoutData.trim(), debug: stdoutData });
-      if (code === 0) return res.json({ message: 'Report Excel generato!', debug: stdoutData.trim() });
-      return res.status(500).json({ error: `Python script failed (code ${code})`, stderr: stderrData, stdout: stdoutData });
+      try { fs.unlinkSync(tempJsonlPath); } catch {}
+      // il report JSON è l'ultima riga di stdout
+      const righe = stdoutData.trim().split(/\r?\n/);
+      let report = null;
+      try { report = JSON.parse(righe[righe.length - 1]); } catch {}
+      if (!report) return res.status(500).json({ error: `Python script failed (code ${code})`, stderr: stderrData, stdout: stdoutData });
+      return res.status(report.errori ? 207 : 200).json(report);
     });
 
     proc.on('error', (err) => {
-      try { fs.unlinkSync(tempJsonPath); } catch {}
+      try { fs.unlinkSync(tempJsonlPath); } catch {}
       res.status(500).json({ error: err.toString() });
     });
   } catch (err) {